@@ -0,0 +1,3 @@
+from quickscope import app
+
+app.start()
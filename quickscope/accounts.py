@@ -0,0 +1,79 @@
+import concurrent.futures
+from collections import namedtuple
+import quickscope.session
+
+# Several Mojang accounts sniping the same name from one slave. Each account
+# has its own login and rename tokens; their requests share one schedule.
+
+# One account: Mojang username (email) and password, and the UUID of the
+# Minecraft profile to rename
+Account = namedtuple('Account', ['username', 'password', 'uuid'])
+
+# Default number of accounts logged in at once
+DEFAULT_WORKERS = 8
+
+def load_accounts(path):
+    """Reads accounts from a file with one 'email:password:uuid' line per
+    account (the password may contain colons). Blank lines and lines
+    starting with '#' are ignored.
+
+    Returns a list of Accounts. Raises ValueError on a malformed line.
+    """
+
+    accounts = []
+    with open(path) as f:
+        for (number, line) in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            (username, _, rest) = line.partition(':')
+            (password, _, uuid) = rest.rpartition(':')
+            if not username or not uuid:
+                raise ValueError('{}:{}: expected \'email:password:uuid\''.format(path, number))
+            accounts.append(Account(username, password, uuid.replace('-', '')))
+    return accounts
+
+def merge(primary, others):
+    """Returns `primary` followed by every account of `others` with a
+    different username.
+    """
+
+    seen = set(account.username.lower() for account in primary)
+    result = list(primary)
+    for account in others:
+        if account.username.lower() not in seen:
+            seen.add(account.username.lower())
+            result.append(account)
+    return result
+
+def login_all(accounts, store = None, workers = DEFAULT_WORKERS):
+    """Logs every account in at once (or reuses its stored login; see
+    quickscope.session).
+
+    Keyword arguments:
+    accounts -- List of Accounts
+    store -- (optional) quickscope.session.SessionStore for the logins
+    workers -- (optional) Number of accounts logged in at once
+
+    Returns a list of (account, session) tuples for the accounts that logged
+    in, in the order given. Failures are printed.
+    """
+
+    sessions = [ quickscope.session.Session(account.username, account.password, store) for account in accounts ]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(workers, len(accounts)))) as executor:
+        results = list(executor.map(lambda session: session.cookies(), sessions))
+    return logged_in(accounts, sessions, results)
+
+def logged_in(accounts, sessions, results):
+    """Returns a list of (account, session) tuples for the accounts whose
+    login `results` (cookies, or None) succeeded. Failures are printed.
+    """
+
+    logged_in = []
+    for (account, session, cookies) in zip(accounts, sessions, results):
+        if cookies is None:
+            print('Failed to login as {}: {}'.format(account.username, session.error))
+        else:
+            logged_in.append((account, session))
+    return logged_in
@@ -1,18 +1,16 @@
 import argparse
 import os
+import socket
 
-import quickscope.mojang
-import quickscope.slave
-import quickscope.master
+# Modules are imported by the functions that use them, so that each mode
+# only pays for its own (e.g. a slave never imports the master's placement
+# or the name cache's sqlite3)
 
 # Environment variables
 ENV_MOJANG_EMAIL = 'MOJANG_EMAIL'
 ENV_MOJANG_PASS = 'MOJANG_PASS'
 ENV_DO_KEY = 'DO_KEY'
 
-# Seconds that a username is held by Mojang for after 'expiry' (37 days)
-USERNAME_HOLDING_TIME = 37 * 24 * 60 * 60
-
 def int_range(lower, upper):
     def validator(string):
         value = 0
@@ -37,34 +35,176 @@ def int_list(string):
     return ints
             
 
+def clock_samples(string):
+    # 0 disables calibration; fewer than clock.MIN_SAMPLES are never trusted
+    from quickscope import clock
+
+    value = int_range(0, 100)(string)
+    if 0 < value < clock.MIN_SAMPLES:
+        raise argparse.ArgumentTypeError('at least {} samples are needed to calibrate the clock'.format(clock.MIN_SAMPLES))
+    return value
+
+def float_list(string):
+    floats = []
+    for part in string.split(','):
+        try:
+            floats.append(float(part.strip()))
+        except ValueError:
+            raise argparse.ArgumentTypeError('invalid float value: \'{}\''.format(part))
+    return floats
+
+def add_slave_arguments(parser):
+    # Arguments shared by slave and bench modes
+    from quickscope import clock, latency
+
+    parser.add_argument('-c', '--variance', type=int, default=0, help='variance in milliseconds for when to send the request; can be negative (default: 0)')
+    parser.add_argument('-r', '--requests', type=int, default=5, help='number of requests to send with INTERVAL between them, starting at EXPIRY - latency + VARIANCE + INTERVAL * i (default: 5)')
+    parser.add_argument('-i', '--interval', type=int, default=20, help='interval in milliseconds between each request. (default: 20)')
+    parser.add_argument('-l', '--latency-estimate', choices=sorted(latency.ESTIMATES), default='send-mean', help='latency statistic to subtract from the fire time; \'one-way\' estimates are half the time to first byte (default: send-mean)')
+    parser.add_argument('--clock-samples', type=clock_samples, default=clock.DEFAULT_SAMPLES, help='number of requests (at least {}) used to calibrate our clock against the Mojang server\'s Date headers; 0 to disable (default: {})'.format(clock.MIN_SAMPLES, clock.DEFAULT_SAMPLES))
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads', help='run requests on threads, or on a single asyncio event loop (default: threads)')
+    parser.add_argument('--offsets', type=float_list, help='comma-separated list of offsets in milliseconds (after availability) to aim each request at, instead of VARIANCE, INTERVAL and REQUESTS')
+    parser.add_argument('--plan-window', type=float, help='spread the REQUESTS requests to maximise the chance that one arrives within this many milliseconds after availability, based on the measured latency and clock spread')
+    parser.add_argument('--hot-window', action='store_true', help='from a couple of seconds before the first request until just after the last, disable garbage collection and hold back printing and tracing, and report how late requests are dispatched before and during that window (threads engine only)')
+    parser.add_argument('--priority', action='store_true', help='with --hot-window, raise the priority of the thread that fires requests (needs permission, e.g. root)')
+    parser.add_argument('--cpu', type=int, help='with --hot-window, pin the thread that fires requests to this CPU')
+    parser.add_argument('--trace', help='append a JSON record of every request (including the timing of each rename attempt) to this file')
+
+def pin_endpoints(enabled):
+    # Resolve the Mojang hosts now, rather than when connecting, and keep
+    # them up to date in the background
+    from quickscope import mojang
+
+    mojang.RESOLVER.configure(enabled=enabled)
+    if enabled:
+        mojang.RESOLVER.prefetch(mojang.endpoints())
+        mojang.RESOLVER.start()
+
 def start():
+    from quickscope import pool, ratelimit, session
+
     parser = argparse.ArgumentParser(description='Snipes OG Minecraft usernames')
-    parser.add_argument('target', help='username of Minecraft account to snipe')
-    parser.add_argument('uuid', help='UUID of Minecraft account associated with Mojang account')
     parser.add_argument('-u', '--username', help='username (email) of Mojang account to use; if not set, use the environment variable MOJANG_EMAIL')
     parser.add_argument('-p', '--password', help='password of Mojang account to use; if not set, use the environment variable MOJANG_PASS')
+    parser.add_argument('--pool-size', type=int_range(1, 100), default=pool.DEFAULT_SIZE, help='maximum number of idle keep-alive connections kept per Mojang host (default: {})'.format(pool.DEFAULT_SIZE))
+    parser.add_argument('--rate-state', default=ratelimit.DEFAULT_STATE_DIR, help='directory in which request budgets are shared with other quickscope processes (default: {})'.format(ratelimit.DEFAULT_STATE_DIR))
+    parser.add_argument('--no-rate-limit', action='store_true', help='do not limit the rate of requests to Mojang')
+    parser.add_argument('--no-pin', action='store_true', help='resolve Mojang hosts whenever connecting, instead of once at startup (pinned to the fastest address)')
+    parser.add_argument('--endpoint', help='send every Mojang request over plain HTTP to HOST:PORT instead, e.g. a local stand-in server for testing')
+    parser.add_argument('--metrics', metavar='HOST[:PORT]', help='serve metrics in the Prometheus text format on HOST:PORT (default port: 9456), e.g. 127.0.0.1')
     
     subparsers = parser.add_subparsers(dest='mode')
 
     # Define arguments for slave mode
     slave_parser = subparsers.add_parser('slave', help='slave mode')
+    slave_parser.add_argument('target', help='username of Minecraft account to snipe')
+    slave_parser.add_argument('uuid', help='UUID of Minecraft account associated with Mojang account')
     slave_parser.add_argument('expiry', type=int, help='UNIX timestamp (seconds) of when username \'expired\' (required)')
-    slave_parser.add_argument('-c', '--variance', type=int, default=0, help='variance in milliseconds for when to send the request; can be negative (default: 0)')
-    slave_parser.add_argument('-r', '--requests', type=int, default=5, help='number of requests to send with INTERVAL between them, starting at EXPIRY - latency + VARIANCE + INTERVAL * i (default: 5)')
-    slave_parser.add_argument('-i', '--interval', type=int, default=20, help='interval in milliseconds between each request. (default: 20)')
+    add_slave_arguments(slave_parser)
+    slave_parser.add_argument('--master', help='HOST[:PORT] of the master\'s control channel, to register with, take the schedule from and report results to')
+    slave_parser.add_argument('--name', default=socket.gethostname(), help='name to register with the master as (default: this machine\'s hostname)')
+    slave_parser.add_argument('--accounts', help='file of further Mojang accounts to snipe with, one \'email:password:uuid\' per line; they log in together and take turns along the same schedule of requests')
+    slave_parser.add_argument('--sessions', default=session.DEFAULT_PATH, help='file in which to keep the login between runs (default: {})'.format(session.DEFAULT_PATH))
+    slave_parser.add_argument('--no-sessions', dest='sessions', action='store_const', const=None, help='always log in afresh, and do not store the login')
+    slave_parser.add_argument('--token', help='shared secret for the master\'s control channel')
 
     # Define arguments for master mode
     master_parser = subparsers.add_parser('master', help='master mode')
-    master_parser.add_argument('-s', '--snapshot', type=int, help='snapshot ID to use to spawn droplets from', required=True)
+    master_parser.add_argument('target', help='username of Minecraft account to snipe')
+    master_parser.add_argument('uuid', help='UUID of Minecraft account associated with Mojang account')
+    master_parser.add_argument('-s', '--snapshot', type=int, help='snapshot ID to use to spawn droplets from (required with the digitalocean backend)')
+    master_parser.add_argument('--backend', choices=['digitalocean', 'local'], default='digitalocean', help='where to run the slaves: on DigitalOcean droplets, or as processes on this machine spread across its CPUs, e.g. to load-test against \'quickscope fake-server\' (default: digitalocean)')
+    master_parser.add_argument('--log-dir', help='with the local backend, directory in which to keep each slave\'s output (default: ~/.quickscope/workers)')
     master_parser.add_argument('-d', '--droplets', type=int_range(1, 25), help='number of droplets to spawn (default: 5, maximum: 25)', default=5)
     master_parser.add_argument('-k', '--api-key', help='DigitalOcean API key; if not set, use the environment variable DO_KEY')
     master_parser.add_argument('-c', '--variances', type=int, nargs='+', default=[0], help='comma-separated list of variances for each droplet (default: 0 for all)')
+    master_parser.add_argument('--latency-table', help='JSON file of latency measurements to the Mojang servers per region, as {"region": {"mean": ms, "stddev": ms}}, used to choose where to place droplets (default: all in ams2)')
+    master_parser.add_argument('--window', type=int, nargs=2, metavar=('START', 'END'), help='spread the droplets\' variances (ms) evenly over this window instead of using VARIANCES')
+    master_parser.add_argument('--size', help='droplet size (default: 512mb)')
+    master_parser.add_argument('--max-per-region', type=int, help='maximum number of droplets per region')
+    master_parser.add_argument('--plan', help='where to store the placement plan (default: ~/.quickscope/plan.json)')
+    master_parser.add_argument('--control', metavar='HOST[:PORT]', help='address (reachable from the droplets) on which to run a control channel; slaves register on it, report their results and are cancelled early once one succeeds')
+    master_parser.add_argument('--plan-window', type=float, help='with a control channel, have every slave measure its arrival error and plan all slaves\' fire times together so as to maximise the chance that one request lands within this many milliseconds after availability')
+    master_parser.add_argument('--budget', type=int, help='total number of requests shared between slaves by --plan-window (default: 5 per droplet)')
+    master_parser.add_argument('--prep-time', type=int, help='seconds before the username becomes available to create the droplets (default: 30 minutes)')
+    master_parser.add_argument('--queue', help='file of further usernames to snipe after TARGET, one per line, soonest available first, until one is claimed; needs --control. Droplets are kept warm and handed the next username rather than created afresh for each')
+    master_parser.add_argument('--idle-ttl', type=int, help='with --queue, seconds a droplet may wait idle for its next username before it is destroyed (default: 45 minutes)')
+    master_parser.add_argument('--cache', help='path of the cache of Mojang API results (default: ~/.quickscope/names.sqlite)')
+    master_parser.add_argument('--no-cache', action='store_true', help='do not cache Mojang API results')
+
+    # Define arguments for watch mode
+    watch_parser = subparsers.add_parser('watch', help='keep a calendar of when a list of usernames become available', description='Keeps a calendar of when a list of usernames become available')
+    watch_parser.add_argument('names', help='file of usernames to watch, one per line')
+    watch_parser.add_argument('--calendar', help='path of the calendar database (default: ~/.quickscope/calendar.sqlite)')
+    watch_parser.add_argument('-w', '--workers', type=int_range(1, 64), help='number of names to resolve at once (default: 8)')
+    watch_parser.add_argument('-r', '--refresh', type=int, help='seconds after which a calendar entry is re-resolved (default: 6 hours)')
+    watch_parser.add_argument('-n', '--limit', type=int, default=0, help='show only the next LIMIT names to become available (default: all)')
+    watch_parser.add_argument('--cache', help='path of the cache of Mojang API results (default: ~/.quickscope/names.sqlite)')
+    watch_parser.add_argument('--no-cache', action='store_true', help='do not cache Mojang API results')
+
+    # Define arguments for bench mode
+    bench_parser = subparsers.add_parser('bench', help='benchmark a slave against a local stand-in for the Mojang servers', description='Runs a slave against a local stand-in for the Mojang servers and reports how far from its target time each request arrived')
+    bench_parser.add_argument('-L', '--latency', type=int, default=20, help='simulated round-trip time in milliseconds (default: 20)')
+    bench_parser.add_argument('-j', '--jitter', type=int, default=2, help='maximum random variation of each half of the round trip, in milliseconds (default: 2)')
+    bench_parser.add_argument('-s', '--skew', type=int, default=0, help='milliseconds the server\'s clock is ahead of ours; can be negative (default: 0)')
+    bench_parser.add_argument('--lead', type=int, default=40, help='seconds from now until the name becomes available (default: 40)')
+    bench_parser.add_argument('--prepare-time', type=int, default=10, help='seconds before firing that each request is prepared (default: 10)')
+    bench_parser.add_argument('-v', '--verbose', action='store_true', help='log every request the server receives')
+    add_slave_arguments(bench_parser)
+
+    # Define arguments for fake-server mode
+    fake_parser = subparsers.add_parser('fake-server', help='run a local stand-in for the Mojang servers on its own', description='Runs a local stand-in for the Mojang servers on its own, e.g. for a master with the local backend to snipe from, and reports when each rename arrived')
+    fake_parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    fake_parser.add_argument('--port', type=int, default=0, help='port to listen on (default: any free port)')
+    fake_parser.add_argument('--target', help='name to be sniped (default: BenchName)')
+    fake_parser.add_argument('--lead', type=int, default=300, help='seconds from now until the name becomes available (default: 300)')
+    fake_parser.add_argument('--duration', type=int, help='seconds to run for (default: until interrupted)')
+    fake_parser.add_argument('-L', '--latency', type=int, default=20, help='simulated round-trip time in milliseconds (default: 20)')
+    fake_parser.add_argument('-j', '--jitter', type=int, default=2, help='maximum random variation of each half of the round trip, in milliseconds (default: 2)')
+    fake_parser.add_argument('-s', '--skew', type=int, default=0, help='milliseconds the server\'s clock is ahead of ours; can be negative (default: 0)')
+    fake_parser.add_argument('-v', '--verbose', action='store_true', help='log every request the server receives')
+
+    # Define arguments for timing-bench mode
+    timing_parser = subparsers.add_parser('timing-bench', help='measure how accurately callbacks fire with each timing strategy', description='Measures how accurately callbacks fire with each timing strategy')
+    timing_parser.add_argument('-s', '--strategy', dest='strategies', action='append', help='strategy to measure (precise-timer, scheduler, sleep, hybrid or, where available, clock-nanosleep); can be repeated (default: all)')
+    timing_parser.add_argument('-n', '--count', type=int, help='number of callbacks per strategy (default: 1000)')
+    timing_parser.add_argument('-t', '--concurrency', type=int_range(1, 1000), help='number of callbacks (and so, for most strategies, threads) pending at once (default: 20)')
+    timing_parser.add_argument('--min-delay', type=int, help='shortest delay in milliseconds (default: 50)')
+    timing_parser.add_argument('--max-delay', type=int, help='longest delay in milliseconds (default: 500)')
+    timing_parser.add_argument('--load-threads', type=int, default=0, help='number of busy background threads competing for the interpreter (default: 0)')
+    timing_parser.add_argument('--load-processes', type=int, default=0, help='number of busy background processes competing for CPUs (default: 0)')
+    timing_parser.add_argument('--seed', type=int, help='seed for the random delays, so runs can be compared')
+    timing_parser.add_argument('--json', help='also write the results as JSON to this file (\'-\' for standard output)')
+
+    # Define arguments for zipapp mode
+    zipapp_parser = subparsers.add_parser('zipapp', help='package quickscope as a single runnable file', description='Packages quickscope as a single runnable file, e.g. to copy to droplets')
+    zipapp_parser.add_argument('target', nargs='?', help='path of the file to write (default: quickscope.pyz)')
+    zipapp_parser.add_argument('--interpreter', help='interpreter to run the file with when executed directly (default: /usr/bin/env python3)')
+    zipapp_parser.add_argument('--compile', action='store_true', help='include bytecode for this Python version, so that it starts faster where the same version runs it')
+    zipapp_parser.add_argument('--compress', action='store_true', help='compress the file (smaller, but slower to start)')
 
     args = parser.parse_args()
+
+    # Only slave and master modes need a target and an account
+    if args.mode == 'watch':
+        start_watch(args)
+        return
+    if args.mode == 'bench':
+        start_bench(args)
+        return
+    if args.mode == 'fake-server':
+        start_fake_server(args)
+        return
+    if args.mode == 'timing-bench':
+        start_timing_bench(args)
+        return
+    if args.mode == 'zipapp':
+        start_zipapp(args)
+        return
     
     username = args.username if args.username else os.getenv(ENV_MOJANG_EMAIL)
     password = args.password if args.password else os.getenv(ENV_MOJANG_PASS)
-    api_key = args.api_key if args.api_key else os.getenv(ENV_DO_KEY)
+    api_key = getattr(args, 'api_key', None) or os.getenv(ENV_DO_KEY) # Only master mode takes a key
 
     # Ensure we have a Mojang username 
     if not username or not password:
@@ -72,24 +212,82 @@ def start():
         parser.print_help()
         return
 
-    # Ensure we have a DO key if in master mode
-    if args.mode == 'master' and not api_key:
+    # Ensure we have a DO key and snapshot if creating droplets
+    if args.mode == 'master' and args.backend == 'digitalocean' and not api_key:
         print('error: missing DigitalOcean API key')
         parser.print_help()
         return
+    if args.mode == 'master' and args.backend == 'digitalocean' and args.snapshot is None:
+        print('error: missing snapshot ID (--snapshot)')
+        parser.print_help()
+        return
 
-    # Call appropriate start routine
+    from quickscope import control, metrics, mojang
+
+    mojang.POOLS.configure(size=args.pool_size)
+    mojang.LIMITER.configure(state_dir=args.rate_state, enabled=not args.no_rate_limit)
+    if args.endpoint:
+        (host, port) = control.parse_address(args.endpoint, 80)
+        mojang.set_endpoints(False, host, port)
+    pin_endpoints(not args.no_pin)
+    if args.metrics:
+        server = metrics.serve(control.parse_address(args.metrics, metrics.DEFAULT_PORT))
+        print('Serving metrics on http://{}:{}/metrics'.format(*server.server_address[:2]))
     if args.mode == 'slave':
-        quickscope.slave.start(args, username, password)
+        from quickscope import trace
+        trace.TRACER.configure(args.trace)
+
+    # Call appropriate start routine
+    if args.mode == 'slave' and args.engine == 'asyncio':
+        # Imported here so that the threads engine does not load asyncio
+        from quickscope import slave_async
+        slave_async.start(args, username, password)
+    elif args.mode == 'slave':
+        from quickscope import slave
+        slave.start(args, username, password)
     elif args.mode == 'master':
-        quickscope.master.start(args, username, password, api_key)
+        from quickscope import master
+        master.start(args, username, password, api_key)
     else:
         print('error: missing mode')
         parser.print_help()
 
+def start_watch(args):
+    from quickscope import mojang, watch
+
+    mojang.POOLS.configure(size=args.pool_size)
+    mojang.LIMITER.configure(state_dir=args.rate_state, enabled=not args.no_rate_limit)
+    pin_endpoints(not args.no_pin)
+    watch.start(args)
+
+def start_bench(args):
+    from quickscope import bench, trace
+
+    trace.TRACER.configure(args.trace)
+    bench.start(args)
+
+def start_fake_server(args):
+    from quickscope import bench
+
+    bench.serve(args)
+
+def start_timing_bench(args):
+    from quickscope import timingbench
+
+    timingbench.start(args)
+
+def start_zipapp(args):
+    from quickscope import package
+
+    target = args.target or package.DEFAULT_TARGET
+    size = package.build(target, args.interpreter or package.DEFAULT_INTERPRETER, args.compile, args.compress)
+    print('Wrote {} ({} bytes); run it with \'python {} ...\''.format(target, size, target))
+
 def start_master(args, username, password):
+    from quickscope import mojang
+
     print('Checking remaining time until \'{}\' becomes free...'.format(username))
-    expiry = quickscope.mojang.get_free_time(args.target)
+    expiry = mojang.get_free_time(args.target)
 
     if expiry is None:
         print('Error: username is not free.')
@@ -0,0 +1,158 @@
+import argparse
+import time
+import quickscope.app
+import quickscope.fakeserver
+import quickscope.mojang
+import quickscope.slave
+
+# End-to-end benchmark: runs a full slave cycle against a local
+# quickscope.fakeserver and reports how far from its target time each
+# rename request arrived.
+
+# Credentials of the stand-in account
+EMAIL = 'bench@quickscope.local'
+PASSWORD = 'quickscope'
+UUID = '0123456789abcdef0123456789abcdef'
+TARGET = 'BenchName'
+
+def aims(args):
+    """Returns the offsets (seconds after availability) the slave was told
+    to aim its requests at. Planned offsets (--plan-window) are not known
+    in advance, so arrivals are then measured from availability itself.
+    """
+
+    if args.offsets is not None:
+        return sorted(offset / 1000 for offset in args.offsets)
+    if args.plan_window:
+        return [ 0 ] * args.requests
+    return [ (args.variance + args.interval * i) / 1000 for i in range(args.requests) ]
+
+def errors(arrivals, available, offsets):
+    """Matches rename arrivals (sorted by server time) to the times they
+    were aimed at: available + offsets[i], by the server's clock.
+
+    Returns a list of (request index, intended time, arrival, error in
+    seconds) tuples.
+    """
+
+    arrivals = sorted(arrivals, key=lambda arrival: arrival.server)
+    result = []
+    for (i, (arrival, offset)) in enumerate(zip(arrivals, offsets)):
+        intended = available + offset
+        result.append((i, intended, arrival, arrival.server - intended))
+    return result
+
+def format_report(rows, window = None):
+    """Returns a human-readable report of the rows returned by errors(),
+    with how many landed within `window` milliseconds after their
+    intended time if it is given.
+    """
+
+    lines = [ '{:>3} {:>10} {:>6}'.format('#', 'error (ms)', 'status') ]
+    for (i, intended, arrival, error) in rows:
+        lines.append('{:>3} {:>+10.2f} {:>6}'.format(i, error * 1000, arrival.status))
+
+    values = sorted(error for (_, _, _, error) in rows)
+    if values:
+        mean = sum(values) / len(values)
+        lines.append('mean {:+.2f}ms, min {:+.2f}ms, max {:+.2f}ms, worst |error| {:.2f}ms'.format(
+            mean * 1000, values[0] * 1000, values[-1] * 1000, max(abs(value) for value in values) * 1000))
+    if window is not None:
+        lines.append('{} of {} landed within {}ms'.format(len([ value for value in values if 0 <= value * 1000 <= window ]), len(rows), window))
+    return '\n'.join(lines)
+
+def start(args):
+    # The name becomes available `lead` seconds from now by the server's clock
+    skew = args.skew / 1000
+    expiry = int(time.time() + skew + args.lead) - quickscope.mojang.USERNAME_HOLDING_TIME
+    available = expiry + quickscope.mojang.USERNAME_HOLDING_TIME
+
+    mojang = quickscope.fakeserver.FakeMojang(EMAIL, PASSWORD, UUID, TARGET, expiry, available,
+                                              latency=args.latency / 1000, jitter=args.jitter / 1000, skew=skew)
+    server = quickscope.fakeserver.FakeMojangServer(mojang, verbose=args.verbose)
+    server.start()
+
+    (host, port) = server.address
+    quickscope.mojang.set_endpoints(False, host, port)
+    quickscope.app.pin_endpoints(True)
+    quickscope.mojang.LIMITER.configure(enabled=False)
+    quickscope.slave.SnipeThread.PREPARE_TIME = args.prepare_time
+    print('Stand-in server on {}:{}; name available in {}s (latency {}ms, jitter {}ms, skew {}ms)'.format(host, port, args.lead, args.latency, args.jitter, args.skew))
+
+    slave_args = argparse.Namespace(expiry=expiry,
+                                    uuid=UUID,
+                                    target=TARGET,
+                                    variance=args.variance,
+                                    requests=args.requests,
+                                    interval=args.interval,
+                                    latency_estimate=args.latency_estimate,
+                                    clock_samples=args.clock_samples,
+                                    engine=args.engine,
+                                    offsets=args.offsets,
+                                    plan_window=args.plan_window,
+                                    hot_window=args.hot_window,
+                                    priority=args.priority,
+                                    cpu=args.cpu,
+                                    sessions=None,
+                                    accounts=None,
+                                    master=None)
+
+    if args.engine == 'asyncio':
+        from quickscope import slave_async
+        slave_async.PREPARE_TIME = args.prepare_time
+        slave_async.start(slave_args, EMAIL, PASSWORD)
+    else:
+        quickscope.slave.start(slave_args, EMAIL, PASSWORD)
+
+    # Wait for every rename to arrive (or give up a while after the window)
+    deadline = available - skew + max(aims(args) + [ args.interval / 1000 * args.requests ]) + 10
+    while time.time() < deadline:
+        if len([ arrival for arrival in mojang.arrivals if arrival.new_name == TARGET ]) >= len(aims(args)):
+            break
+        time.sleep(0.1)
+
+    # Give the slave's response threads a moment to print before reporting
+    time.sleep(args.latency / 1000 + 0.5)
+
+    offsets = aims(args)
+    rows = errors([ arrival for arrival in mojang.arrivals if arrival.new_name == TARGET ], available, offsets)
+    print(format_report(rows, args.plan_window))
+    if len(rows) < len(offsets):
+        print('Only {} of {} requests arrived.'.format(len(rows), len(offsets)))
+
+    server.stop()
+
+def serve(args):
+    """Runs a stand-in server on its own, e.g. for a master and its local
+    workers to snipe from (see quickscope.provision.LocalProvider), until
+    interrupted or for args.duration seconds. Then reports when each rename
+    arrived relative to availability.
+    """
+
+    target = args.target or TARGET
+    skew = args.skew / 1000
+    expiry = int(time.time() + skew + args.lead) - quickscope.mojang.USERNAME_HOLDING_TIME
+    available = expiry + quickscope.mojang.USERNAME_HOLDING_TIME
+
+    mojang = quickscope.fakeserver.FakeMojang(EMAIL, PASSWORD, UUID, target, expiry, available,
+                                              latency=args.latency / 1000, jitter=args.jitter / 1000, skew=skew)
+    server = quickscope.fakeserver.FakeMojangServer(mojang, args.host, args.port, verbose=args.verbose)
+    server.start()
+
+    (host, port) = server.address
+    print('Stand-in server on {}:{}; \'{}\' available in {}s (latency {}ms, jitter {}ms, skew {}ms)'.format(host, port, target, args.lead, args.latency, args.jitter, args.skew))
+    print('Account: {} (password {}), profile UUID {}'.format(EMAIL, PASSWORD, UUID))
+
+    try:
+        if args.duration is None:
+            while True:
+                time.sleep(1)
+        else:
+            time.sleep(args.duration)
+    except KeyboardInterrupt:
+        pass
+
+    arrivals = [ arrival for arrival in mojang.arrivals if arrival.new_name == target ]
+    print(format_report(errors(arrivals, available, [ 0 ] * len(arrivals))))
+    print('Name claimed by {}'.format(mojang.claimed_by) if mojang.claimed_by else 'Name not claimed')
+    server.stop()
@@ -0,0 +1,149 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Default location of the on-disk cache
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.quickscope', 'names.sqlite')
+
+# Seconds for which a cached name history is fresh
+DEFAULT_HISTORY_TTL = 60 * 60
+
+# Seconds for which a cached (username, timestamp) -> UUID lookup is fresh
+DEFAULT_UUID_AT_TTL = 60 * 60
+
+# Maximum number of rows kept in each table; the least recently used rows
+# are evicted beyond this
+DEFAULT_MAX_ENTRIES = 100000
+
+# Number of writes between checks of the table sizes
+EVICT_INTERVAL = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS names (
+    uuid     TEXT PRIMARY KEY,
+    history  TEXT NOT NULL,
+    fetched  REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS uuid_at (
+    username  TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    status    INTEGER NOT NULL,
+    uuid      TEXT,
+    fetched   REAL NOT NULL,
+    accessed  REAL NOT NULL,
+    PRIMARY KEY (username, timestamp)
+);
+CREATE INDEX IF NOT EXISTS names_accessed ON names (accessed);
+CREATE INDEX IF NOT EXISTS uuid_at_accessed ON uuid_at (accessed);
+"""
+
+class NameCache:
+    """An sqlite-backed cache of Mojang API results: UUID -> name history,
+    and (username, timestamp) -> UUID. Entries expire after a TTL, and each
+    table is kept to at most `max_entries` rows by evicting the least
+    recently used ones.
+
+    The cache may be shared between threads.
+
+    Keyword arguments:
+    path -- Path of the sqlite database (created if missing), or ':memory:'
+    history_ttl -- (optional) Seconds for which name histories are fresh
+    uuid_at_ttl -- (optional) Seconds for which UUID lookups are fresh
+    max_entries -- (optional) Maximum number of rows per table
+    """
+
+    def __init__(self, path = DEFAULT_PATH, history_ttl = DEFAULT_HISTORY_TTL, uuid_at_ttl = DEFAULT_UUID_AT_TTL, max_entries = DEFAULT_MAX_ENTRIES):
+        if path != ':memory:':
+            directory = os.path.dirname(path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+        self.path = path
+        self.history_ttl = history_ttl
+        self.uuid_at_ttl = uuid_at_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+
+    def get_names(self, uuid):
+        """Returns the cached name history (a list, as parsed from the API's
+        JSON) of the player `uuid`, or None if it is missing or stale.
+        """
+
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT history FROM names WHERE uuid = ? AND fetched > ?', (uuid, now - self.history_ttl)).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE names SET accessed = ? WHERE uuid = ?', (now, uuid))
+            self._db.commit()
+
+        return json.loads(row[0])
+
+    def put_names(self, uuid, history):
+        """Caches the name history `history` of the player `uuid`."""
+
+        now = time.time()
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO names VALUES (?, ?, ?, ?)', (uuid, json.dumps(history), now, now))
+            self._evict('names')
+            self._db.commit()
+
+    def get_uuid_at(self, username, timestamp):
+        """Returns the cached result of looking up the owner of `username` at
+        `timestamp`, as a tuple of (status code, UUID or None), or None if it
+        is missing or stale.
+        """
+
+        now = time.time()
+        username = username.lower()
+        with self._lock:
+            row = self._db.execute('SELECT status, uuid FROM uuid_at WHERE username = ? AND timestamp = ? AND fetched > ?', (username, timestamp, now - self.uuid_at_ttl)).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE uuid_at SET accessed = ? WHERE username = ? AND timestamp = ?', (now, username, timestamp))
+            self._db.commit()
+
+        return (row[0], row[1])
+
+    def put_uuid_at(self, username, timestamp, status, uuid):
+        """Caches the result of looking up the owner of `username` at
+        `timestamp`. `uuid` is None if nobody owned it (e.g. status 204).
+        """
+
+        now = time.time()
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO uuid_at VALUES (?, ?, ?, ?, ?, ?)', (username.lower(), timestamp, status, uuid, now, now))
+            self._evict('uuid_at')
+            self._db.commit()
+
+    def purge(self):
+        """Deletes every stale entry."""
+
+        now = time.time()
+        with self._lock:
+            self._db.execute('DELETE FROM names WHERE fetched <= ?', (now - self.history_ttl,))
+            self._db.execute('DELETE FROM uuid_at WHERE fetched <= ?', (now - self.uuid_at_ttl,))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _evict(self, table):
+        # Must be called with the lock held. Counting rows is linear in the
+        # table size, so only check every EVICT_INTERVAL writes.
+        self._writes += 1
+        if self._writes % EVICT_INTERVAL != 0:
+            return
+
+        (count,) = self._db.execute('SELECT COUNT(*) FROM {}'.format(table)).fetchone()
+        if count > self.max_entries:
+            self._db.execute('DELETE FROM {0} WHERE rowid IN (SELECT rowid FROM {0} ORDER BY accessed LIMIT ?)'.format(table), (count - self.max_entries,))
@@ -0,0 +1,159 @@
+import email.utils
+import time
+from collections import namedtuple
+import quickscope.pool
+
+# One response: local wall-clock times around the request, and the server
+# time (whole seconds since the epoch) from its Date header.
+Observation = namedtuple('Observation', ['sent', 'received', 'server'])
+
+# Estimate of (server time - local time), in seconds. `low` and `high` bound
+# the true offset; if the observations contradicted each other (consistent
+# is False), they are the 5th and 95th percentiles of the per-observation
+# estimates instead.
+ClockOffset = namedtuple('ClockOffset', ['offset', 'low', 'high', 'samples', 'consistent'])
+
+# Default number of requests made by calibrate()
+DEFAULT_SAMPLES = 12
+
+# Fewest observations an offset is trusted from (see trusted())
+MIN_SAMPLES = 5
+
+# Widest range (seconds) an offset is trusted with: aiming by the midpoint
+# of a wider one can be further off than our own clock
+MAX_SPREAD = 0.05
+
+# Seconds before a target send time at which _wait_until stops sleeping and spins
+SPIN_TIME = 0.002
+
+def parse_date(headers):
+    """Returns the Date header in a (key, value) list of headers as seconds
+    since the epoch, or None if it is missing or malformed.
+    """
+
+    for (key, value) in headers:
+        if key.lower() == 'date':
+            parsed = email.utils.parsedate_tz(value)
+            if parsed is None:
+                return None
+            return email.utils.mktime_tz(parsed)
+    return None
+
+def bounds(observation):
+    """Returns the (low, high) range of clock offsets consistent with one
+    observation. The server generated its Date header at some local time
+    between `sent` and `received`, and at a server time in
+    [server, server + 1).
+    """
+
+    return (observation.server - observation.received, observation.server + 1 - observation.sent)
+
+def estimate(observations):
+    """Fits a ClockOffset to a list of Observations by intersecting their
+    bounds. Returns None if there are no observations.
+    """
+
+    if not observations:
+        return None
+
+    ranges = [ bounds(observation) for observation in observations ]
+    low = max(r[0] for r in ranges)
+    high = min(r[1] for r in ranges)
+
+    if low <= high:
+        return ClockOffset((low + high) / 2, low, high, len(observations), True)
+
+    # The observations disagree (e.g. servers behind a load balancer with
+    # different clocks); fall back to the spread of the midpoints
+    mids = sorted((r[0] + r[1]) / 2 for r in ranges)
+    pick = lambda q: mids[min(len(mids) - 1, int(q * len(mids)))]
+    return ClockOffset(pick(0.5), pick(0.05), pick(0.95), len(observations), False)
+
+def trusted(offset, min_samples = MIN_SAMPLES, max_spread = MAX_SPREAD):
+    """Returns whether a ClockOffset is good enough to fire by: its
+    observations agreed, there were at least `min_samples` of them, and they
+    bound the offset to within `max_spread` seconds.
+    """
+
+    return offset.consistent and offset.samples >= min_samples and offset.high - offset.low <= max_spread
+
+def _wait_until(when):
+    remaining = when - time.time()
+    if remaining > SPIN_TIME:
+        time.sleep(remaining - SPIN_TIME)
+    while time.time() < when:
+        pass
+
+def observe(pool, path, method = 'GET', headers = None):
+    """Sends one request through `pool` (a quickscope.pool.ConnectionPool)
+    and returns an Observation, or None if the response had no Date header.
+    """
+
+    sent = time.time()
+    (status, response_headers, _) = pool.request(method, path, None, headers)
+    received = time.time()
+
+    server = parse_date(response_headers)
+    if server is None:
+        return None
+    return Observation(sent, received, server)
+
+def calibrate(url, path = None, samples = DEFAULT_SAMPLES, method = 'GET', headers = None, pool = None):
+    """Estimates the offset between the local clock and the clock of the
+    HTTP server at the Url `url`, from the Date headers of its responses.
+
+    Date headers only have a resolution of one second, so after a first
+    request, every request is timed so that the server's clock is expected
+    to tick over to the next second while the request is in flight (at the
+    midpoint of the current estimate). Whichever side of the tick the
+    response lands on halves the remaining uncertainty, down to roughly the
+    round-trip jitter.
+
+    Keyword arguments:
+    url -- Url tuple of any HTTP(S) endpoint that sends a Date header
+    path -- (optional) Request path; defaults to url.path
+    samples -- (optional) Number of requests to make
+    method -- (optional) HTTP method
+    headers -- (optional) Dictionary of request headers
+    pool -- (optional) quickscope.pool.ConnectionPool to send requests through,
+            so that they reuse an open connection
+
+    Returns a ClockOffset, or None if no response carried a Date header.
+    """
+
+    if path is None:
+        path = url.path
+    if pool is None:
+        pool = quickscope.pool.ConnectionPool(url.ssl, url.host, url.port)
+
+    # Open the connection first, so that the connect is not timed
+    pool.request(method, path, None, headers)
+
+    observations = []
+    rtt = None
+
+    for i in range(samples):
+        result = estimate(observations)
+        if result is not None and result.consistent:
+            # Send so that the request reaches the server just as its clock
+            # reaches the next whole second (if our estimate is right)
+            now = time.time()
+            boundary = int(now + result.offset + rtt) + 1
+            _wait_until(boundary - result.offset - rtt / 2)
+
+        observation = observe(pool, path, method, headers)
+        if observation is None:
+            continue
+
+        observations.append(observation)
+        trip = observation.received - observation.sent
+        rtt = trip if rtt is None else min(rtt, trip)
+
+    return estimate(observations)
+
+def format_offset(offset):
+    """Returns a one-line, human-readable description of a ClockOffset."""
+
+    return 'server clock offset {:+.1f}ms (range {:+.1f}ms to {:+.1f}ms, {} samples{})'.format(
+        offset.offset * 1000, offset.low * 1000, offset.high * 1000, offset.samples,
+        '' if offset.consistent else ', inconsistent')
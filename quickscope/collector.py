@@ -0,0 +1,307 @@
+import collections
+import selectors
+import socket
+import ssl
+import threading
+import time
+
+# Collection of responses to fired requests. Rather than one thread blocking
+# in getresponse() per request, every fired connection is registered with a
+# single selector loop, which parses each response as its bytes arrive; the
+# status is known (and a success can be acted on) as soon as the status line
+# is in, before the rest of the response.
+
+# Default seconds to wait for a response after it was added
+DEFAULT_TIMEOUT = 30
+
+# Bytes read from a socket at a time
+READ_SIZE = 65536
+
+class ResponseParser:
+    """Incremental parser of one HTTP/1.1 response. Feed it bytes as they
+    arrive; `status` is set as soon as the status line is complete, and
+    `complete` once the whole response has been read.
+
+    Keyword arguments:
+    method -- (optional) Method of the request, e.g. 'HEAD' (which has no
+              response body)
+    """
+
+    def __init__(self, method = 'POST'):
+        self.method = method
+        self.status = None
+        self.reason = None
+        self.headers = [] # (key, value) tuples
+        self.body = b''
+        self.complete = False
+        self._buffer = b''
+        self._state = 'status'
+        self._length = None # Bytes of body (or current chunk) still expected
+        self._chunks = []
+
+    def feed(self, data):
+        """Parses `data` (bytes). Returns True once the response is complete."""
+
+        self._buffer += data
+        while not self.complete and self._step():
+            pass
+        return self.complete
+
+    def finish(self):
+        """Called when the connection was closed. A response delimited by the
+        connection closing is then complete.
+
+        Returns whether the response is complete.
+        """
+
+        if self._state == 'body' and self._length is None:
+            self.body = self._buffer
+            self._buffer = b''
+            self.complete = True
+        return self.complete
+
+    def _line(self):
+        # Takes one CRLF-terminated line from the buffer, or returns None
+        end = self._buffer.find(b'\r\n')
+        if end < 0:
+            return None
+        line = self._buffer[:end]
+        self._buffer = self._buffer[end + 2:]
+        return line.decode('latin-1')
+
+    def _step(self):
+        # Advances the state machine by one step; returns False if more
+        # bytes are needed
+        if self._state == 'status':
+            line = self._line()
+            if line is None:
+                return False
+            parts = line.split(' ', 2)
+            if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+                raise ValueError('Malformed status line: {!r}'.format(line))
+            self.status = int(parts[1])
+            self.reason = parts[2] if len(parts) > 2 else ''
+            self.headers = []
+            self._state = 'headers'
+            return True
+
+        if self._state == 'headers':
+            line = self._line()
+            if line is None:
+                return False
+            if line:
+                (key, _, value) = line.partition(':')
+                self.headers.append((key.strip(), value.strip()))
+                return True
+            self._start_body()
+            return True
+
+        if self._state == 'body':
+            if self._length is None or len(self._buffer) < self._length:
+                return False
+            self.body = self._buffer[:self._length]
+            self._buffer = self._buffer[self._length:]
+            self.complete = True
+            return False
+
+        if self._state == 'chunk-size':
+            line = self._line()
+            if line is None:
+                return False
+            self._length = int(line.split(';', 1)[0], 16)
+            self._state = 'chunk' if self._length else 'trailer'
+            return True
+
+        if self._state == 'chunk':
+            if len(self._buffer) < self._length + 2:
+                return False
+            self._chunks.append(self._buffer[:self._length])
+            self._buffer = self._buffer[self._length + 2:]
+            self._state = 'chunk-size'
+            return True
+
+        if self._state == 'trailer':
+            line = self._line()
+            if line is None:
+                return False
+            if not line:
+                self.body = b''.join(self._chunks)
+                self.complete = True
+                return False
+            return True
+
+        return False
+
+    def _start_body(self):
+        # Decides how the body is delimited, once the headers are in
+        if 100 <= self.status < 200:
+            # Interim response; the real one follows
+            self._state = 'status'
+            return
+
+        headers = dict((key.lower(), value) for (key, value) in self.headers)
+        if self.method == 'HEAD' or self.status in (204, 304):
+            self._length = 0
+            self._state = 'body'
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            self._state = 'chunk-size'
+        elif 'content-length' in headers:
+            self._length = int(headers['content-length'])
+            self._state = 'body'
+        else:
+            self._length = None # Until the connection closes
+            self._state = 'body'
+
+class _Pending:
+    # A fired request waiting for its response
+    def __init__(self, request, on_response, added):
+        self.request = request
+        self.on_response = on_response
+        self.added = added
+        self.parser = ResponseParser(request.method)
+        self.reported = False # Whether on_status was called
+
+class ResponseCollector:
+    """Reads the responses to fired requests on one background thread.
+
+    Keyword arguments:
+    on_status -- (optional) Called with (request, status) as soon as a
+                 response's status line has arrived, on the collector's
+                 thread; e.g. to cancel other requests once one succeeds
+    timeout -- (optional) Seconds to wait for each response
+    """
+
+    def __init__(self, on_status = None, timeout = DEFAULT_TIMEOUT):
+        self.on_status = on_status
+        self.timeout = timeout
+        self._selector = selectors.DefaultSelector()
+        self._added = collections.deque()
+        self._pending = {} # Socket -> _Pending
+        (self._wake_r, self._wake_w) = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='quickscope-collector')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Stops the loop. Responses still pending are not reported."""
+
+        self._stopped = True
+        self._wake()
+
+    def add(self, request, on_response):
+        """Collects the response to `request` (a fired PreparedRequest).
+        `on_response` is called (on the collector's thread) with (request,
+        status, headers, body) once it has been read; status is None if the
+        response could not be read (then headers is [] and body the error
+        message). The request's connection is closed afterwards.
+
+        Cheap enough to call on the fire path: the request is only queued.
+        """
+
+        self._added.append((request, on_response, time.perf_counter()))
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b'\0')
+        except OSError:
+            pass
+
+    def _run(self):
+        while not self._stopped:
+            timeout = None
+            if self._pending:
+                oldest = min(pending.added for pending in self._pending.values())
+                timeout = max(0, oldest + self.timeout - time.perf_counter())
+
+            for (key, _) in self._selector.select(timeout):
+                if key.fileobj is self._wake_r:
+                    self._drain_wake()
+                else:
+                    self._read(key.fileobj)
+
+            while self._added:
+                self._register(_Pending(*self._added.popleft()))
+            self._expire()
+
+        self._selector.close()
+        self._wake_r.close()
+        self._wake_w.close()
+
+    def _drain_wake(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except OSError:
+            pass
+
+    def _register(self, pending):
+        sock = pending.request.conn.sock
+        if sock is None:
+            return self._finish(pending, None, 'Connection closed before the response')
+
+        sock.setblocking(False)
+        self._pending[sock] = pending
+        self._selector.register(sock, selectors.EVENT_READ)
+
+        # TLS may already have buffered the start of the response
+        if isinstance(sock, ssl.SSLSocket) and sock.pending():
+            self._read(sock)
+
+    def _read(self, sock):
+        pending = self._pending.get(sock)
+        if pending is None:
+            return
+
+        parser = pending.parser
+        try:
+            while not parser.complete:
+                try:
+                    data = sock.recv(READ_SIZE)
+                except (ssl.SSLWantReadError, BlockingIOError):
+                    break
+
+                if pending.request.first_byte_at is None:
+                    pending.request.first_byte_at = time.perf_counter()
+                if not data:
+                    if not parser.finish():
+                        raise ConnectionError('Connection closed during the response')
+                    break
+
+                parser.feed(data)
+                if parser.status is not None and not pending.reported:
+                    pending.reported = True
+                    if self.on_status is not None:
+                        self.on_status(pending.request, parser.status)
+        except (OSError, ValueError) as e:
+            return self._done(sock, pending, None, str(e))
+
+        if parser.complete:
+            self._done(sock, pending, parser.status)
+
+    def _expire(self):
+        now = time.perf_counter()
+        for (sock, pending) in list(self._pending.items()):
+            if now - pending.added >= self.timeout:
+                self._done(sock, pending, None, 'Timed out waiting for the response')
+
+    def _done(self, sock, pending, status, error = None):
+        self._selector.unregister(sock)
+        del self._pending[sock]
+        self._finish(pending, status, error)
+
+    def _finish(self, pending, status, error):
+        pending.request.close()
+        parser = pending.parser
+        try:
+            if status is None:
+                pending.on_response(pending.request, None, [], error)
+            else:
+                pending.on_response(pending.request, status, parser.headers, parser.body)
+        except Exception as e:
+            print('Error handling response: {}'.format(e))
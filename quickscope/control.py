@@ -0,0 +1,494 @@
+import hmac
+import json
+import socket
+import socketserver
+import threading
+import time
+
+# Control channel between the master and its slaves: newline-delimited JSON
+# messages over a TCP connection that each slave opens to the master.
+#
+#   slave -> master  {"type": "register", "name": ..., "token": ...}
+#   master -> slave  {"type": "schedule", ...}  fields overriding the slave's
+#                                               arguments (e.g. expiry, variance)
+#   slave -> master  {"type": "ready", "process": ..., "boot": ...}
+#                                               seconds the slave took to log in
+#                                               and calibrate, since its process
+#                                               started and since boot
+#   slave -> master  {"type": "measurements", "errors": [...]}
+#                                               arrival error samples (ms), if
+#                                               the schedule asked for them
+#   master -> slave  {"type": "offsets", "offsets": [...]}
+#                                               when to aim each request (ms
+#                                               after availability; see
+#                                               quickscope.fireplan)
+#   slave -> master  {"type": "result", "index": ..., "status": ..., ...}
+#   slave -> master  {"type": "done"}           every request was sent or cancelled
+#   master -> slave  {"type": "cancel"}         stop sending requests
+#   master -> slave  {"type": "release"}        exit rather than wait for
+#                                               another schedule
+#
+# The master sends "cancel" to every slave as soon as any slave reports a
+# successful (200) rename. A slave cannot register under a name that a
+# connected slave already has; the master closes such connections.
+#
+# A slave whose schedule has "warm" set stays connected after "done" and
+# waits for the master to push another schedule (with a new target; see
+# quickscope.warmpool), or to release it.
+
+# Default port the master listens on
+DEFAULT_PORT = 7456
+
+# Seconds a slave waits for the master to push its schedule
+SCHEDULE_TIMEOUT = 30
+
+# Seconds a slave waits for the master to plan its offsets
+OFFSETS_TIMEOUT = 5 * 60
+
+# Status of a successful rename
+STATUS_SUCCESS = 200
+
+def parse_address(string, default_port = DEFAULT_PORT):
+    """Parses 'host[:port]' into a (host, port) tuple."""
+
+    (host, _, port) = string.rpartition(':')
+    if not host:
+        return (string, default_port)
+    return (host, int(port))
+
+def send_message(f, lock, message):
+    # Writes one message to the file-like `f`, holding `lock`
+    data = (json.dumps(message) + '\n').encode()
+    with lock:
+        f.write(data)
+        f.flush()
+
+def read_message(f):
+    """Reads one message from the file-like `f`. Returns None at EOF or on a
+    malformed message.
+    """
+
+    line = f.readline()
+    if not line:
+        return None
+    try:
+        message = json.loads(line.decode())
+    except ValueError:
+        return None
+    return message if isinstance(message, dict) else None
+
+# ========================================
+#
+#                 MASTER
+#
+# ========================================
+class SlaveConnection:
+    """A registered slave, as seen by the master."""
+
+    def __init__(self, name, address, wfile):
+        self.name = name
+        self.address = address
+        self.registered_at = time.time()
+        self.connected = True
+        self.done = False
+        self.errors = None # Arrival error samples (ms), once measured
+        self.ready = None # The "ready" message, once received
+        self.ready_at = None # When it was received
+        self.results = []
+        self.connected = True
+        self._wfile = wfile
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Forgets what the slave reported about its last target."""
+
+        self.done = False
+        self.errors = None
+        self.ready = None
+        self.ready_at = None
+        self.results = []
+
+    def send(self, message):
+        try:
+            send_message(self._wfile, self._lock, message)
+            return True
+        except (OSError, ValueError):
+            return False
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        control = self.server.control
+        message = read_message(self.rfile)
+        if message is None or message.get('type') != 'register' or not control.authenticate(message.get('token')):
+            return
+
+        slave = control._register(message.get('name'), self.client_address[0], self.wfile)
+        if slave is None:
+            return
+        try:
+            while True:
+                message = read_message(self.rfile)
+                if message is None:
+                    break
+                control._handle(slave, message)
+        except OSError:
+            pass # e.g. reset by a slave whose droplet was destroyed
+        finally:
+            control._disconnect(slave)
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class ControlServer:
+    """The master's end of the control channel.
+
+    Keyword arguments:
+    token -- Shared secret that slaves must register with
+    host -- (optional) Address to listen on; only this machine can connect
+            by default
+    port -- (optional) Port to listen on; 0 picks a free port
+    schedules -- (optional) Dictionary of slave name -> schedule (a
+                 dictionary of fields), pushed to each slave when it registers
+    on_register -- (optional) Called with each SlaveConnection that registers
+    on_result -- (optional) Called with (SlaveConnection, result message)
+    """
+
+    def __init__(self, token, host = '127.0.0.1', port = DEFAULT_PORT, schedules = None, on_register = None, on_result = None):
+        self.token = token
+        self.schedules = schedules if schedules is not None else {}
+        self.on_register = on_register
+        self.on_result = on_result
+        self.slaves = {}
+        self.succeeded = threading.Event()
+        self.cancelled = False
+        self._finished = threading.Condition()
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _Handler)
+        self._server.control = self
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='quickscope-control')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def authenticate(self, token):
+        """Returns whether `token` (from a register message) is this
+        channel's token, comparing in constant time.
+        """
+
+        if not isinstance(token, str):
+            return False
+        return hmac.compare_digest(token.encode(), self.token.encode())
+
+    def push_schedule(self, name, schedule):
+        """Sets the schedule of the slave called `name`, sending it now if
+        the slave is connected.
+        """
+
+        self.schedules[name] = schedule
+        slave = self.slaves.get(name)
+        if slave is not None:
+            slave.send(dict(schedule, type='schedule'))
+
+    def new_round(self, schedules):
+        """Starts sniping another target with the same slaves: replaces
+        every schedule with those in `schedules` (a dictionary of slave name
+        -> schedule) and forgets every result, without sending anything.
+        Push the new schedules to connected slaves with push_schedule().
+        """
+
+        self.schedules = dict(schedules)
+        self.succeeded.clear()
+        self.cancelled = False
+        for slave in list(self.slaves.values()):
+            slave.reset()
+
+    def release(self, name):
+        """Tells the slave called `name`, if it is waiting for another
+        schedule, to exit. Returns False if it is not connected.
+        """
+
+        slave = self.slaves.get(name)
+        return slave is not None and slave.connected and slave.send({ 'type': 'release' })
+
+    def push_offsets(self, name, offsets):
+        """Sends the slave called `name` the offsets (ms after availability)
+        to aim its requests at. Returns False if it is not connected.
+        """
+
+        slave = self.slaves.get(name)
+        return slave is not None and slave.send({ 'type': 'offsets', 'offsets': offsets })
+
+    def wait_measurements(self, names, timeout):
+        """Blocks until every slave in `names` has sent its arrival error
+        samples, or for at most `timeout` seconds.
+
+        Returns a dictionary of slave name -> error samples (ms) for the
+        slaves that sent them.
+        """
+
+        measured = lambda: dict((name, self.slaves[name].errors) for name in names if name in self.slaves and self.slaves[name].errors is not None)
+        deadline = time.time() + timeout
+        with self._finished:
+            while len(measured()) < len(names):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._finished.wait(remaining)
+        return measured()
+
+    def cancel(self):
+        """Tells every connected slave (and every slave that registers
+        later) to stop sending requests.
+        """
+
+        self.cancelled = True
+        for slave in list(self.slaves.values()):
+            slave.send({ 'type': 'cancel' })
+
+    def finished(self, names):
+        """Returns whether a rename succeeded, or every slave in `names` has
+        reported that it is done.
+        """
+
+        if self.succeeded.is_set():
+            return True
+        return all(name in self.slaves and self.slaves[name].done for name in names)
+
+    def wait_finished(self, names, timeout):
+        """Blocks until finished(names), or for at most `timeout` seconds.
+
+        Returns whether the slaves finished.
+        """
+
+        deadline = time.time() + timeout
+        with self._finished:
+            while not self.finished(names):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._finished.wait(remaining)
+        return True
+
+    def results(self):
+        """Returns every result reported so far, as (slave name, result
+        message) tuples.
+        """
+
+        return [ (slave.name, result) for slave in list(self.slaves.values()) for result in slave.results ]
+
+    def _register(self, name, address, wfile):
+        # Returns None if a connected slave already has this name
+        slave = SlaveConnection(name, address, wfile)
+        with self._lock:
+            previous = self.slaves.get(name)
+            if previous is not None and previous.connected:
+                print('Rejected slave {} from {}: already registered from {}'.format(name, address, previous.address))
+                return None
+            self.slaves[name] = slave
+        print('Slave {} registered from {}'.format(name, address))
+
+        if name in self.schedules:
+            slave.send(dict(self.schedules[name], type='schedule'))
+        if self.cancelled:
+            slave.send({ 'type': 'cancel' })
+        if self.on_register is not None:
+            self.on_register(slave)
+        return slave
+
+    def _handle(self, slave, message):
+        kind = message.get('type')
+        if kind == 'result':
+            slave.results.append(message)
+            print('Slave {} request {}: status {} (fired {}ms from schedule)'.format(slave.name, message.get('index'), message.get('status'), message.get('error')))
+            if self.on_result is not None:
+                self.on_result(slave, message)
+            if message.get('status') == STATUS_SUCCESS and not self.succeeded.is_set():
+                print('Slave {} got the name; cancelling every other request'.format(slave.name))
+                self.succeeded.set()
+                self.cancel()
+        elif kind == 'done':
+            slave.done = True
+        elif kind == 'ready':
+            slave.ready = message
+            slave.ready_at = time.time()
+            boot = message.get('boot')
+            print('Slave {} ready {:.2f}s after start{}'.format(slave.name, message.get('process', 0), '' if boot is None else ' ({:.1f}s after boot)'.format(boot)))
+        elif kind == 'measurements':
+            slave.errors = [ float(error) for error in message.get('errors', []) ]
+        else:
+            return
+
+        with self._finished:
+            self._finished.notify_all()
+
+    def _disconnect(self, slave):
+        slave.connected = False
+        if self.slaves.get(slave.name) is slave and not slave.done:
+            print('Slave {} disconnected'.format(slave.name))
+
+# ========================================
+#
+#                 SLAVE
+#
+# ========================================
+class ControlClient:
+    """A slave's end of the control channel.
+
+    Keyword arguments:
+    address -- (host, port) of the master
+    name -- Name of this slave (e.g. its droplet's name)
+    token -- Shared secret given by the master
+    on_cancel -- (optional) Called (on the reader thread) when the master
+                 sends "cancel"
+    """
+
+    def __init__(self, address, name, token, on_cancel = None):
+        self.address = address
+        self.name = name
+        self.token = token
+        self.on_cancel = on_cancel
+        self.cancelled = threading.Event()
+        self.released = False # Whether the master told us to exit
+        self.lost = False # Whether the connection to the master ended
+        self._schedule = None
+        self._scheduled = threading.Event()
+        self._offsets = None
+        self._planned = threading.Event()
+        self._sock = None
+        self._rfile = None
+        self._wfile = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def connect(self, timeout = 10):
+        """Connects and registers with the master."""
+
+        self._sock = socket.create_connection(self.address, timeout)
+        self._sock.settimeout(None)
+        self._rfile = self._sock.makefile('rb')
+        self._wfile = self._sock.makefile('wb')
+        send_message(self._wfile, self._lock, { 'type': 'register', 'name': self.name, 'token': self.token })
+
+        self._thread = threading.Thread(target=self._read, name='quickscope-control')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def wait_schedule(self, timeout = SCHEDULE_TIMEOUT):
+        """Waits for the master to push this slave's schedule.
+
+        Returns the schedule (a dictionary of fields), or None if none came
+        within `timeout` seconds.
+        """
+
+        self._scheduled.wait(timeout)
+        return self._schedule
+
+    def ready(self, process, boot = None):
+        """Tells the master how long this slave took to get ready, in seconds
+        since its process started and (if known) since boot.
+        """
+
+        self.send({ 'type': 'ready', 'process': process, 'boot': boot })
+
+    def measurements(self, errors):
+        """Sends this slave's arrival error samples (ms) to the master."""
+
+        self.send({ 'type': 'measurements', 'errors': errors })
+
+    def wait_offsets(self, timeout = OFFSETS_TIMEOUT):
+        """Waits for the master to send the offsets to aim requests at.
+
+        Returns a list of offsets (ms after availability), or None if none
+        came within `timeout` seconds.
+        """
+
+        self._planned.wait(timeout)
+        return self._offsets
+
+    def report(self, **result):
+        """Sends the result of one request to the master."""
+
+        self.send(dict(result, type='result'))
+
+    def done(self):
+        """Tells the master that every request was sent or cancelled."""
+
+        self.send({ 'type': 'done' })
+
+    def idle(self):
+        """Tells the master that every request was sent or cancelled, and
+        waits for it to push a schedule with another target.
+
+        Returns the new schedule, or None if the master released this slave
+        or the connection was lost.
+        """
+
+        # Forget the last target before the master can send the next
+        self._schedule = None
+        self._scheduled.clear()
+        self._offsets = None
+        self._planned.clear()
+        self.cancelled.clear()
+        self.on_cancel = None
+
+        self.done()
+        if self.lost:
+            return None # The reader set _scheduled before we cleared it
+        self._scheduled.wait()
+        return self._schedule
+
+    def send(self, message):
+        if self._wfile is None:
+            return
+        try:
+            send_message(self._wfile, self._lock, message)
+        except (OSError, ValueError) as e:
+            print('Warning: lost connection to master: {}'.format(e))
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+
+    def _read(self):
+        while True:
+            try:
+                message = read_message(self._rfile)
+            except (OSError, ValueError):
+                message = None
+            if message is None:
+                # Nothing more will come
+                self.lost = True
+                self._scheduled.set()
+                self._planned.set()
+                return
+
+            kind = message.pop('type', None)
+            if kind == 'schedule':
+                self._schedule = message
+                self._scheduled.set()
+            elif kind == 'offsets':
+                self._offsets = message.get('offsets', [])
+                self._planned.set()
+            elif kind == 'release':
+                self.released = True
+                self._scheduled.set()
+            elif kind == 'cancel' and not self.cancelled.is_set():
+                self.cancelled.set()
+                if self.on_cancel is not None:
+                    self.on_cancel()
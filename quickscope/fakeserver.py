@@ -0,0 +1,261 @@
+import email.utils
+import http.cookies
+import http.server
+import json
+import random
+import re
+import socketserver
+import threading
+import time
+import urllib.parse
+import uuid as uuidlib
+from collections import namedtuple
+
+# A local stand-in for the Mojang endpoints used by quickscope.mojang, for
+# testing and benchmarking without touching the real servers. It serves
+# plain HTTP; point quickscope at it with mojang#set_endpoints.
+
+# One rename POST as seen by the server. `local` is when it arrived by the
+# machine's clock, `server` the same moment by the server's (skewed) clock.
+Arrival = namedtuple('Arrival', ['local', 'server', 'uuid', 'new_name', 'status'])
+
+RE_RENAME = re.compile(r'^/me/renameProfile/([0-9a-fA-F-]+)$')
+RE_UUID_AT = re.compile(r'^/users/profiles/minecraft/([^/?]+)$')
+RE_NAMES = re.compile(r'^/user/profiles/([0-9a-fA-F]+)/names$')
+
+class FakeMojang:
+    """The state of the stand-in: one Mojang account, and one target name
+    that its previous owner changed away from at `expiry`, so that
+    mojang#get_free_time(target) returns `expiry`.
+
+    Keyword arguments:
+    email -- Email of the account
+    password -- Password of the account
+    uuid -- UUID of the account's Minecraft profile
+    target -- Name to be sniped
+    expiry -- Unix timestamp at which the previous owner changed away from `target`
+    available -- Unix timestamp (server clock) from which `target` can be claimed
+    latency -- (optional) Simulated round-trip time in seconds; half is spent
+               before a request 'arrives', half before its response is sent
+    jitter -- (optional) Maximum random variation (+/-) of each half, in seconds
+    skew -- (optional) Seconds the server's clock is ahead of the local clock
+    """
+
+    def __init__(self, email, password, uuid, target, expiry, available, latency = 0, jitter = 0, skew = 0):
+        self.email = email
+        self.password = password
+        self.uuid = uuid.replace('-', '')
+        self.target = target
+        self.expiry = expiry
+        self.available = available
+        self.latency = latency
+        self.jitter = jitter
+        self.skew = skew
+        self.previous_owner = 'f' * 32
+        self.claimed_by = None
+        self.arrivals = []
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def now(self):
+        """Returns the current time by the server's clock."""
+
+        return time.time() + self.skew
+
+    def delay(self):
+        """Sleeps for half of the simulated round trip (plus jitter)."""
+
+        half = self.latency / 2 + random.uniform(-self.jitter, self.jitter)
+        if half > 0:
+            time.sleep(half)
+
+    def new_session(self):
+        session = uuidlib.uuid4().hex
+        with self._lock:
+            self._sessions[session] = set()
+        return session
+
+    def new_token(self, session):
+        token = uuidlib.uuid4().hex
+        with self._lock:
+            self._sessions.setdefault(session, set()).add(token)
+        return token
+
+    def valid_token(self, session, token):
+        with self._lock:
+            return token in self._sessions.get(session, ())
+
+    def known_token(self, token):
+        with self._lock:
+            return any(token in tokens for tokens in self._sessions.values())
+
+    def valid_session(self, session):
+        with self._lock:
+            return session in self._sessions
+
+    def rename(self, uuid, new_name, password):
+        """Attempts a rename at the current server time.
+
+        Returns a tuple of (status code, message).
+        """
+
+        if password != self.password or uuid.replace('-', '') != self.uuid:
+            return (401, 'Invalid password')
+
+        with self._lock:
+            if new_name.lower() != self.target.lower():
+                return (400, 'Name is unavailable')
+            if self.claimed_by is not None:
+                return (400, 'Name is unavailable')
+            if self.now() < self.available:
+                return (400, 'Name is unavailable')
+
+            self.claimed_by = uuid
+            return (200, 'Name changed')
+
+    def record(self, arrival):
+        with self._lock:
+            self.arrivals.append(arrival)
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body are written separately; don't let Nagle's algorithm
+    # hold the body back
+    disable_nagle_algorithm = True
+
+    @property
+    def mojang(self):
+        return self.server.mojang
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def date_time_string(self, timestamp = None):
+        if timestamp is None:
+            timestamp = self.mojang.now()
+        return email.utils.formatdate(timestamp, usegmt=True)
+
+    def reply(self, status, body = b'', headers = []):
+        if isinstance(body, str):
+            body = body.encode()
+
+        # Date is when the server answered, i.e. before the reply travels back
+        date = self.date_time_string(self.mojang.now())
+        self.mojang.delay()
+        self.log_request(status)
+        self.send_response_only(status)
+        self.send_header('Server', self.version_string())
+        self.send_header('Date', date)
+        for (key, value) in headers:
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def session(self):
+        cookies = http.cookies.SimpleCookie(self.headers.get('Cookie', ''))
+        if 'PLAY_SESSION' not in cookies:
+            return None
+        parts = urllib.parse.parse_qs(cookies['PLAY_SESSION'].value)
+        return parts['session'][0] if 'session' in parts else None
+
+    def form(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return dict((key, values[0]) for (key, values) in urllib.parse.parse_qs(self.rfile.read(length).decode()).items())
+
+    def do_GET(self):
+        self.mojang.delay()
+        url = urllib.parse.urlparse(self.path)
+
+        if url.path == '/login':
+            token = self.mojang.new_token(self.mojang.new_session())
+            return self.reply(200, '<html>login</html>', [ ('Set-Cookie', 'PLAY_SESSION=___AT={}; Path=/'.format(token)) ])
+
+        match = RE_RENAME.match(url.path)
+        if match:
+            session = self.session()
+            if session is None or not self.mojang.valid_session(session):
+                return self.reply(302, headers=[ ('Location', '/login') ])
+            token = self.mojang.new_token(session)
+            return self.reply(200, '<html>rename</html>', [ ('Set-Cookie', 'PLAY_SESSION=___AT={}&session={}; Path=/'.format(token, session)) ])
+
+        match = RE_UUID_AT.match(url.path)
+        if match:
+            at = int(urllib.parse.parse_qs(url.query).get('at', ['0'])[0])
+            if match.group(1).lower() == self.mojang.target.lower() and at <= self.mojang.expiry:
+                return self.reply(200, json.dumps({ 'id': self.mojang.previous_owner, 'name': self.mojang.target }))
+            return self.reply(204)
+
+        match = RE_NAMES.match(url.path)
+        if match:
+            if match.group(1) == self.mojang.previous_owner:
+                return self.reply(200, json.dumps([ { 'name': self.mojang.target }, { 'name': self.mojang.target + '_old', 'changedToAt': self.mojang.expiry * 1000 } ]))
+            if match.group(1) == self.mojang.uuid:
+                return self.reply(200, json.dumps([ { 'name': 'quickscope' } ]))
+            return self.reply(204)
+
+        self.reply(404, 'Not found')
+
+    def do_POST(self):
+        form = self.form()
+        self.mojang.delay()
+        url = urllib.parse.urlparse(self.path)
+
+        if url.path == '/login':
+            # The login form does not send the cookie from the login page, so
+            # any token handed out is accepted
+            if form.get('username') != self.mojang.email \
+            or form.get('password') != self.mojang.password \
+            or not self.mojang.known_token(form.get('authenticityToken')):
+                return self.reply(302, headers=[ ('Location', '/login') ])
+            return self.reply(302, headers=[ ('Location', '/me'), ('Set-Cookie', 'PLAY_SESSION=session={}; Path=/'.format(self.mojang.new_session())) ])
+
+        match = RE_RENAME.match(url.path)
+        if match:
+            local = time.time()
+            session = self.session()
+            if session is None or not self.mojang.valid_token(session, form.get('authenticityToken')):
+                (status, message) = (403, 'Invalid authenticity token')
+            else:
+                (status, message) = self.mojang.rename(match.group(1), form.get('newName', ''), form.get('password', ''))
+
+            self.mojang.record(Arrival(local, local + self.mojang.skew, match.group(1), form.get('newName'), status))
+            return self.reply(status, message)
+
+        self.reply(404, 'Not found')
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class FakeMojangServer:
+    """Serves a FakeMojang on a background thread.
+
+    Keyword arguments:
+    mojang -- FakeMojang instance
+    host -- (optional) Address to listen on
+    port -- (optional) Port to listen on; 0 picks a free port
+    verbose -- (optional) Log every request
+    """
+
+    def __init__(self, mojang, host = '127.0.0.1', port = 0, verbose = False):
+        self.mojang = mojang
+        self.server = Server((host, port), Handler)
+        self.server.mojang = mojang
+        self.server.verbose = verbose
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='quickscope-fakeserver')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,216 @@
+import bisect
+import random
+
+# Fire-time planning. A request aimed at offset `o` (milliseconds after the
+# name becomes available) arrives at o + e, where e is the worker's arrival
+# error: how far its real one-way latency and clock are from what it
+# subtracted. A request 'hits' if it arrives within `window` milliseconds
+# after availability.
+#
+# A worker's requests share most of their error (the same latency estimate
+# and clock offset), so rather than aiming every request at the same
+# instant, each worker's requests are spread so that together they cover as
+# much of its error distribution as possible; and the request budget is
+# shared between workers so as to maximise the probability that at least
+# one request from any worker hits. Workers' errors are assumed to be
+# independent of each other.
+#
+# Everything here is pure: errors are lists of sampled errors in
+# milliseconds, and plans are dictionaries of worker name -> list of offsets.
+
+# Default width of the window a request should land in, in milliseconds
+DEFAULT_WINDOW = 5
+
+# Number of points the clock offset's uncertainty range is sampled at
+CLOCK_POINTS = 5
+
+def residuals(one_way, estimate, clock_low = 0, clock_high = 0, clock_points = CLOCK_POINTS):
+    """Builds a worker's arrival error samples (ms) from its measurements.
+
+    Keyword arguments:
+    one_way -- Measured one-way latencies (ms), e.g. half of each time to
+               first byte
+    estimate -- Latency (ms) the worker subtracts from its fire times
+    clock_low, clock_high -- (optional) Range (ms) by which the server's real
+                             clock offset may differ from the one used (see
+                             quickscope.clock); sampled uniformly
+    clock_points -- (optional) Number of points that range is sampled at
+
+    Returns a sorted list of errors.
+    """
+
+    if clock_high > clock_low and clock_points > 1:
+        step = (clock_high - clock_low) / (clock_points - 1)
+        clocks = [ clock_low + step * i for i in range(clock_points) ]
+    else:
+        clocks = [ (clock_low + clock_high) / 2 ]
+
+    return sorted(latency - estimate + clock for latency in one_way for clock in clocks)
+
+def covered(errors, offsets, window):
+    """Returns which of `errors` (a sorted list) would have at least one of
+    the requests aimed at `offsets` land in the window: a list of booleans.
+    """
+
+    result = [ False ] * len(errors)
+    for offset in offsets:
+        # Hits if 0 <= offset + e <= window
+        low = bisect.bisect_left(errors, -offset)
+        high = bisect.bisect_right(errors, window - offset)
+        for i in range(low, high):
+            result[i] = True
+    return result
+
+def coverage(errors, offsets, window):
+    """Returns the probability that at least one request aimed at `offsets`
+    hits, if the worker's error is one of `errors` (a sorted list), each
+    equally likely.
+    """
+
+    if not errors:
+        return 0
+    return sum(covered(errors, offsets, window)) / len(errors)
+
+def best_offset(errors, taken, window):
+    # The offset whose window covers the most errors not already covered
+    # (`taken`); windows start at a sample, so only those are tried
+    best = (0, None)
+    for (i, error) in enumerate(errors):
+        high = bisect.bisect_right(errors, error + window)
+        count = sum(1 for j in range(i, high) if not taken[j])
+        if count > best[0]:
+            best = (count, -error)
+    return best
+
+def worker_offsets(errors, count, window = DEFAULT_WINDOW):
+    """Chooses up to `count` offsets for one worker, greedily adding the
+    offset that covers the most of its remaining error distribution.
+
+    Returns a sorted list of offsets (ms). Fewer than `count` offsets are
+    returned if the distribution is already fully covered.
+    """
+
+    errors = sorted(errors)
+    taken = [ False ] * len(errors)
+    offsets = []
+    for k in range(count):
+        (gain, offset) = best_offset(errors, taken, window)
+        if offset is None:
+            break
+        offsets.append(offset)
+        taken = covered(errors, offsets, window)
+    return sorted(offsets)
+
+def plan(workers, budget, window = DEFAULT_WINDOW, max_per_worker = None):
+    """Shares `budget` requests between workers, maximising the probability
+    that at least one request hits.
+
+    Keyword arguments:
+    workers -- Dictionary of worker name -> list of error samples (ms)
+    budget -- Total number of requests
+    window -- (optional) Width (ms) of the window after availability
+    max_per_worker -- (optional) Maximum number of requests per worker
+
+    Returns a dictionary of worker name -> sorted list of offsets (ms).
+    """
+
+    errors = dict((name, sorted(samples)) for (name, samples) in workers.items())
+    offsets = dict((name, []) for name in workers)
+    hits = dict((name, 0.0) for name in workers)
+
+    for i in range(budget):
+        # The chance that every request misses is the product of each
+        # worker's; adding a request to worker w multiplies it by
+        # (1 - new hit chance of w) / (1 - old hit chance of w)
+        best = None
+        for (name, samples) in errors.items():
+            if not samples or (max_per_worker is not None and len(offsets[name]) >= max_per_worker):
+                continue
+
+            taken = covered(samples, offsets[name], window)
+            (gain, offset) = best_offset(samples, taken, window)
+            if offset is None:
+                continue
+
+            new = coverage(samples, offsets[name] + [ offset ], window)
+            factor = (1 - new) / (1 - hits[name]) if hits[name] < 1 else 1
+            if best is None or factor < best[0]:
+                best = (factor, name, offset, new)
+
+        if best is None:
+            break
+        (_, name, offset, new) = best
+        offsets[name].append(offset)
+        hits[name] = new
+
+    return dict((name, sorted(values)) for (name, values) in offsets.items())
+
+def static_plan(names, variances, interval, requests):
+    """The plan that fixed variances and intervals give: worker i fires
+    `requests` requests at variances[i % len(variances)] + interval * k.
+    """
+
+    return dict((name, [ variances[i % len(variances)] + interval * k for k in range(requests) ]) for (i, name) in enumerate(names))
+
+def hit_probability(schedule, workers, window = DEFAULT_WINDOW):
+    """Returns the probability that at least one request of `schedule` (a
+    plan) hits, given each worker's error samples.
+    """
+
+    miss = 1.0
+    for (name, offsets) in schedule.items():
+        miss *= 1 - coverage(sorted(workers.get(name, [])), offsets, window)
+    return 1 - miss
+
+def simulate(schedule, workers, window = DEFAULT_WINDOW, trials = 10000, jitter = 0, seed = None):
+    """Evaluates a plan by simulation: in each trial every worker's error is
+    drawn from its samples, and each of its requests adds its own uniform
+    jitter of up to +/- `jitter` ms.
+
+    Returns a dictionary with the fraction of trials in which a request hit
+    ('hit_rate'), the mean arrival (ms after availability) of the first hit
+    ('first_hit'), and the mean number of requests arriving too early
+    ('early').
+    """
+
+    rng = random.Random(seed)
+    hits = 0
+    first_total = 0
+    early_total = 0
+
+    for trial in range(trials):
+        first = None
+        for (name, offsets) in schedule.items():
+            samples = workers.get(name)
+            if not samples:
+                continue
+            error = rng.choice(samples)
+            for offset in offsets:
+                arrival = offset + error + (rng.uniform(-jitter, jitter) if jitter else 0)
+                if arrival < 0:
+                    early_total += 1
+                elif arrival <= window and (first is None or arrival < first):
+                    first = arrival
+
+        if first is not None:
+            hits += 1
+            first_total += first
+
+    return {
+        'hit_rate': hits / trials if trials else 0,
+        'first_hit': first_total / hits if hits else None,
+        'early': early_total / trials if trials else 0,
+    }
+
+def format_plan(schedule, workers = None, window = DEFAULT_WINDOW):
+    """Returns a human-readable table of a plan, with each worker's chance
+    of a hit if its error samples are given.
+    """
+
+    lines = []
+    for (name, offsets) in sorted(schedule.items()):
+        chance = '' if workers is None else ' ({:.1%} chance of a hit)'.format(coverage(sorted(workers.get(name, [])), offsets, window))
+        lines.append('{:12} {}{}'.format(name, ', '.join('{:+.1f}ms'.format(offset) for offset in offsets) or '-', chance))
+    if workers is not None:
+        lines.append('Chance that a request lands within {}ms: {:.1%}'.format(window, hit_probability(schedule, workers, window)))
+    return '\n'.join(lines)
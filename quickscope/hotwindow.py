@@ -0,0 +1,227 @@
+import gc
+import os
+import sys
+import threading
+import time
+import quickscope.metrics
+import quickscope.trace
+
+# Hot window: the few seconds around the fire times, during which the slave
+# avoids anything that could delay the dispatcher thread. When the window
+# opens (on the dispatcher thread itself), the garbage collector is run,
+# frozen and disabled; printing is buffered; trace records stop being
+# written and metrics stop being folded; and, if asked, the dispatcher
+# thread's priority is raised and it is pinned to one CPU. Everything is
+# undone (and the buffered output printed) when the window closes.
+
+# Seconds before the first fire time that the window opens
+DEFAULT_LEAD = 2
+
+# Seconds after the last fire time that the window closes
+DEFAULT_TAIL = 1
+
+# Niceness the dispatcher thread asks for when raising its priority
+PRIORITY = -10
+
+# Number of probe events used to measure the dispatcher's lateness
+PROBE_COUNT = 50
+
+# Seconds between probe events
+PROBE_SPACING = 0.003
+
+# Seconds from scheduling the probe until its first event
+PROBE_DELAY = 0.05
+
+class DeferredOutput:
+    """Stands in for sys.stdout or sys.stderr, keeping what is written in
+    memory until it is written out with replay().
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._parts = []
+
+    def write(self, text):
+        self._parts.append(text)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def replay(self):
+        self.stream.write(''.join(self._parts))
+        self.stream.flush()
+        self._parts = []
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def percentile(values, q):
+    # Nearest-rank percentile of a sorted list
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def format_lateness(values):
+    """Returns a summary of dispatch lateness samples (seconds) in
+    microseconds.
+    """
+
+    if not values:
+        return 'no samples'
+    values = sorted(values)
+    return 'p50 {:.0f}us, p99 {:.0f}us, max {:.0f}us ({} samples)'.format(
+        percentile(values, 0.5) * 1e6, percentile(values, 0.99) * 1e6, values[-1] * 1e6, len(values))
+
+class HotWindow:
+    """Runs a quickscope.timing.Scheduler's dispatcher thread in hot-window
+    mode around a set of fire times, and measures how late it dispatches
+    events before and inside the window.
+
+    Keyword arguments:
+    scheduler -- The (started) Scheduler that fires the requests
+    priority -- (optional) Whether to raise the dispatcher thread's priority
+    cpu -- (optional) CPU to pin the dispatcher thread to
+    lead -- (optional) Seconds before the first fire time to open the window
+    tail -- (optional) Seconds after the last fire time to close it
+    """
+
+    def __init__(self, scheduler, priority = False, cpu = None, lead = DEFAULT_LEAD, tail = DEFAULT_TAIL):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.cpu = cpu
+        self.lead = lead
+        self.tail = tail
+        self.before = [] # Dispatch lateness samples (seconds) before the window
+        self.during = [] # ... and inside it
+        self.notes = [] # What could not be done, e.g. for lack of permission
+        self.closed = threading.Event()
+        self._open_event = None
+        self._close_event = None
+        self._gc_enabled = None
+        self._output = None
+        self._niceness = None
+        self._affinity = None
+
+    def arm(self, first, last):
+        """Measures dispatch lateness now, then schedules the window around
+        the perf_counter() times `first` and `last` (the first and last fire
+        times). Blocks while measuring.
+        """
+
+        done = threading.Event()
+        self.probe(self.before, done.set)
+        done.wait()
+
+        self._open_event = self.scheduler.schedule_at(first - self.lead, self.open)
+        self._close_event = self.scheduler.schedule_at(last + self.tail, self.close)
+
+    def finish(self, timeout = None):
+        """Closes the window now, unless it has closed already, e.g. once
+        every request was answered or dropped. Waits up to `timeout` seconds
+        for the report to be printed.
+
+        Returns whether the window is closed.
+        """
+
+        if self.scheduler.cancel(self._close_event):
+            self.scheduler.schedule_at(time.perf_counter(), self.close)
+        return self.closed.wait(timeout)
+
+    def probe(self, samples, on_done = None):
+        """Schedules PROBE_COUNT events that append how late they were
+        dispatched (in seconds) to `samples`. `on_done` is called after the
+        last one.
+        """
+
+        start = time.perf_counter() + PROBE_DELAY
+        for i in range(PROBE_COUNT):
+            deadline = start + PROBE_SPACING * i
+            last = i == PROBE_COUNT - 1
+            self.scheduler.schedule_at(deadline, self._probe_event(samples, deadline, on_done if last else None))
+
+    def _probe_event(self, samples, deadline, on_done):
+        def event():
+            samples.append(time.perf_counter() - deadline)
+            if on_done is not None:
+                on_done()
+        return event
+
+    def open(self):
+        """Opens the window. Runs on the dispatcher thread."""
+
+        # Collect now, then keep the collector out of the way; frozen objects
+        # are not even scanned when it runs again
+        self._gc_enabled = gc.isenabled()
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        gc.disable()
+
+        self._output = (sys.stdout, sys.stderr)
+        sys.stdout = DeferredOutput(sys.stdout)
+        sys.stderr = DeferredOutput(sys.stderr)
+        quickscope.trace.TRACER.pause()
+        quickscope.metrics.METRICS.pause()
+
+        if self.priority:
+            try:
+                self._niceness = os.getpriority(os.PRIO_PROCESS, 0)
+                os.setpriority(os.PRIO_PROCESS, 0, PRIORITY)
+            except (AttributeError, OSError) as e:
+                self._niceness = None
+                self.notes.append('could not raise priority: {}'.format(e))
+
+        if self.cpu is not None:
+            try:
+                self._affinity = os.sched_getaffinity(0)
+                os.sched_setaffinity(0, { self.cpu })
+            except (AttributeError, OSError) as e:
+                self._affinity = None
+                self.notes.append('could not pin to CPU {}: {}'.format(self.cpu, e))
+
+        # Measure again, with all of the above in effect
+        self.probe(self.during)
+
+    def close(self):
+        """Closes the window, undoing open(), and prints the report. Runs on
+        the dispatcher thread.
+        """
+
+        # When finished early, the window may not have opened yet
+        self.scheduler.cancel(self._open_event)
+        if self._output is not None:
+            self._restore()
+
+        print(self.report())
+        self.closed.set()
+
+    def _restore(self):
+        # Undoes open()
+        if self._affinity is not None:
+            os.sched_setaffinity(0, self._affinity)
+        if self._niceness is not None:
+            try:
+                os.setpriority(os.PRIO_PROCESS, 0, self._niceness)
+            except OSError:
+                pass # Lowering it back needs no permission, but be safe
+
+        quickscope.trace.TRACER.resume()
+        quickscope.metrics.METRICS.resume()
+        (stdout, stderr) = (sys.stdout, sys.stderr)
+        (sys.stdout, sys.stderr) = self._output
+        stdout.replay()
+        stderr.replay()
+
+        if hasattr(gc, 'unfreeze'):
+            gc.unfreeze()
+        if self._gc_enabled:
+            gc.enable()
+
+    def report(self):
+        """Returns a human-readable summary of the dispatch lateness before
+        and inside the window.
+        """
+
+        lines = [ 'Dispatch lateness before hot window: {}'.format(format_lateness(self.before)),
+                  'Dispatch lateness in hot window:     {}'.format(format_lateness(self.during)) ]
+        lines.extend('Hot window: {}'.format(note) for note in self.notes)
+        return '\n'.join(lines)
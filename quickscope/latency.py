@@ -0,0 +1,191 @@
+import http.client
+import math
+import socket
+import ssl
+import time
+from collections import namedtuple
+
+# One timed request. All values are in seconds; connect and tls are None for
+# requests sent over a reused connection.
+#   connect -- TCP connect
+#   tls     -- TLS handshake (0 for plain HTTP)
+#   send    -- writing the request
+#   ttfb    -- from the end of the write until the status line and headers were read
+#   total   -- from the start of the write until the whole response was read
+Sample = namedtuple('Sample', ['connect', 'tls', 'send', 'ttfb', 'total'])
+
+# Summary statistics of one phase, after outlier rejection
+Distribution = namedtuple('Distribution', ['count', 'rejected', 'min', 'p50', 'p90', 'p99', 'max', 'mean', 'stddev'])
+
+# Latency estimates the slave can offset its fire times by, as
+# (phase, statistic, factor). The estimate is `statistic(phase) * factor`.
+ESTIMATES = {
+    'send-mean':   ('send', 'mean', 1),   # What time_rename_profile has always returned
+    'one-way-min': ('ttfb', 'min', 0.5),
+    'one-way-p50': ('ttfb', 'p50', 0.5),
+    'one-way-p90': ('ttfb', 'p90', 0.5),
+    'rtt-p50':     ('ttfb', 'p50', 1),
+}
+
+# Samples further than this many (scaled) median absolute deviations from
+# the median are rejected as outliers
+OUTLIER_THRESHOLD = 3.5
+
+def percentile(values, q):
+    """Returns the q-th percentile (0 <= q <= 100) of a sorted list of
+    values, interpolating linearly between the closest ranks.
+    """
+
+    if not values:
+        return None
+
+    rank = (len(values) - 1) * q / 100
+    lower = math.floor(rank)
+    upper = math.ceil(rank)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+def reject_outliers(values, threshold = OUTLIER_THRESHOLD):
+    """Removes outliers using the median absolute deviation (MAD), which,
+    unlike the standard deviation, is not itself skewed by the outliers.
+
+    Returns a tuple of (kept values (sorted), number rejected).
+    """
+
+    values = sorted(values)
+    if len(values) < 3:
+        return (values, 0)
+
+    median = percentile(values, 50)
+    mad = percentile(sorted(abs(value - median) for value in values), 50) * 1.4826
+    if mad == 0:
+        return (values, 0)
+
+    kept = [ value for value in values if abs(value - median) / mad <= threshold ]
+    return (kept, len(values) - len(kept))
+
+def summarize(values, threshold = OUTLIER_THRESHOLD):
+    """Summarizes a list of durations as a Distribution, after rejecting
+    outliers. Returns None if there are no values.
+    """
+
+    (kept, rejected) = reject_outliers(values, threshold)
+    if not kept:
+        return None
+
+    mean = sum(kept) / len(kept)
+    variance = sum((value - mean) ** 2 for value in kept) / len(kept)
+
+    return Distribution(count=len(kept),
+                        rejected=rejected,
+                        min=kept[0],
+                        p50=percentile(kept, 50),
+                        p90=percentile(kept, 90),
+                        p99=percentile(kept, 99),
+                        max=kept[-1],
+                        mean=mean,
+                        stddev=math.sqrt(variance))
+
+def open_connection(url, timeout = None, resolver = None):
+    """Opens a new HTTP(S)Connection to the host of the Url `url`, timing the
+    TCP connect and TLS handshake separately. If a quickscope.resolver
+    Resolver is given, the connection goes to the host's pinned address.
+
+    Returns a tuple of (connection, connect time, TLS time).
+    """
+
+    if timeout is None:
+        timeout = socket.getdefaulttimeout()
+
+    address = url.host if resolver is None else resolver.address(url.host, url.port)
+
+    before = time.perf_counter()
+    sock = socket.create_connection((address, url.port), timeout)
+    connected = time.perf_counter()
+
+    if url.ssl:
+        context = ssl.create_default_context()
+        sock = context.wrap_socket(sock, server_hostname=url.host)
+        conn = http.client.HTTPSConnection(url.host, url.port, context=context)
+    else:
+        conn = http.client.HTTPConnection(url.host, url.port)
+    handshaken = time.perf_counter()
+
+    conn.sock = sock
+    return (conn, connected - before, handshaken - connected)
+
+class Profile:
+    """A set of latency samples, with summary statistics per phase.
+
+    Keyword arguments:
+    threshold -- (optional) outlier rejection threshold; see reject_outliers
+    """
+
+    def __init__(self, threshold = OUTLIER_THRESHOLD):
+        self.threshold = threshold
+        self.samples = []
+
+    def add(self, sample):
+        self.samples.append(sample)
+
+    def add_connect(self, connect, tls):
+        """Records a connect and TLS handshake that was not followed by a
+        timed request.
+        """
+
+        self.samples.append(Sample(connect, tls, None, None, None))
+
+    def time_request(self, request):
+        """Fires a connected PreparedRequest, reads its whole response and
+        records the timings.
+
+        Returns a tuple of (Sample, response status code).
+        """
+
+        request.fire()
+        resp = request.getresponse()
+        head = time.perf_counter()
+        resp.read()
+        end = time.perf_counter()
+
+        sent = request.sent_at + request.send_duration
+        sample = Sample(None, None, request.send_duration, head - sent, end - request.sent_at)
+        self.add(sample)
+        return (sample, resp.status)
+
+    def values(self, phase):
+        """Returns the (sorted) values of one phase, with outliers removed."""
+
+        return reject_outliers([ getattr(sample, phase) for sample in self.samples if getattr(sample, phase) is not None ], self.threshold)[0]
+
+    def summary(self, phase):
+        """Returns a Distribution for one phase (a field of Sample), or None
+        if there are no samples for it.
+        """
+
+        return summarize([ getattr(sample, phase) for sample in self.samples if getattr(sample, phase) is not None ], self.threshold)
+
+    def estimate(self, name):
+        """Returns the latency estimate `name` (a key of ESTIMATES) in
+        seconds, or 0 if there are no samples for it.
+        """
+
+        (phase, statistic, factor) = ESTIMATES[name]
+        summary = self.summary(phase)
+        if summary is None:
+            return 0
+        return getattr(summary, statistic) * factor
+
+    def format(self):
+        """Returns a human-readable table of every phase's distribution, in
+        milliseconds.
+        """
+
+        lines = [ '{:8} {:>5} {:>4} {:>8} {:>8} {:>8} {:>8} {:>8}'.format('phase', 'n', 'rej', 'min', 'p50', 'p90', 'p99', 'stddev') ]
+        for phase in Sample._fields:
+            summary = self.summary(phase)
+            if summary is None:
+                continue
+            lines.append('{:8} {:>5} {:>4} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f}'.format(
+                phase, summary.count, summary.rejected,
+                summary.min * 1000, summary.p50 * 1000, summary.p90 * 1000, summary.p99 * 1000, summary.stddev * 1000))
+        return '\n'.join(lines)
@@ -1,13 +1,15 @@
+import threading
 import time
 import datetime
-import digitalocean
+import uuid as uuidlib
+import quickscope.cache
+import quickscope.control
+import quickscope.fireplan
 import quickscope.mojang
-import quickscope.app
+import quickscope.placement
+import quickscope.provision
 import quickscope.timing
-
-# Commands to be executed on Droplet spawn
-USER_DATA = """#!/bin/bash
-scl enable python33 -- quickscope -u {username} -p {password} {target} {uuid} slave -c {variance} {expiry} >> /home/quickscope.log"""
+import quickscope.warmpool
 
 # How long before the username becomes available to create droplets & run worker tasks
 DROPLET_PREP_TIME = 30 * 60 # 30 mins
@@ -15,18 +17,55 @@ DROPLET_PREP_TIME = 30 * 60 # 30 mins
 # How long after the username becomes available to kill droplets
 DROPLET_KILL_TIME = 10 * 60 # 10 mins
 
-def start(args, username, password, api_key):
-    
-    expiry = quickscope.mojang.get_free_time(args.target)
+# How long before the username becomes available every droplet should be ready
+READY_DEADLINE = 5 * 60 # 5 mins
+
+# How long before the username becomes available fire plans must be sent;
+# slaves need them before they prepare their requests, a minute ahead
+PLAN_DEADLINE = 2 * 60 # 2 mins
+
+# Requests per droplet when planning fire times, if no budget is given
+DEFAULT_REQUESTS_PER_DROPLET = 5
+
+# Slaves' default interval (ms) between requests, when not planning fire times
+DEFAULT_INTERVAL = 20
+
+def prep_time(args):
+    """Returns how many seconds before the username becomes available to
+    create the droplets.
+    """
+
+    return args.prep_time if args.prep_time is not None else DROPLET_PREP_TIME
+
+def start(args, username, password, api_key, provider = None):
+
+    cache = None if args.no_cache else quickscope.cache.NameCache(args.cache or quickscope.cache.DEFAULT_PATH)
+
+    # Several targets: snipe them one after another, keeping droplets warm
+    # in between
+    if args.queue:
+        if not args.control:
+            print('error: --queue needs a control channel (--control)')
+            return
+        targets = load_targets(args, cache)
+        if not targets:
+            print('Cannot quickscope any of these usernames -- they are all taken!')
+            return
+        return _snipe_queue(args, username, password, api_key, targets, _place(args), provider)
+
+    expiry = quickscope.mojang.get_free_time(args.target, cache=cache)
     
     # Ensure we can get the name
     if expiry is None:
         print('Cannot quickscope this username -- it is taken!')
         return
 
+    # Decide where to put the droplets
+    placements = _place(args)
+
     # Calculate time at which to start prep
-    available = expiry + quickscope.app.USERNAME_HOLDING_TIME
-    when = available - DROPLET_PREP_TIME
+    available = expiry + quickscope.mojang.USERNAME_HOLDING_TIME
+    when = available - prep_time(args)
     remaining = when - time.time()
 
     if remaining < 0:
@@ -42,39 +81,76 @@ def start(args, username, password, api_key):
 
     # Start timer to start prep
     print('Started timer to create droplets; timer will execute {}s after now ({})'.format(remaining, datetime.datetime.now().isoformat()))
-    create_timer = quickscope.timing.PreciseTimer(remaining, lambda: _create_droplets(args, username, password, api_key, expiry))
+    created = threading.Event()
+    def create():
+        try:
+            _create_droplets(args, username, password, api_key, expiry, placements, provider)
+        finally:
+            created.set()
+    create_timer = quickscope.timing.PreciseTimer(remaining, create)
     create_timer.start()
 
-def _create_droplets(args, username, password, api_key, expiry):
-    droplets = []
-    available = expiry + quickscope.app.USERNAME_HOLDING_TIME
+    # Wait rather than return: once the main thread has exited, no new thread
+    # pools may be started (Python 3.9+), and creating droplets needs one
+    created.wait()
+
+def load_targets(args, cache = None):
+    """Returns the usernames to snipe in turn: args.target, then those in the
+    file args.queue (one per line; blank lines and lines starting with '#'
+    are ignored). Names that are taken are left out.
+
+    Returns a list of (username, expiry) tuples, soonest available first.
+    """
+
+    names = [ args.target ]
+    with open(args.queue) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#') and line.lower() not in [ name.lower() for name in names ]:
+                names.append(line)
+
+    targets = []
+    for name in names:
+        expiry = quickscope.mojang.get_free_time(name, cache=cache)
+        if expiry is None:
+            print('Cannot quickscope \'{}\' -- it is taken!'.format(name))
+        else:
+            targets.append((name, expiry))
+    return sorted(targets, key=lambda target: target[1])
+
+def _place(args):
+    # Decides where to put the droplets
+    latencies = quickscope.placement.load_latency_table(args.latency_table) if args.latency_table else []
+    placements = quickscope.placement.plan(latencies, args.droplets, args.variances, args.window, args.size or quickscope.placement.DEFAULT_SIZE, args.max_per_region)
+    print(quickscope.placement.format_plan(placements))
+    quickscope.placement.save_plan(args.plan or quickscope.placement.DEFAULT_PLAN_PATH, placements, args.target, latencies)
+    return placements
+
+def _create_droplets(args, username, password, api_key, expiry, placements, provider = None):
+    available = expiry + quickscope.mojang.USERNAME_HOLDING_TIME
+
+    if provider is None:
+        provider = _provider(args, api_key)
+    provisioner = quickscope.provision.Provisioner(provider)
+
+    # Slaves register on the control channel (if any), are sent their
+    # schedule there, and report their results back
+    control = None
+    if args.control:
+        control = _start_control(args, provisioner, _schedules(args, placements, expiry))
 
     print('Beginning droplet creation...')
-    
-    # Create each droplet
-    for i in range(args.droplets):
-        variance = args.variances[i % len(args.variances)]
-        print('Creating droplet {} (variance: {})...'.format(i, variance))
-        droplet = digitalocean.Droplet(token=api_key,
-                                       name='qs-sl-{}'.format(i),
-                                       region='ams2',
-                                       image=args.snapshot,
-                                       size_slug='512mb',
-                                       backups=False,
-                                       user_data=USER_DATA.format(
-                                           username=username,
-                                           password=password,
-                                           target=args.target,
-                                           uuid=args.uuid,
-                                           variance=variance,
-                                           expiry=expiry
-                                        ))
-        droplet.create()
-        droplets.append(droplet)
-
-
-    print('Droplets created. Waiting to kill them...')
-        
+    provisioner.create_all(_droplet_specs(args, username, password, args.target, expiry, placements, control))
+
+    # Wait for the droplets to boot, and report on them before the window
+    print('Droplets created. Waiting for them to boot...')
+    if not provisioner.wait_ready(available - READY_DEADLINE, reported=control is not None):
+        print('Warning: not every droplet is ready')
+    print(provisioner.format_report())
+
+    if control is not None and args.plan_window:
+        _plan_fire_times(args, control, placements, available)
+
     # ... and then schedule to kill them all
     when = available + DROPLET_KILL_TIME
     remaining = when - time.time()
@@ -82,12 +158,195 @@ def _create_droplets(args, username, password, api_key, expiry):
     if remaining < 0:
         remaining = 0
 
+    # With a control channel, kill them as soon as one succeeds or all are done
+    if control is not None:
+        names = [ placement.name for placement in placements ]
+        if control.wait_finished(names, remaining):
+            print('Every slave has finished' if not control.succeeded.is_set() else 'Name claimed')
+        print(_format_readiness(args, provisioner, control))
+        _destroy_droplets(provisioner)
+        control.stop()
+        return provisioner
+
     print('Started timer to kill droplets')
-    destroy_timer = quickscope.timing.PreciseTimer(remaining, lambda: _destroy_droplets(droplets))
+    destroy_timer = quickscope.timing.PreciseTimer(remaining, lambda: _destroy_droplets(provisioner))
     destroy_timer.start()
+    return provisioner
+
+def _snipe_queue(args, username, password, api_key, targets, placements, provider = None):
+    # Snipes each (target, expiry) in turn until one is claimed. Droplets
+    # whose slaves finished a target are kept warm and handed the next one
+    # over the control channel; only missing droplets are created, and idle
+    # ones are destroyed after the idle TTL (see quickscope.warmpool).
+    if provider is None:
+        provider = _provider(args, api_key)
+    provisioner = quickscope.provision.Provisioner(provider)
+    control = _start_control(args, provisioner, {})
+    idle_ttl = args.idle_ttl if args.idle_ttl is not None else quickscope.warmpool.DEFAULT_IDLE_TTL
+    pool = quickscope.warmpool.WarmPool(provisioner, control, idle_ttl)
+    names = [ placement.name for placement in placements ]
+
+    try:
+        for (target, expiry) in targets:
+            available = expiry + quickscope.mojang.USERNAME_HOLDING_TIME
+            print('Next target: \'{}\', available at {}'.format(target, datetime.datetime.fromtimestamp(available).isoformat()))
+            pool.wait(names, available, prep_time(args))
+
+            if available - time.time() < 0:
+                print('Too late to quickscope \'{}\'! Username already expired'.format(target))
+                continue
+            if _snipe_round(args, username, password, provisioner, control, pool, target, expiry, placements):
+                print('Name claimed; skipping the rest of the queue')
+                break
+    finally:
+        pool.close()
+        control.stop()
+    return provisioner
+
+def _snipe_round(args, username, password, provisioner, control, pool, target, expiry, placements):
+    # Snipes one target of a queue with warm droplets where there are any,
+    # creating the rest. Returns whether the name was claimed.
+    available = expiry + quickscope.mojang.USERNAME_HOLDING_TIME
+    names = [ placement.name for placement in placements ]
+
+    control.new_round(_schedules(args, placements, expiry, target))
+    reused = pool.assign(control.schedules)
+    missing = [ placement for placement in placements if placement.name not in reused ]
+    print('Sniping \'{}\' with {} warm droplets; creating {}'.format(target, len(reused), len(missing)))
+
+    if missing:
+        provisioner.create_all(_droplet_specs(args, username, password, target, expiry, missing, control))
+        print('Droplets created. Waiting for them to boot...')
+    if not provisioner.wait_ready(available - READY_DEADLINE, reported=True):
+        print('Warning: not every droplet is ready')
+    print(provisioner.format_report())
+
+    if args.plan_window:
+        _plan_fire_times(args, control, placements, available)
+
+    remaining = max(available + DROPLET_KILL_TIME - time.time(), 0)
+    if control.wait_finished(names, remaining):
+        print('Every slave has finished' if not control.succeeded.is_set() else 'Name claimed')
+    print(_format_readiness(args, provisioner, control, dict(pool.assigned)))
+
+    # Nothing is left to snipe once the name is claimed
+    claimed = control.succeeded.is_set()
+    if claimed:
+        pool.retire(names)
+    else:
+        pool.settle(names)
+        print(pool.format_status())
+    return claimed
+
+def _plan_fire_times(args, control, placements, available):
+    # Plans every slave's fire times together from their measured arrival
+    # errors (see quickscope.fireplan) and sends each slave its offsets.
+    # Slaves that send no measurements in time plan for themselves.
+    names = [ placement.name for placement in placements ]
+    print('Waiting for slaves\' measurements...')
+    workers = control.wait_measurements(names, max(available - PLAN_DEADLINE - time.time(), 0))
+    if not workers:
+        print('Warning: no slave sent measurements; slaves will plan their own fire times')
+        return
+
+    budget = args.budget or DEFAULT_REQUESTS_PER_DROPLET * len(workers)
+    schedule = quickscope.fireplan.plan(workers, budget, args.plan_window)
+    print('Fire plan ({} requests over {} slaves):'.format(budget, len(workers)))
+    print(quickscope.fireplan.format_plan(schedule, workers, args.plan_window))
+
+    # Compare with what the variances alone would have done
+    measured = [ placement for placement in placements if placement.name in workers ]
+    static = quickscope.fireplan.static_plan([ placement.name for placement in measured ], [ placement.variance for placement in measured ],
+                                             DEFAULT_INTERVAL, DEFAULT_REQUESTS_PER_DROPLET)
+    planned = quickscope.fireplan.simulate(schedule, workers, args.plan_window)
+    unplanned = quickscope.fireplan.simulate(static, workers, args.plan_window)
+    print('Simulated hit rate: {:.1%} planned, {:.1%} with variances only'.format(planned['hit_rate'], unplanned['hit_rate']))
+
+    for (name, offsets) in schedule.items():
+        if not control.push_offsets(name, offsets):
+            print('Warning: could not send fire plan to slave {}'.format(name))
+
+def _format_readiness(args, provisioner, control, assigned = None):
+    # How long each droplet took from being created (or, if it was reused
+    # from the warm pool, handed its target) until its slave was logged in
+    # and calibrated, to tune --prep-time by
+    assigned = assigned or {}
+    (times, reused) = ([], [])
+    for worker in provisioner.all:
+        slave = control.slaves.get(worker.name)
+        started = assigned.get(worker.name, worker.created_at)
+        if started is not None and slave is not None and slave.ready_at is not None:
+            (reused if worker.name in assigned else times).append(slave.ready_at - started)
+
+    lines = []
+    if times:
+        lines.append('Slaves were ready {:.0f}s to {:.0f}s after their droplets were created (prep time: {}s)'.format(min(times), max(times), prep_time(args)))
+    if reused:
+        lines.append('Warm slaves were ready {:.0f}s to {:.0f}s after being handed their target'.format(min(reused), max(reused)))
+    return '\n'.join(lines) or 'No slave reported being ready'
+
+def _schedules(args, placements, expiry, target = None):
+    # What to push to each slave over the control channel. With a target,
+    # slaves are told to snipe it and then wait for another (see
+    # quickscope.warmpool).
+    schedules = dict((placement.name, { 'expiry': expiry, 'variance': placement.variance }) for placement in placements)
+    for schedule in schedules.values():
+        if args.plan_window:
+            # Slaves send their arrival error samples and wait to be told when to fire
+            schedule.update(plan_window=args.plan_window, measure=True)
+        if target is not None:
+            schedule.update(target=target, warm=True)
+    return schedules
+
+def _start_control(args, provisioner, schedules):
+    # Listens on args.control, checking slaves in with `provisioner`
+    port = quickscope.control.parse_address(args.control)[1]
+    # Listen on every interface, as the droplets connect from elsewhere
+    control = quickscope.control.ControlServer(uuidlib.uuid4().hex, host='0.0.0.0', port=port, schedules=schedules,
+                                               on_register=lambda slave: provisioner.checkin(slave.name, slave.address))
+    control.start()
+    print('Control channel listening on port {}'.format(control.address[1]))
+    return control
+
+def _droplet_specs(args, username, password, target, expiry, placements, control = None):
+    # One DropletSpec per placement, whose slave snipes `target`
+    specs = []
+    for placement in placements:
+        specs.append(quickscope.provision.DropletSpec(name=placement.name,
+                                                      region=placement.region,
+                                                      image=args.snapshot,
+                                                      size=placement.size,
+                                                      argv=slave_arguments(args, username, password, target, expiry, placement, control)))
+    return specs
+
+def slave_arguments(args, username, password, target, expiry, placement, control = None):
+    """Returns the arguments (of the quickscope command) to run the slave of
+    `placement` with, sniping `target`. The master's own endpoint and rate
+    limiting options are passed on.
+    """
+
+    arguments = [ '-u', username, '-p', password ]
+    if args.endpoint:
+        arguments += [ '--endpoint', args.endpoint ]
+    if args.no_rate_limit:
+        arguments.append('--no-rate-limit')
+    if args.no_pin:
+        arguments.append('--no-pin')
+
+    arguments += [ 'slave', target, args.uuid, '-c', str(placement.variance) ]
+    if control is not None:
+        host = quickscope.control.parse_address(args.control)[0]
+        arguments += [ '--master', '{}:{}'.format(host, control.address[1]), '--name', placement.name, '--token', control.token ]
+    arguments.append(str(expiry))
+    return arguments
+
+def _provider(args, api_key):
+    # Where the workers run: droplets, or processes on this machine
+    if args.backend == 'local':
+        return quickscope.provision.LocalProvider(args.log_dir or quickscope.provision.DEFAULT_LOG_DIR)
+    return quickscope.provision.DigitalOceanProvider(api_key)
 
-def _destroy_droplets(droplets):
+def _destroy_droplets(provisioner):
     print('Beginning droplet destruction...')
-    for droplet in droplets:
-        droplet.destroy()
+    provisioner.destroy_all()
     print('Droplet destruction initiated!')
@@ -0,0 +1,252 @@
+import collections
+import threading
+
+# In-process metrics (counters, gauges and histograms), served over HTTP in
+# the Prometheus text format. Metrics are disabled (updates do nothing) until
+# serve() is called.
+#
+# Updates only append to a queue, which needs no lock (deque.append is
+# atomic), so they are safe to make on the fire path; the queue is folded
+# into the totals whenever the metrics are read.
+
+# Content type of the Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Default address the metrics are served on
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 9456
+
+# Bucket bounds (seconds) of histograms of request durations
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Bucket bounds (seconds) of histograms of timing errors; fire errors can be
+# negative
+ERROR_BUCKETS = (-0.01, -0.001, 0, 0.0001, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.05, 0.1)
+
+def format_value(value):
+    # Prometheus spells infinities and integers its own way
+    if value == float('inf'):
+        return '+Inf'
+    if value == -float('inf'):
+        return '-Inf'
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+def format_labels(names, values, extra = ()):
+    # {name="value",...}, escaping values as the text format requires
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join('{}="{}"'.format(name, escape(value)) for (name, value) in pairs) + '}'
+
+class Metric:
+    """Base class of the metric types. Create metrics with the Registry's
+    counter(), gauge() and histogram() methods.
+    """
+
+    kind = None
+
+    def __init__(self, registry, name, help, labels = ()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {} # Label values tuple -> value; only read under the registry's lock
+
+    def _update(self, operation, value, labels):
+        # Runs on the updating thread: queue the update, nothing else
+        if self.registry.enabled:
+            self.registry._updates.append((self, operation, value, tuple(str(labels.get(name, '')) for name in self.labels)))
+
+    def _apply(self, operation, value, key):
+        # Runs under the registry's lock
+        if operation == 'set':
+            self.values[key] = value
+        else:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def samples(self):
+        """Returns a list of (name suffix, label values, extra labels, value)
+        tuples.
+        """
+
+        return [ ('', key, (), value) for (key, value) in sorted(self.values.items()) ]
+
+class Counter(Metric):
+    """A value that only goes up."""
+
+    kind = 'counter'
+
+    def inc(self, amount = 1, **labels):
+        self._update('add', amount, labels)
+
+class Gauge(Metric):
+    """A value that can go up and down."""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self._update('set', value, labels)
+
+    def inc(self, amount = 1, **labels):
+        self._update('add', amount, labels)
+
+    def dec(self, amount = 1, **labels):
+        self._update('add', -amount, labels)
+
+class Histogram(Metric):
+    """Counts of observed values (e.g. durations) in buckets, with their sum.
+
+    Keyword arguments:
+    buckets -- Upper bounds of the buckets, ascending; +Inf is added
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labels = (), buckets = DURATION_BUCKETS):
+        Metric.__init__(self, registry, name, help, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        self._update('observe', value, labels)
+
+    def _apply(self, operation, value, key):
+        if key not in self.values:
+            self.values[key] = ([ 0 ] * len(self.buckets), [ 0, 0 ]) # (bucket counts, [sum, count])
+        (counts, totals) = self.values[key]
+        for (i, bound) in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        totals[0] += value
+        totals[1] += 1
+
+    def samples(self):
+        samples = []
+        for (key, (counts, totals)) in sorted(self.values.items()):
+            cumulative = 0
+            for (bound, count) in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(('_bucket', key, (('le', format_value(bound)),), cumulative))
+            samples.append(('_sum', key, (), totals[0]))
+            samples.append(('_count', key, (), totals[1]))
+        return samples
+
+class Registry:
+    """A set of metrics, and the queue of updates to them."""
+
+    def __init__(self):
+        self.enabled = False
+        self.metrics = []
+        self._updates = collections.deque()
+        self._paused = False
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labels = ()):
+        return self._add(Counter(self, name, help, labels))
+
+    def gauge(self, name, help, labels = ()):
+        return self._add(Gauge(self, name, help, labels))
+
+    def histogram(self, name, help, labels = (), buckets = DURATION_BUCKETS):
+        return self._add(Histogram(self, name, help, labels, buckets))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def pause(self):
+        """Stops folding queued updates (e.g. during the fire window) until
+        resume() is called; reads return the totals as they were. Updates
+        are still queued.
+        """
+
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+
+    def collect(self):
+        """Folds the queued updates into the totals."""
+
+        with self._lock:
+            if self._paused:
+                return
+            while self._updates:
+                (metric, operation, value, key) = self._updates.popleft()
+                metric._apply(operation, value, key)
+
+    def format(self):
+        """Returns every metric in the Prometheus text format."""
+
+        self.collect()
+        lines = []
+        with self._lock:
+            for metric in self.metrics:
+                lines.append('# HELP {} {}'.format(metric.name, metric.help.replace('\\', '\\\\').replace('\n', '\\n')))
+                lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+                for (suffix, key, extra, value) in metric.samples():
+                    lines.append('{}{}{} {}'.format(metric.name, suffix, format_labels(metric.labels, key, extra), format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+def serve(address, registry = None):
+    """Enables `registry` (by default, METRICS) and serves it on `address`, a
+    (host, port) tuple, from a background thread: GET /metrics returns every
+    metric in the Prometheus text format.
+
+    Returns the HTTP server; its server_address is the address it is
+    listening on.
+    """
+
+    import http.server
+    import socketserver
+
+    if registry is None:
+        registry = METRICS
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.format().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    server = Server(address, Handler)
+    thread = threading.Thread(target=server.serve_forever, name='quickscope-metrics')
+    thread.daemon = True
+    thread.start()
+    registry.enabled = True
+    return server
+
+# ========================================
+#
+#                METRICS
+#
+# ========================================
+# Metrics of quickscope.mojang, quickscope.session, quickscope.slave,
+# quickscope.slave_async and quickscope.provision go here
+METRICS = Registry()
+
+API_REQUESTS = METRICS.counter('quickscope_api_requests_total', 'Mojang API requests, by endpoint (path) and response status', ['endpoint', 'status'])
+API_DURATION = METRICS.histogram('quickscope_api_request_seconds', 'Time to send a Mojang API request and read its response, by endpoint (path)', ['endpoint'])
+LOGINS = METRICS.counter('quickscope_logins_total', 'Logins to Mojang accounts, by result', ['result'])
+LOGIN_RETRIES = METRICS.counter('quickscope_login_retries_total', 'Logins attempted again after a failed login or a rejected session')
+WAKE_ERROR = METRICS.histogram('quickscope_timer_wake_error_seconds', 'How late the timer woke to fire each rename request', buckets=ERROR_BUCKETS)
+FIRE_ERROR = METRICS.histogram('quickscope_fire_error_seconds', 'When each rename request was sent, relative to its scheduled time', buckets=ERROR_BUCKETS)
+RESPONSES = METRICS.counter('quickscope_rename_responses_total', 'Responses to rename requests, by status (\'error\' if none could be read)', ['status'])
+DROPLETS = METRICS.gauge('quickscope_droplets', 'Worker droplets in each provisioning state', ['state'])
+DROPLET_EVENTS = METRICS.counter('quickscope_droplet_events_total', 'Worker droplets created, failed to be created, and destroyed', ['event'])
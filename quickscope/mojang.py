@@ -4,6 +4,14 @@ import json
 import http.cookies
 import time
 from collections import namedtuple
+import quickscope.latency
+import quickscope.metrics
+import quickscope.pool
+import quickscope.prepared
+import quickscope.ratelimit
+import quickscope.resolver
+import quickscope.trace
+from quickscope.ratelimit import PRIORITY_CRITICAL, PRIORITY_NORMAL
 
 # ========================================
 #
@@ -27,6 +35,24 @@ URL_RENAME_PROFILE = Url(True, 'account.mojang.com', 443, '/me/renameProfile/{uu
 # Dummy User-Agent string
 USER_AGENT = 'Mozilla/5.0 (Windows NT 6.1; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/48.0.2564.116 Safari/537.36'
 
+# Addresses of the Mojang hosts, resolved ahead of time and pinned
+RESOLVER = quickscope.resolver.Resolver()
+
+# Keep-alive connection pools, one per host; shared by all API functions
+POOLS = quickscope.pool.PoolManager(resolver=RESOLVER)
+
+# Client-side rate limiting of every request sent with send_request
+LIMITER = quickscope.ratelimit.RateLimiter()
+
+# Number of fresh connections opened to time the TCP connect and TLS handshake
+CONNECT_SAMPLES = 3
+
+# Maximum number of owners get_free_time follows a name through
+MAX_OWNERS = 1000
+
+# Seconds that a username is held by Mojang for after 'expiry' (37 days)
+USERNAME_HOLDING_TIME = 37 * 24 * 60 * 60
+
 # ========================================
 #
 #               HELPERS
@@ -34,18 +60,75 @@ USER_AGENT = 'Mozilla/5.0 (Windows NT 6.1; Win64; x64) AppleWebKit/537.36 (KHTML
 # ========================================
 def create_connection(url):
     """Creates an HTTPConnection or HTTPSConnection instance using the
-    parameters in the Url `url`.
+    parameters in the Url `url`, connecting to the host's pinned address
+    (see mojang#RESOLVER).
 
     Keyword arguments:
     url -- Url tuple
     """
     
-    if url.ssl:
-        conn = http.client.HTTPSConnection(url.host, url.port)
-        #conn.set_tunnel(url.host, url.port)
-        return conn
-    else:
-        return http.client.HTTPConnection(url.host, url.port)
+    return RESOLVER.connection(url.ssl, url.host, url.port)
+
+def endpoints():
+    """Returns the set of (host, port) pairs of every Mojang endpoint."""
+
+    return set((url.host, url.port) for url in (URL_NAMES, URL_UUID_AT, URL_LOGIN, URL_RENAME_PROFILE))
+
+def set_endpoints(ssl, host, port):
+    """Points every Mojang endpoint (the URL_ constants) at another server,
+    keeping their paths. Used to run against a local stand-in server (see
+    quickscope.fakeserver).
+
+    Keyword arguments:
+    ssl -- Whether the server uses HTTPS
+    host -- Host name or address of the server
+    port -- Port of the server
+    """
+
+    global URL_NAMES, URL_UUID_AT, URL_LOGIN, URL_RENAME_PROFILE
+
+    URL_NAMES          = Url(ssl, host, port, URL_NAMES.path)
+    URL_UUID_AT        = Url(ssl, host, port, URL_UUID_AT.path)
+    URL_LOGIN          = Url(ssl, host, port, URL_LOGIN.path)
+    URL_RENAME_PROFILE = Url(ssl, host, port, URL_RENAME_PROFILE.path)
+
+def send_request(url, method, path, body = None, headers = None, priority = PRIORITY_NORMAL):
+    """Sends a request to the host of the Url `url` over a pooled keep-alive
+    connection (see mojang#POOLS) and reads the whole response.
+
+    The request waits for the host's rate limit budget first (see
+    mojang#LIMITER); a 429 response empties the budget.
+
+    Keyword arguments:
+    url -- Url tuple of the host to send the request to
+    method -- HTTP method, e.g. 'GET'
+    path -- Request path (including any query string)
+    body -- (optional) Request body
+    headers -- (optional) Dictionary of request headers
+    priority -- (optional) Rate limit priority class (see quickscope.ratelimit)
+
+    Returns a tuple of (status code, headers, data)
+    """
+
+    LIMITER.acquire(url, priority)
+    before = time.perf_counter()
+    pool = POOLS.get(url)
+    endpoint = url.path.split('?', 1)[0]
+    try:
+        result = pool.request(method, path, body, headers)
+    except (http.client.HTTPException, OSError):
+        quickscope.metrics.API_REQUESTS.inc(endpoint=endpoint, status='error')
+        raise
+    if result[0] == 429:
+        LIMITER.limited(url)
+
+    quickscope.metrics.API_REQUESTS.inc(endpoint=endpoint, status=result[0])
+    quickscope.metrics.API_DURATION.observe(time.perf_counter() - before, endpoint=endpoint)
+
+    tracer = quickscope.trace.TRACER
+    tracer.emit('request', method=method, url='{}{}'.format(url.host, path), status=result[0],
+                address=pool.last_peer(), start=tracer.wall(before), duration=time.perf_counter() - before, priority=priority)
+    return result
 
 def get_cookies(headers):
     """Obtains cookies from a set of HTTP headers. The headers are scanned
@@ -88,7 +171,7 @@ def get_login_error(result):
 #              API FUNCTIONS
 #
 # ========================================
-def api_uuid_at(username, timestamp):
+def api_uuid_at(username, timestamp, priority = PRIORITY_NORMAL):
     """Sends an HTTP(S) request to the Mojang API to retrieve the UUID of
     a player at the given time. If the player's name has not changed and
     the account is not legacy, a response code of 204 is returned.
@@ -97,39 +180,27 @@ def api_uuid_at(username, timestamp):
     username  -- Username of player to find UUID of
     timestamp -- Unix timestamp (seconds) of the time to check for the player's
                  UUID at. 0 seconds will retrieve the original username.
+    priority  -- (optional) Rate limit priority class (see quickscope.ratelimit)
 
     Returns a tuple of (status code, data) (where data is binary string of JSON)
     """
-    conn = create_connection(URL_UUID_AT)
+    (status, _, data) = send_request(URL_UUID_AT, 'GET', URL_UUID_AT.path.format(username=username, timestamp=timestamp), priority=priority)
 
-    # Send request
-    conn.request('GET', URL_UUID_AT.path.format(username=username, timestamp=timestamp))
-    resp = conn.getresponse()
+    return (status, data)
 
-    # Read response
-    data = resp.read()
-    
-    return (resp.status, data)
-
-def api_names(uuid):
+def api_names(uuid, priority = PRIORITY_NORMAL):
     """Sends an HTTP(S) request to the Mojang API to retrieve all the username
     changes of a player of the given UUID `uuid`. UUID must be without hyphens.
 
     Keyword arguments:
     uuid -- UUID of player to find name history of (without hyphens)
+    priority -- (optional) Rate limit priority class (see quickscope.ratelimit)
 
     Returns a tuple of (status code, data) (where data is a binary string of JSON)
     """
-    conn = create_connection(URL_NAMES)
-
-    # Send request
-    conn.request('GET', URL_NAMES.path.format(uuid=uuid))
-    resp = conn.getresponse()
+    (status, _, data) = send_request(URL_NAMES, 'GET', URL_NAMES.path.format(uuid=uuid), priority=priority)
 
-    # Read response
-    data = resp.read()
-
-    return (resp.status, data)
+    return (status, data)
 
 def api_get_login():
     """Sends a GET request to the /login endpoint on Mojang's accounts site.
@@ -142,12 +213,9 @@ def api_get_login():
     Returns a tuple of (status code, headers), where headers is a (key,value) list.
     """
     
-    conn = create_connection(URL_LOGIN)
-
-    conn.request('GET', URL_LOGIN.path, None, { 'User-Agent': USER_AGENT })
-    resp = conn.getresponse()
+    (status, headers, _) = send_request(URL_LOGIN, 'GET', URL_LOGIN.path, None, { 'User-Agent': USER_AGENT }, PRIORITY_CRITICAL)
 
-    return (resp.status, resp.getheaders())
+    return (status, headers)
 
 def api_login(username, password, authenticity_token):
     """Attempts to login to Mojang and create a session with the given
@@ -169,10 +237,8 @@ def api_login(username, password, authenticity_token):
     Returns a tuple of (response status code, response headers)
     """
     
-    conn = create_connection(URL_LOGIN)
-
     # Send request with parameters to login and fake User-Agent string
-    conn.request('POST', URL_LOGIN.path, urllib.parse.urlencode({
+    (status, headers, _) = send_request(URL_LOGIN, 'POST', URL_LOGIN.path, urllib.parse.urlencode({
         'username': username,
         'password': password,
         'authenticityToken': authenticity_token,
@@ -184,10 +250,9 @@ def api_login(username, password, authenticity_token):
         'Origin': 'https://account.mojang.com',
         'Accept-Encoding': 'gzip, deflate',
         'Content-Type': 'application/x-www-form-urlencoded'
-    })
-    resp = conn.getresponse()
+    }, PRIORITY_CRITICAL)
 
-    return (resp.status, resp.getheaders())
+    return (status, headers)
 
 def api_get_rename_profile(uuid, login_cookies):
     """Sends a GET request for the rename profile page. This does not
@@ -206,15 +271,12 @@ def api_get_rename_profile(uuid, login_cookies):
     Returns a tuple of (response status code, response headers)
     """
     
-    conn = create_connection(URL_RENAME_PROFILE)
-
-    conn.request('GET', URL_RENAME_PROFILE.path.format(uuid=uuid), None, {
+    (status, headers, _) = send_request(URL_RENAME_PROFILE, 'GET', URL_RENAME_PROFILE.path.format(uuid=uuid), None, {
         'User-Agent': USER_AGENT,
         'Cookie': login_cookies.output(attrs=[], header='', sep='; ')
-    })
-    resp = conn.getresponse()
+    }, PRIORITY_CRITICAL)
 
-    return (resp.status, resp.getheaders())
+    return (status, headers)
 
 # ========================================
 #
@@ -222,7 +284,7 @@ def api_get_rename_profile(uuid, login_cookies):
 #  (ones that do something with the API)
 #
 # ========================================
-def get_free_time(username, prev_time = 0):
+def get_free_time(username, prev_time = 0, cache = None, priority = PRIORITY_NORMAL):
     """Gets the time at which a username was 'freed' from a user.
     This is the latest time when the user who owns the username
     changed their name to something else, thus 'freeing' the username
@@ -235,7 +297,9 @@ def get_free_time(username, prev_time = 0):
 
     Note that requests to Mojang APIs are rate limited to 600 requests
     per 10 minutes. The number of requests that this function involves
-    is unknown, and could possibly exceed this.
+    is unknown, and could possibly exceed this. Passing a cache
+    (quickscope.cache.NameCache) avoids repeating requests whose results
+    are still fresh.
 
     If retrieving this information is not possible, a value of None is
     returned. Reasons for this return value:
@@ -249,61 +313,97 @@ def get_free_time(username, prev_time = 0):
     username changed their name to something else, thus freeing the
     name. Adding 37 days to this value will yield the time that a
     username becomes freely available to register.
-    """
-    # Get UUID at time
-    (code, data) = api_uuid_at(username, prev_time)
-
-    # If we hit a non-OK response, return the previous UUID
-    # - this can indicate that it is not possible to get their
-    # UUID (due to non-legacy/no name changes) or that we hit the
-    # latest record for it, which is that nobody owns the name
-    if code != 200:
-        # Subtract 1 from prev_time as 1 was added
-        return None if prev_time == 0 else prev_time - 1
-
-    # Ensure data is not empty at this point
-    if len(data) == 0:
-        return None
 
-    # Parse JSON data    
-    json_data = json.loads(data.decode())
-    uuid = json_data['id']
-
-    # Get player's username history
-    (code, data) = api_names(uuid)
-
-    # Function failed; UUID is invalid (should be impossible) or Mojang
-    # didn't feel like giving us a meaningful response. 
-    if code != 200:
+    Keyword arguments:
+    username -- Username to check
+    prev_time -- (optional) Unix timestamp (seconds) to start following owners from
+    cache -- (optional) quickscope.cache.NameCache to read and store API results in
+    priority -- (optional) Rate limit priority class of the requests (see quickscope.ratelimit)
+    """
+    # Follow the name from owner to owner, starting with the owner at
+    # `prev_time`
+    timestamp = prev_time
+    for i in range(MAX_OWNERS):
+        (code, uuid) = _uuid_at(username, timestamp, cache, priority)
+
+        # If we hit a non-OK response, return the previous time - this
+        # can indicate that it is not possible to get their UUID (due to
+        # non-legacy/no name changes) or that we hit the latest record
+        # for it, which is that nobody owns the name
+        if code != 200:
+            # Subtract 1 from timestamp as 1 was added
+            return None if timestamp == 0 else timestamp - 1
+
+        # Ensure we got a UUID at this point
+        if uuid is None:
+            return None
+
+        # Get player's username history. This fails if the UUID is invalid
+        # (should be impossible) or Mojang didn't feel like giving us a
+        # meaningful response.
+        history = _names(uuid, cache, priority)
+        if history is None:
+            return None
+
+        changed_to = 0
+        prev_name  = ''
+
+        # Iterate over each username change
+        for change in history:
+
+            # Update changed to if the previous name was the username
+            # and the changed to time is greater than our stored one
+            if prev_name.lower() == username.lower() \
+            and 'changedToAt' in change \
+            and change['changedToAt'] > changed_to:
+                changed_to = change['changedToAt']
+
+            prev_name = change['name']
+
+        # If the username has been changed from the one we want, look up
+        # the owner at the time it was changed + 1 second (to get the new
+        # username owner). Stop if that would not move forward in time.
+        next_timestamp = (changed_to // 1000) + 1
+        if changed_to <= 0 or next_timestamp <= timestamp:
+            return None
+
+        timestamp = next_timestamp
+
+    return None
+
+def _uuid_at(username, timestamp, cache, priority):
+    # Returns (status code, UUID or None) for the owner of `username` at
+    # `timestamp`, from the cache if fresh
+    if cache is not None:
+        cached = cache.get_uuid_at(username, timestamp)
+        if cached is not None:
+            return cached
+
+    (code, data) = api_uuid_at(username, timestamp, priority)
+    uuid = json.loads(data.decode())['id'] if code == 200 and len(data) > 0 else None
+
+    # Only cache answers, not errors (e.g. rate limiting)
+    if cache is not None and code in (200, 204):
+        cache.put_uuid_at(username, timestamp, code, uuid)
+
+    return (code, uuid)
+
+def _names(uuid, cache, priority):
+    # Returns the name history of `uuid`, from the cache if fresh, or None
+    if cache is not None:
+        history = cache.get_names(uuid)
+        if history is not None:
+            return history
+
+    (code, data) = api_names(uuid, priority)
+    if code != 200 or len(data) == 0:
         return None
 
-    if len(data) == 0:
-        return None
+    history = json.loads(data.decode())
+    if cache is not None:
+        cache.put_names(uuid, history)
 
-    # Parse JSON data and sort by changed date
-    history    = json.loads(data.decode())
-    changed_to = 0
-    prev_name  = ''
-
-    # Iterate over each username change
-    for change in history:
-
-        # Update changed to if the previous name was the username
-        # and the changed to time is greater than our stored one
-        if prev_name.lower() == username.lower() \
-        and 'changedToAt' in change \
-        and change['changedToAt'] > changed_to:
-            changed_to = change['changedToAt']
-            
-        prev_name = change['name']
-
-    # If the username has been changed from the one we want, recursively
-    # call this function with the time it was changed + 1 second (to get
-    # the new username owner).
-    if changed_to > 0:
-        return get_free_time(username, (changed_to // 1000) + 1)
-    else:
-        return None
+    return history
 
 def get_authenticity_token(headers):
     """Attempts to retrieve an authenticity token from a set of
@@ -364,15 +464,34 @@ def login(username, password):
     # Attempt to login
     return api_login(username, password, at)
 
-def rename_profile_later(username, password, uuid, new_name, login_cookies = None):
-    """Prepares a request to rename a profile. This will login, if necessary (i.e
-    if login_cookies is None); get an authenticity token to rename the profile;
-    create an HTTP(S) connection to rename a profile; prepare the headers and data
-    to be sent with the request; and create an anonymous function that will send
-    the request.
+def get_rename_token(uuid, login_cookies):
+    """Fetches an authenticity token with which to rename a profile.
 
-    Note that the request is not actually sent - the function to send it is returned
-    from this function, so that the request can be sent 'later'.
+    Keyword arguments:
+    uuid -- UUID of Minecraft account
+    login_cookies -- Login cookies (see mojang#get_cookies)
+
+    Returns a tuple of (authenticity token, cookies), where cookies is the
+    http.cookies.SimpleCookie() that must be sent with the token; or None if
+    no token was given (e.g. because the login has expired).
+    """
+
+    (status, headers) = api_get_rename_profile(uuid, login_cookies)
+    at = get_authenticity_token(headers)
+    if at is None:
+        return None
+    return (at, get_cookies(headers))
+
+def rename_profile_later(username, password, uuid, new_name, login_cookies = None, token = None):
+    """Prepares a request to rename a profile. Unless a token is given, this
+    will login, if necessary (i.e if login_cookies is None), and get an
+    authenticity token to rename the profile; it then opens an HTTP(S)
+    connection to rename a profile, and serializes the complete request
+    (headers and data) into a PreparedRequest.
+
+    Note that the request is not actually sent - calling fire() on the returned
+    PreparedRequest sends it, so that the request can be sent 'later' with a
+    single write on the already connected socket.
 
     Keyword arguments:
     username -- Mojang username
@@ -380,15 +499,20 @@ def rename_profile_later(username, password, uuid, new_name, login_cookies = Non
     uuid -- UUID of Minecraft account
     new_name -- New (desired) username
     login_cookies -- (optional) login cookies obtained via calling mojang#get_cookies on a login response
-
-    Returns a tuple of (f, connection, login_cookies), where:
-       f -- anonymous function f(connection), where connection is an http.client.HTTP(S)Connection
-       connection -- HTTPSConnection instance obtained via create_connection; connected to rename profile page
+    token -- (optional) A (authenticity token, cookies) tuple, as returned by
+             mojang#get_rename_token (or a quickscope.session.RenameToken), to
+             use instead of fetching one
+
+    Returns a tuple of (request, connection, login_cookies), where:
+       request -- quickscope.prepared.PreparedRequest, already connected
+       connection -- HTTPSConnection instance taken from the rename profile pool (see mojang#POOLS);
+                     the caller owns it, and may return it with request.release(POOLS.get(URL_RENAME_PROFILE))
        login_cookies -- The generated login cookies, if none were passed.
+    If something fails, (False, error message, None) is returned instead.
     """
     
     # Login if needed to
-    if login_cookies is None:
+    if login_cookies is None and token is None:
 
         # Attempt login
         result = login(username, password)
@@ -402,15 +526,22 @@ def rename_profile_later(username, password, uuid, new_name, login_cookies = Non
         login_cookies = get_cookies(result[1])
 
     # Get authenticity token for renaming profile
-    (status, headers) = api_get_rename_profile(uuid, login_cookies)
-    at = get_authenticity_token(headers)
+    if token is None:
+        token = get_rename_token(uuid, login_cookies)
 
     # Handle failure to get auth token
-    if at is None:
+    if token is None:
         return (False, 'Failed to get second authenticity token', None)
+    (at, token_cookies) = token[:2]
+
+    # The request is sent later, outside send_request, so take its rate
+    # limit budget now
+    LIMITER.acquire(URL_RENAME_PROFILE, PRIORITY_CRITICAL)
 
-    # Create parameters for request to rename profile in advance
-    conn = create_connection(URL_RENAME_PROFILE)
+    # Build the request to rename profile in advance. The connection is
+    # taken from the pool, so it is normally one that was used to fetch
+    # tokens and is already connected.
+    conn = POOLS.get(URL_RENAME_PROFILE).acquire()
     path = URL_RENAME_PROFILE.path.format(uuid=uuid)
     data = urllib.parse.urlencode({
         'newName': new_name,
@@ -420,18 +551,24 @@ def rename_profile_later(username, password, uuid, new_name, login_cookies = Non
     headers = {
         'User-Agent': USER_AGENT,
         'Content-Type': 'application/x-www-form-urlencoded',
-        'Cookie': get_cookies(headers).output(attrs=[], header='', sep='; ')
+        'Cookie': token_cookies.output(attrs=[], header='', sep='; ')
     }
 
-    def execute(conn):
-        conn.request('POST', path, data, headers)
+    request = quickscope.prepared.PreparedRequest(conn, 'POST', path, data, headers)
+    try:
+        request.connect()
+    except OSError as e:
+        request.close()
+        return (False, 'Failed to connect: {}'.format(e), None)
 
-    return (execute, conn, login_cookies)
+    return (request, conn, login_cookies)
         
-def time_rename_profile(number, username, password, uuid, login_cookies = None):
-    """Attempts to gauge how long it will take for a round trip of renaming a profile via
-    Mojang's (obscured) API. This will send a number of requests to the URL with dummy
-    data. The username and password are required to login if login_cookies is None.
+def profile_rename_profile(number, username, password, uuid, login_cookies = None):
+    """Measures the latency of renaming a profile via Mojang's (obscured) API,
+    phase by phase (see quickscope.latency.Sample). A few fresh connections
+    are opened to time the TCP connect and TLS handshake; `number` requests
+    with dummy data are then sent over the reused, pooled connection, and
+    each one's response is read in full.
 
     Note that this will not actually rename the profile; instead, dummy data is passed:
     the password is blank and the username is 'Notch'.
@@ -443,36 +580,74 @@ def time_rename_profile(number, username, password, uuid, login_cookies = None):
     uuid -- UUID of Minecraft account that will be renamed
     login_cookies -- Existing login_cookies (see mojang#get_cookies)
 
-    Returns the average round-trip time to rename a profile, or 0 if something failed
-    (e.g. could not connect, could not login)
+    Returns a quickscope.latency.Profile, or None if something failed (e.g.
+    could not connect, could not login)
     """
-    
+
+    profile = quickscope.latency.Profile()
     if number <= 0:
-        return 0
+        return profile
 
     # Login if necessary
     if not login_cookies:
         result = login(username, password)
-        if not result \
-        or result[0] != 200 and result[0] != 302 \
-        or len([ header for header in result[1] if header[0].lower() == 'location' and header[1].lower()[-6:] == URL_LOGIN.path ]) > 0:
+        if get_login_error(result) is not None:
             print(result)
-            return 0
+            return None
 
         login_cookies = get_cookies(result[1])
 
-    total = 0
+    pool = POOLS.get(URL_RENAME_PROFILE)
+
+    # Time fresh connections; the last one is left in the pool for the
+    # requests below
+    for i in range(min(number, CONNECT_SAMPLES)):
+        try:
+            (conn, connect, tls) = quickscope.latency.open_connection(URL_RENAME_PROFILE, resolver=RESOLVER)
+        except OSError as e:
+            print('Failed to connect: {}'.format(e))
+            return None
 
-    # Send fake logins `number` times
+        profile.add_connect(connect, tls)
+        pool.release(conn)
+
+    # Send fake renames `number` times
     for i in range(number):
         # Generate request (not timed)
         (fake_rename, conn, _) = rename_profile_later(username, '', uuid, 'Notch', login_cookies)
+        if fake_rename == False:
+            print(conn)
+            return None
 
-        # Start timing and execute
-        before = time.perf_counter()
-        fake_rename(conn)
-        after = time.perf_counter()
-        
-        total += (after - before)
+        try:
+            profile.time_request(fake_rename)
+        except (http.client.HTTPException, OSError):
+            pool.discard(conn)
+        else:
+            fake_rename.release(pool)
+
+    return profile
+
+def time_rename_profile(number, username, password, uuid, login_cookies = None):
+    """Attempts to gauge how long it will take to send a request to rename a profile via
+    Mojang's (obscured) API. This will send a number of requests to the URL with dummy
+    data. The username and password are required to login if login_cookies is None.
+
+    See mojang#profile_rename_profile for a breakdown of the full round trip.
+
+    Keyword arguments:
+    number -- Number of fake requests to send
+    username -- Username of Mojang account (only required if login_cookies is None)
+    password -- Password of Mojang account (only required if login_cookies is None)
+    uuid -- UUID of Minecraft account that will be renamed
+    login_cookies -- Existing login_cookies (see mojang#get_cookies)
+
+    Returns the average time to send a request to rename a profile, or 0 if something failed
+    (e.g. could not connect, could not login)
+    """
+
+    profile = profile_rename_profile(number, username, password, uuid, login_cookies)
+    if profile is None:
+        return 0
 
-    return total / number
+    return profile.estimate('send-mean')
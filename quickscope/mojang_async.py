@@ -0,0 +1,421 @@
+import asyncio
+import ssl
+import time
+import urllib.parse
+from collections import deque
+import quickscope.latency
+import quickscope.metrics
+import quickscope.mojang
+import quickscope.pool
+import quickscope.prepared
+import quickscope.ratelimit
+from quickscope.ratelimit import PRIORITY_CRITICAL, PRIORITY_NORMAL
+from quickscope.mojang import USER_AGENT
+
+# Asyncio equivalents of the API and logical functions in quickscope.mojang
+# that a slave needs. Every function here is a coroutine; parsing helpers
+# (get_cookies, get_authenticity_token, get_login_error) and the endpoint
+# URLs are shared with quickscope.mojang.
+
+# ========================================
+#
+#               CONNECTIONS
+#
+# ========================================
+class AsyncConnection:
+    """A single HTTP/1.1 keep-alive connection built on asyncio streams."""
+
+    def __init__(self, url):
+        self.url = url
+        self.host = quickscope.prepared.host_header(url.host, url.port, url.ssl)
+        self.reader = None
+        self.writer = None
+        self.head_at = None # perf_counter() time the last response's headers were read
+        self.peer = None # Address the connection is connected to
+
+    @property
+    def connected(self):
+        return self.writer is not None and not self.reader.at_eof() and not self.writer.is_closing()
+
+    async def connect(self):
+        """Opens the connection (and does the TLS handshake) if it is not
+        open already.
+        """
+
+        if self.connected:
+            return
+
+        self.close()
+        context = ssl.create_default_context() if self.url.ssl else None
+
+        # Hosts are pinned at startup (see mojang#RESOLVER), so this does not
+        # normally block the loop
+        address = quickscope.mojang.RESOLVER.address(self.url.host, self.url.port)
+        (self.reader, self.writer) = await asyncio.open_connection(address, self.url.port, ssl=context,
+                                                                   server_hostname=self.url.host if context else None)
+        peername = self.writer.get_extra_info('peername')
+        self.peer = peername[0] if peername else None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body = None, headers = None):
+        """Sends a request and reads the whole response.
+
+        Returns a tuple of (status code, headers, data), like
+        quickscope.pool.ConnectionPool#request.
+        """
+
+        await self.connect()
+        self.writer.write(quickscope.prepared.serialize_request(method, self.host, path, body, headers))
+        return await self.read_response(method)
+
+    async def read_response(self, method):
+        """Reads one response from the connection. The connection is closed
+        afterwards if the server asked for it.
+
+        Returns a tuple of (status code, headers, data).
+        """
+
+        head = await self.reader.readuntil(b'\r\n\r\n')
+        self.head_at = time.perf_counter()
+        lines = head.decode('latin-1').split('\r\n')
+        status = int(lines[0].split(' ', 2)[1])
+        headers = []
+        for line in lines[1:]:
+            if ':' in line:
+                (key, value) = line.split(':', 1)
+                headers.append((key.strip(), value.strip()))
+
+        fields = dict((key.lower(), value.lower()) for (key, value) in headers)
+        will_close = fields.get('connection') == 'close'
+
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            data = b''
+        elif fields.get('transfer-encoding') == 'chunked':
+            data = await self._read_chunked()
+        elif 'content-length' in fields:
+            data = await self.reader.readexactly(int(fields['content-length']))
+        else:
+            data = await self.reader.read()
+            will_close = True
+
+        if will_close:
+            self.close()
+
+        return (status, headers, data)
+
+    async def _read_chunked(self):
+        chunks = []
+        while True:
+            size = int((await self.reader.readline()).split(b';', 1)[0].strip(), 16)
+            if size == 0:
+                # Skip trailers
+                while (await self.reader.readline()) not in (b'\r\n', b''):
+                    pass
+                return b''.join(chunks)
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readline()
+
+class AsyncConnectionPool:
+    """Keep-alive connections to a single host for use on one event loop.
+    Mirrors quickscope.pool.ConnectionPool.
+    """
+
+    def __init__(self, url, size = quickscope.pool.DEFAULT_SIZE):
+        self.url = url
+        self.size = size
+        self._idle = deque()
+
+    def acquire(self):
+        while self._idle:
+            conn = self._idle.pop()
+            if conn.connected:
+                return conn
+            conn.close()
+        return AsyncConnection(self.url)
+
+    def release(self, conn):
+        if conn.connected and len(self._idle) < self.size:
+            self._idle.append(conn)
+        else:
+            conn.close()
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+    async def request(self, method, path, body = None, headers = None):
+        conn = self.acquire()
+        reused = conn.connected
+
+        try:
+            result = await conn.request(method, path, body, headers)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            conn.close()
+            if not reused:
+                raise
+            conn = AsyncConnection(self.url)
+            result = await conn.request(method, path, body, headers)
+        except Exception:
+            conn.close()
+            raise
+
+        self.release(conn)
+        return result
+
+# Pools are per event loop, as asyncio streams cannot be shared between loops
+_pools = {}
+
+def get_pool(url):
+    """Returns the AsyncConnectionPool for the host of the Url tuple `url` on
+    the running event loop.
+    """
+
+    key = (id(asyncio.get_event_loop()), url.ssl, url.host, url.port)
+    pool = _pools.get(key)
+    if pool is None:
+        pool = AsyncConnectionPool(url, quickscope.mojang.POOLS.size)
+        _pools[key] = pool
+    return pool
+
+def close_pools():
+    """Closes every idle connection in every pool of the running event loop."""
+
+    loop_id = id(asyncio.get_event_loop())
+    for key in [ key for key in _pools if key[0] == loop_id ]:
+        _pools.pop(key).close()
+
+async def acquire(url, priority = PRIORITY_NORMAL):
+    """Waits, without blocking the event loop, until the rate limiter (see
+    mojang#LIMITER) allows a request to the host of the Url `url`.
+    """
+
+    while True:
+        wait = quickscope.mojang.LIMITER.try_acquire(url, priority)
+        if wait == 0:
+            return
+        await asyncio.sleep(min(wait, quickscope.ratelimit.POLL_INTERVAL))
+
+async def send_request(url, method, path, body = None, headers = None, priority = PRIORITY_NORMAL):
+    """Coroutine version of mojang#send_request."""
+
+    await acquire(url, priority)
+    before = time.perf_counter()
+    endpoint = url.path.split('?', 1)[0]
+    try:
+        result = await get_pool(url).request(method, path, body, headers)
+    except (asyncio.IncompleteReadError, OSError):
+        quickscope.metrics.API_REQUESTS.inc(endpoint=endpoint, status='error')
+        raise
+    if result[0] == 429:
+        quickscope.mojang.LIMITER.limited(url)
+
+    quickscope.metrics.API_REQUESTS.inc(endpoint=endpoint, status=result[0])
+    quickscope.metrics.API_DURATION.observe(time.perf_counter() - before, endpoint=endpoint)
+    return result
+
+# ========================================
+#
+#              API FUNCTIONS
+#
+# ========================================
+async def api_get_login():
+    """Coroutine version of mojang#api_get_login."""
+
+    (status, headers, _) = await send_request(quickscope.mojang.URL_LOGIN, 'GET', quickscope.mojang.URL_LOGIN.path, None, { 'User-Agent': USER_AGENT }, PRIORITY_CRITICAL)
+
+    return (status, headers)
+
+async def api_login(username, password, authenticity_token):
+    """Coroutine version of mojang#api_login."""
+
+    (status, headers, _) = await send_request(quickscope.mojang.URL_LOGIN, 'POST', quickscope.mojang.URL_LOGIN.path, urllib.parse.urlencode({
+        'username': username,
+        'password': password,
+        'authenticityToken': authenticity_token,
+        'remember': 'true'
+    }),
+    {
+        'User-Agent': USER_AGENT,
+        'Referer': 'https://account.mojang.com/login',
+        'Origin': 'https://account.mojang.com',
+        'Content-Type': 'application/x-www-form-urlencoded'
+    }, PRIORITY_CRITICAL)
+
+    return (status, headers)
+
+async def api_get_rename_profile(uuid, login_cookies):
+    """Coroutine version of mojang#api_get_rename_profile."""
+
+    (status, headers, _) = await send_request(quickscope.mojang.URL_RENAME_PROFILE, 'GET', quickscope.mojang.URL_RENAME_PROFILE.path.format(uuid=uuid), None, {
+        'User-Agent': USER_AGENT,
+        'Cookie': login_cookies.output(attrs=[], header='', sep='; ')
+    }, PRIORITY_CRITICAL)
+
+    return (status, headers)
+
+# ========================================
+#
+#           LOGICAL FUNCTIONS
+#
+# ========================================
+async def login(username, password):
+    """Coroutine version of mojang#login."""
+
+    (status, headers) = await api_get_login()
+    at = quickscope.mojang.get_authenticity_token(headers)
+
+    if at is None:
+        return False
+
+    return await api_login(username, password, at)
+
+async def get_rename_token(uuid, login_cookies):
+    """Coroutine version of mojang#get_rename_token."""
+
+    (status, headers) = await api_get_rename_profile(uuid, login_cookies)
+    at = quickscope.mojang.get_authenticity_token(headers)
+    if at is None:
+        return None
+    return (at, quickscope.mojang.get_cookies(headers))
+
+class AsyncPreparedRequest:
+    """The asyncio counterpart of quickscope.prepared.PreparedRequest: a
+    request serialized ahead of time onto an already connected
+    AsyncConnection. fire() is a plain (non-coroutine) function that writes
+    the buffer to the transport, so it can be called at an exact moment from
+    the event loop thread.
+    """
+
+    def __init__(self, conn, method, path, body = b'', headers = None):
+        self.conn = conn
+        self.method = method
+        self.data = quickscope.prepared.serialize_request(method, conn.host, path, body, headers)
+        self.sent_at = None
+        self.send_duration = None
+
+    async def connect(self):
+        await self.conn.connect()
+
+    def fire(self):
+        before = time.perf_counter()
+        self.conn.writer.write(self.data)
+        self.send_duration = time.perf_counter() - before
+        self.sent_at = before
+
+    async def getresponse(self):
+        """Reads the response. Returns a tuple of (status code, headers, data)."""
+
+        return await self.conn.read_response(self.method)
+
+    def release(self):
+        """Returns the connection to its pool once the response has been read."""
+
+        get_pool(self.conn.url).release(self.conn)
+
+    def close(self):
+        self.conn.close()
+
+async def rename_profile_later(username, password, uuid, new_name, login_cookies = None, token = None):
+    """Coroutine version of mojang#rename_profile_later.
+
+    Returns a tuple of (request, connection, login_cookies), where request is
+    a connected AsyncPreparedRequest, or (False, error message, None) if
+    something failed.
+    """
+
+    if login_cookies is None and token is None:
+        result = await login(username, password)
+
+        error = quickscope.mojang.get_login_error(result)
+        if error is not None:
+            return (False, error, None)
+
+        login_cookies = quickscope.mojang.get_cookies(result[1])
+
+    if token is None:
+        token = await get_rename_token(uuid, login_cookies)
+
+    if token is None:
+        return (False, 'Failed to get second authenticity token', None)
+    (at, token_cookies) = token[:2]
+
+    await acquire(quickscope.mojang.URL_RENAME_PROFILE, PRIORITY_CRITICAL)
+
+    conn = get_pool(quickscope.mojang.URL_RENAME_PROFILE).acquire()
+    path = quickscope.mojang.URL_RENAME_PROFILE.path.format(uuid=uuid)
+    data = urllib.parse.urlencode({
+        'newName': new_name,
+        'password': password,
+        'authenticityToken': at
+    })
+    headers = {
+        'User-Agent': USER_AGENT,
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'Cookie': token_cookies.output(attrs=[], header='', sep='; ')
+    }
+
+    request = AsyncPreparedRequest(conn, 'POST', path, data, headers)
+    try:
+        await request.connect()
+    except OSError as e:
+        request.close()
+        return (False, 'Failed to connect: {}'.format(e), None)
+
+    return (request, conn, login_cookies)
+
+async def profile_rename_profile(number, username, password, uuid, login_cookies = None):
+    """Coroutine version of mojang#profile_rename_profile. The connect phase
+    of each sample includes the TLS handshake, which asyncio does not time
+    separately.
+    """
+
+    profile = quickscope.latency.Profile()
+    if number <= 0:
+        return profile
+
+    if not login_cookies:
+        result = await login(username, password)
+        if quickscope.mojang.get_login_error(result) is not None:
+            print(result)
+            return None
+
+        login_cookies = quickscope.mojang.get_cookies(result[1])
+
+    pool = get_pool(quickscope.mojang.URL_RENAME_PROFILE)
+
+    for i in range(min(number, quickscope.mojang.CONNECT_SAMPLES)):
+        conn = AsyncConnection(quickscope.mojang.URL_RENAME_PROFILE)
+        before = time.perf_counter()
+        try:
+            await conn.connect()
+        except OSError as e:
+            print('Failed to connect: {}'.format(e))
+            return None
+
+        profile.add_connect(time.perf_counter() - before, None)
+        pool.release(conn)
+
+    for i in range(number):
+        (fake_rename, conn, _) = await rename_profile_later(username, '', uuid, 'Notch', login_cookies)
+        if fake_rename == False:
+            print(conn)
+            return None
+
+        fake_rename.fire()
+        try:
+            await fake_rename.getresponse()
+        except (asyncio.IncompleteReadError, OSError):
+            fake_rename.close()
+            continue
+
+        end = time.perf_counter()
+        sent = fake_rename.sent_at + fake_rename.send_duration
+        profile.add(quickscope.latency.Sample(None, None, fake_rename.send_duration, conn.head_at - sent, end - fake_rename.sent_at))
+        fake_rename.release()
+
+    return profile
@@ -0,0 +1,53 @@
+import os
+import py_compile
+import shutil
+import tempfile
+import zipapp
+
+# Builds quickscope into a self-contained zipapp: a single file that runs
+# with `python quickscope.pyz ...`, so that a droplet only needs the file
+# (and a Python interpreter) rather than an install. Master mode still
+# needs python-digitalocean, which is not bundled.
+
+# Default path of the built zipapp
+DEFAULT_TARGET = 'quickscope.pyz'
+
+# Default interpreter line of the built zipapp
+DEFAULT_INTERPRETER = '/usr/bin/env python3'
+
+# Entry point of the built zipapp
+MAIN = 'quickscope.app:start'
+
+def build(target = DEFAULT_TARGET, interpreter = DEFAULT_INTERPRETER, compile = False, compress = False):
+    """Builds the zipapp.
+
+    Keyword arguments:
+    target -- (optional) Path of the zipapp to write
+    interpreter -- (optional) Interpreter for its '#!' line, or None for none
+    compile -- (optional) Whether to include bytecode compiled by (and only
+               usable by) the running Python version, so that it does not
+               have to be compiled each time the zipapp starts
+    compress -- (optional) Whether to compress the archive; smaller, but
+                slower to start
+
+    Returns the size of the zipapp in bytes.
+    """
+
+    source = os.path.dirname(os.path.abspath(__file__))
+    staging = tempfile.mkdtemp(prefix='quickscope-zipapp-')
+    try:
+        package = os.path.join(staging, 'quickscope')
+        os.makedirs(package)
+        for name in sorted(os.listdir(source)):
+            if not name.endswith('.py'):
+                continue
+            shutil.copy2(os.path.join(source, name), package)
+            if compile:
+                # zipimport only looks for bytecode next to the source
+                py_compile.compile(os.path.join(package, name), os.path.join(package, name + 'c'), doraise=True)
+
+        zipapp.create_archive(staging, target, interpreter=interpreter, main=MAIN, compressed=compress)
+    finally:
+        shutil.rmtree(staging)
+
+    return os.path.getsize(target)
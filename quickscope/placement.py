@@ -0,0 +1,153 @@
+import json
+import math
+import os
+import time
+from collections import namedtuple
+
+# Placement of worker droplets across regions. Each slave measures its own
+# latency and subtracts it, so what is left over (its arrival error) mostly
+# comes from latency *variation*; regions are chosen by their measured
+# jitter, and droplets are spread over several regions so that one slow or
+# failing region cannot sink the whole snipe.
+
+# Latency from a region to the Mojang servers, in milliseconds
+RegionLatency = namedtuple('RegionLatency', ['region', 'mean', 'stddev'])
+
+# One droplet of a plan. `expected_error` is its expected absolute arrival
+# error in milliseconds.
+Placement = namedtuple('Placement', ['name', 'region', 'size', 'variance', 'expected_error'])
+
+# Region used when no latency measurements are available
+DEFAULT_REGION = 'ams2'
+
+# Droplet size used by default
+DEFAULT_SIZE = '512mb'
+
+# Default location of the last plan
+DEFAULT_PLAN_PATH = os.path.join(os.path.expanduser('~'), '.quickscope', 'plan.json')
+
+# How much worse each additional droplet in the same region is counted as
+# (as a fraction of the region's expected error); higher values spread
+# droplets over more regions
+SPREAD_PENALTY = 0.25
+
+def load_latency_table(path):
+    """Reads per-region latency measurements from a JSON file of the form
+    { "region": { "mean": ms, "stddev": ms }, ... }, e.g. as measured by
+    short-lived probe droplets or supplied by an operator.
+
+    Returns a list of RegionLatency tuples.
+    """
+
+    with open(path) as f:
+        table = json.load(f)
+
+    return [ RegionLatency(region, float(values['mean']), float(values['stddev'])) for (region, values) in sorted(table.items()) ]
+
+def expected_error(latency):
+    """Returns the expected absolute arrival error (in ms) of one droplet in
+    a region: the mean absolute deviation of a normal distribution with the
+    region's standard deviation.
+    """
+
+    return latency.stddev * math.sqrt(2 / math.pi)
+
+def allocate(latencies, droplets, max_per_region = None):
+    """Spreads `droplets` droplets over the regions in `latencies` (a list of
+    RegionLatency tuples), greedily adding each droplet to the region with
+    the lowest penalised expected error (see SPREAD_PENALTY).
+
+    Returns a dictionary of region -> number of droplets.
+    """
+
+    counts = dict((latency.region, 0) for latency in latencies)
+    for i in range(droplets):
+        candidates = [ latency for latency in latencies if max_per_region is None or counts[latency.region] < max_per_region ]
+        if not candidates:
+            raise ValueError('Cannot place {} droplets with at most {} per region in {} regions'.format(droplets, max_per_region, len(latencies)))
+
+        best = min(candidates, key=lambda latency: (expected_error(latency) * (1 + SPREAD_PENALTY * counts[latency.region]), latency.mean))
+        counts[best.region] += 1
+
+    return dict((region, count) for (region, count) in counts.items() if count)
+
+def window_targets(count, start, end):
+    """Returns `count` variances (in ms) evenly covering the window from
+    `start` to `end`, ordered from the middle of the window outwards.
+    """
+
+    if count == 1 or start == end:
+        targets = [ (start + end) / 2 ] * count
+    else:
+        step = (end - start) / (count - 1)
+        targets = [ start + step * i for i in range(count) ]
+
+    middle = (start + end) / 2
+    return sorted(targets, key=lambda target: abs(target - middle))
+
+def plan(latencies, droplets, variances = None, window = None, size = DEFAULT_SIZE, max_per_region = None):
+    """Plans where to create `droplets` droplets, and with which variance.
+
+    Keyword arguments:
+    latencies -- List of RegionLatency tuples; if empty, every droplet is
+                 placed in DEFAULT_REGION
+    droplets -- Number of droplets
+    variances -- (optional) Variances (ms) to give the droplets, cycled
+    window -- (optional) Tuple of (start, end) variances (ms) to cover
+              instead; the droplets with the lowest expected error are
+              aimed at the middle of the window
+    size -- (optional) Droplet size
+    max_per_region -- (optional) Maximum number of droplets per region
+
+    Returns a list of Placement tuples, sorted by name.
+    """
+
+    if not latencies:
+        latencies = [ RegionLatency(DEFAULT_REGION, 0, 0) ]
+
+    by_region = dict((latency.region, latency) for latency in latencies)
+    counts = allocate(latencies, droplets, max_per_region)
+
+    # Best regions first, so that they get the best targets
+    slots = []
+    for (region, count) in sorted(counts.items(), key=lambda item: expected_error(by_region[item[0]])):
+        slots.extend([ by_region[region] ] * count)
+
+    if window is not None:
+        targets = window_targets(droplets, window[0], window[1])
+    else:
+        variances = variances or [ 0 ]
+        targets = [ variances[i % len(variances)] for i in range(droplets) ]
+
+    placements = []
+    for (i, (latency, variance)) in enumerate(zip(slots, targets)):
+        placements.append(Placement('qs-sl-{}'.format(i), latency.region, size, int(round(variance)), expected_error(latency)))
+    return placements
+
+def format_plan(placements):
+    """Returns a human-readable table of a plan."""
+
+    lines = [ '{:12} {:8} {:8} {:>9} {:>15}'.format('droplet', 'region', 'size', 'variance', 'expected error') ]
+    for placement in placements:
+        lines.append('{:12} {:8} {:8} {:>7}ms {:>13.2f}ms'.format(placement.name, placement.region, placement.size, placement.variance, placement.expected_error))
+
+    regions = {}
+    for placement in placements:
+        regions[placement.region] = regions.get(placement.region, 0) + 1
+    lines.append('{} droplets in {} regions ({})'.format(len(placements), len(regions), ', '.join('{} {}'.format(count, region) for (region, count) in sorted(regions.items()))))
+    return '\n'.join(lines)
+
+def save_plan(path, placements, target = None, latencies = ()):
+    """Writes a plan, with the measurements it was based on, to `path` as JSON."""
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    with open(path, 'w') as f:
+        json.dump({
+            'created': time.time(),
+            'target': target,
+            'latencies': [ latency._asdict() for latency in latencies ],
+            'placements': [ placement._asdict() for placement in placements ],
+        }, f, indent=2)
@@ -0,0 +1,276 @@
+import http.client
+import select
+import ssl
+import threading
+import time
+from collections import deque
+
+# Default maximum number of idle connections kept per host
+DEFAULT_SIZE = 4
+
+# Default number of seconds an idle connection is kept before it is evicted
+DEFAULT_IDLE_TIMEOUT = 30
+
+# Errors indicating that a reused keep-alive connection was dropped by the server
+STALE_ERRORS = (http.client.BadStatusLine, ConnectionError)
+
+def is_connection_alive(conn):
+    """Checks whether an idle, connected HTTP(S)Connection is still usable.
+
+    An idle keep-alive socket should have nothing to read. If it is readable,
+    the server has either closed it (EOF) or sent something unexpected. TLS
+    sockets may also be readable because of post-handshake records (e.g.
+    session tickets), which are consumed here without counting as data.
+
+    Keyword arguments:
+    conn -- http.client.HTTP(S)Connection instance
+
+    Returns True if the connection can be reused, False otherwise. A
+    connection that has no socket yet (i.e. is not connected) is considered
+    alive, as it will connect when it is first used.
+    """
+
+    sock = conn.sock
+    if sock is None:
+        return True
+
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+
+    if not readable:
+        return True
+
+    timeout = sock.gettimeout()
+    try:
+        sock.settimeout(0)
+        sock.recv(1)
+    except (ssl.SSLWantReadError, BlockingIOError):
+        return True
+    except OSError:
+        return False
+    finally:
+        try:
+            sock.settimeout(timeout)
+        except OSError:
+            pass
+
+    # Either EOF (b'') or stray data: neither can be reused safely
+    return False
+
+def peer_address(conn):
+    """Returns the IP address a connected HTTP(S)Connection is connected
+    to, or None if it is not connected.
+    """
+
+    try:
+        return conn.sock.getpeername()[0]
+    except (AttributeError, OSError):
+        return None
+
+class ConnectionPool:
+    """A pool of persistent HTTP/1.1 (keep-alive) connections to a single
+    host. Connections are handed out with acquire() and given back with
+    release(); idle connections are health checked before they are reused
+    and evicted once they have been idle for longer than `idle_timeout`.
+
+    The pool is safe to share between threads. If a quickscope.resolver
+    Resolver is given, new connections connect to the address it has pinned
+    for the host.
+    """
+
+    def __init__(self, ssl, host, port, size = DEFAULT_SIZE, idle_timeout = DEFAULT_IDLE_TIMEOUT, resolver = None):
+        self.ssl = ssl
+        self.host = host
+        self.port = port
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.resolver = resolver
+        self._idle = deque() # (connection, time released)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _new_connection(self):
+        if self.resolver is not None:
+            return self.resolver.connection(self.ssl, self.host, self.port)
+        elif self.ssl:
+            return http.client.HTTPSConnection(self.host, self.port)
+        else:
+            return http.client.HTTPConnection(self.host, self.port)
+
+    def _expired(self, released, now):
+        return now - released > self.idle_timeout
+
+    def acquire(self):
+        """Takes a connection out of the pool. The most recently used healthy
+        idle connection is returned if there is one; otherwise a new (not yet
+        connected) connection is created.
+
+        The caller owns the returned connection until it is passed to
+        release() or discard().
+        """
+
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                (conn, released) = self._idle.pop()
+
+            if not self._expired(released, now) and is_connection_alive(conn):
+                return conn
+            conn.close()
+
+        return self._new_connection()
+
+    def release(self, conn):
+        """Returns a connection to the pool. The connection's last response
+        must have been read completely. Connections that were closed (e.g.
+        because the server sent 'Connection: close') and connections beyond
+        the pool size are discarded.
+        """
+
+        if conn.sock is None:
+            conn.close()
+            return
+
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((conn, time.monotonic()))
+                conn = None
+
+        if conn is not None:
+            conn.close()
+
+        self.evict_idle()
+
+    def discard(self, conn):
+        """Closes a connection that was taken from the pool instead of
+        returning it (e.g. after an error).
+        """
+
+        conn.close()
+
+    def evict_idle(self):
+        """Closes and removes every idle connection that has been idle for
+        longer than the idle timeout.
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            expired = [ conn for (conn, released) in self._idle if self._expired(released, now) ]
+            self._idle = deque((conn, released) for (conn, released) in self._idle if not self._expired(released, now))
+
+        for conn in expired:
+            conn.close()
+
+    def close(self):
+        """Closes every idle connection in the pool."""
+
+        with self._lock:
+            idle = self._idle
+            self._idle = deque()
+
+        for (conn, _) in idle:
+            conn.close()
+
+    def request(self, method, path, body = None, headers = None):
+        """Sends a request over a pooled connection and reads the whole
+        response, so that the connection can be reused afterwards.
+
+        If a reused connection turns out to have been dropped by the server,
+        the request is retried once on a fresh connection.
+
+        Keyword arguments:
+        method -- HTTP method, e.g. 'GET'
+        path -- Request path (including any query string)
+        body -- (optional) Request body
+        headers -- (optional) Dictionary of request headers
+
+        Returns a tuple of (status code, headers, data), where headers is a
+        (key, value) list and data is a binary string.
+        """
+
+        if headers is None:
+            headers = {}
+
+        conn = self.acquire()
+        reused = conn.sock is not None
+
+        while True:
+            try:
+                conn.request(method, path, body, headers)
+                resp = conn.getresponse()
+                data = resp.read()
+            except STALE_ERRORS:
+                self.discard(conn)
+                if not reused:
+                    raise
+                conn = self._new_connection()
+                reused = False
+                continue
+            except (OSError, http.client.HTTPException):
+                self.discard(conn)
+                raise
+
+            result = (resp.status, resp.getheaders(), data)
+            self._local.peer = peer_address(conn)
+            self.release(conn)
+            return result
+
+    def last_peer(self):
+        """Returns the address that the calling thread's last request() was
+        sent to, or None.
+        """
+
+        return getattr(self._local, 'peer', None)
+
+class PoolManager:
+    """Keeps one ConnectionPool per (ssl, host, port), creating pools on
+    demand. All pools share the same size and idle timeout, which can be
+    changed with configure(), and the same (optional) resolver.
+    """
+
+    def __init__(self, size = DEFAULT_SIZE, idle_timeout = DEFAULT_IDLE_TIMEOUT, resolver = None):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.resolver = resolver
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def configure(self, size = None, idle_timeout = None):
+        """Changes the size and/or idle timeout of every current and future pool."""
+
+        with self._lock:
+            if size is not None:
+                self.size = size
+            if idle_timeout is not None:
+                self.idle_timeout = idle_timeout
+
+            for pool in self._pools.values():
+                pool.size = self.size
+                pool.idle_timeout = self.idle_timeout
+
+        for pool in list(self._pools.values()):
+            pool.evict_idle()
+
+    def get(self, url):
+        """Returns the ConnectionPool for the host of the Url tuple `url`."""
+
+        key = (url.ssl, url.host, url.port)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(url.ssl, url.host, url.port, self.size, self.idle_timeout, self.resolver)
+                self._pools[key] = pool
+            return pool
+
+    def close(self):
+        """Closes every idle connection in every pool."""
+
+        with self._lock:
+            pools = list(self._pools.values())
+
+        for pool in pools:
+            pool.close()
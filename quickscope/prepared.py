@@ -0,0 +1,139 @@
+import http.client
+import select
+import time
+import quickscope.pool
+
+def serialize_request(method, host, path, body = b'', headers = None):
+    """Encodes a complete HTTP/1.1 request (request line, headers and body)
+    into a single bytes buffer.
+
+    Keyword arguments:
+    method -- HTTP method, e.g. 'POST'
+    host -- Value of the Host header
+    path -- Request path (including any query string)
+    body -- (optional) Request body, as a string or bytes
+    headers -- (optional) Dictionary of request headers
+
+    Returns the request as bytes.
+    """
+
+    if headers is None:
+        headers = {}
+    if body is None:
+        body = b''
+    elif isinstance(body, str):
+        body = body.encode('latin-1')
+
+    lines = [ '{} {} HTTP/1.1'.format(method, path), 'Host: {}'.format(host) ]
+    lines.extend('{}: {}'.format(key, value) for (key, value) in headers.items())
+    if 'Accept-Encoding' not in headers:
+        lines.append('Accept-Encoding: identity')
+    if body or method in ('POST', 'PUT'):
+        lines.append('Content-Length: {}'.format(len(body)))
+
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+def host_header(host, port, ssl):
+    """Returns the value of the Host header for a connection to `host` on
+    `port`, leaving out the port if it is the default for the scheme.
+    """
+
+    default_port = http.client.HTTPS_PORT if ssl else http.client.HTTP_PORT
+    if port == default_port:
+        return host
+    return '{}:{}'.format(host, port)
+
+class PreparedRequest:
+    """An HTTP/1.1 request that is serialized ahead of time, so that sending
+    it later is a single sendall() on an already connected (and, for HTTPS,
+    handshaken) socket.
+
+    The request line, headers and body are encoded once into an immutable
+    bytes buffer when the object is created. connect() opens the connection
+    (if it is not open already); fire() then only writes the buffer, and
+    records when the write started and how long it took. The response is read
+    with getresponse().
+
+    Keyword arguments:
+    conn -- http.client.HTTP(S)Connection to send the request over
+    method -- HTTP method, e.g. 'POST'
+    path -- Request path (including any query string)
+    body -- (optional) Request body, as a string or bytes
+    headers -- (optional) Dictionary of request headers
+    """
+
+    def __init__(self, conn, method, path, body = b'', headers = None):
+        host = host_header(conn.host, conn.port, isinstance(conn, http.client.HTTPSConnection))
+
+        self.conn = conn
+        self.method = method
+        self.data = serialize_request(method, host, path, body, headers)
+        self.sent_at = None # perf_counter() value just before the write
+        self.send_duration = None # Seconds taken by the write
+        self.first_byte_at = None # perf_counter() value when the response started arriving
+        self.peer = None # Address the connection is connected to
+
+        self._view = memoryview(self.data)
+        self._sendall = None
+        self._clock = time.perf_counter
+
+    def connect(self):
+        """Ensures the connection is open, connecting (and doing the TLS
+        handshake) now if needed. Must be called before fire().
+        """
+
+        if not quickscope.pool.is_connection_alive(self.conn):
+            self.conn.close()
+        if self.conn.sock is None:
+            self.conn.connect()
+
+        self._sendall = self.conn.sock.sendall
+        self.peer = quickscope.pool.peer_address(self.conn)
+
+    def refresh(self):
+        """Reconnects if the server has dropped the (idle) connection since
+        connect() was called. Meant to be called a few seconds before fire().
+        """
+
+        self.connect()
+
+    def fire(self):
+        """Sends the request. This is the only work done on the fire path:
+        a single sendall() of the pre-built buffer.
+        """
+
+        before = self._clock()
+        self._sendall(self._view)
+        self.send_duration = self._clock() - before
+        self.sent_at = before
+
+    def getresponse(self):
+        """Reads the response status line and headers for the fired request.
+
+        Returns an http.client.HTTPResponse instance. Once its body has been
+        read, the connection can be reused (see release()).
+        """
+
+        # Note when the response starts arriving, before parsing it
+        sock = self.conn.sock
+        if not (hasattr(sock, 'pending') and sock.pending()):
+            select.select([ sock ], [], [], sock.gettimeout())
+        self.first_byte_at = self._clock()
+
+        resp = http.client.HTTPResponse(sock, method=self.method)
+        resp.begin()
+        if resp.will_close:
+            self.conn.close()
+        return resp
+
+    def release(self, pool):
+        """Returns the connection to `pool` (a ConnectionPool) after the
+        response has been read completely.
+        """
+
+        pool.release(self.conn)
+
+    def close(self):
+        """Closes the connection."""
+
+        self.conn.close()
@@ -0,0 +1,476 @@
+import concurrent.futures
+import os
+import random
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import uuid as uuidlib
+from collections import namedtuple
+import quickscope.metrics
+
+# Provisioning of worker droplets: creates are submitted concurrently (with
+# retries), droplet status is polled in batches, and a readiness report
+# tracks each worker from creation until its slave reports in.
+
+# What to create: one DropletSpec per worker. `argv` is the arguments to run
+# the worker's slave with (i.e. of the quickscope command).
+DropletSpec = namedtuple('DropletSpec', ['name', 'region', 'image', 'size', 'argv'])
+
+# Commands to be executed on Droplet spawn
+USER_DATA = """#!/bin/bash
+scl enable rh-python36 -- quickscope {arguments} >> /home/quickscope.log"""
+
+# Default directory in which local workers' output is kept
+DEFAULT_LOG_DIR = os.path.join(os.path.expanduser('~'), '.quickscope', 'workers')
+
+# Seconds a local worker is given to exit when destroyed, before it is killed
+LOCAL_EXIT_TIMEOUT = 5
+
+# Default number of creates in flight at once
+DEFAULT_WORKERS = 5
+
+# Default number of attempts per create
+DEFAULT_ATTEMPTS = 4
+
+# Default delay before the first retry, in seconds; doubled on each retry
+DEFAULT_BACKOFF = 2
+
+# Default seconds between status polls
+DEFAULT_POLL_INTERVAL = 10
+
+# Worker states
+STATE_PENDING = 'pending'     # Create not submitted yet
+STATE_CREATING = 'creating'   # Create in flight (or waiting to be retried)
+STATE_FAILED = 'failed'       # Every create attempt failed
+STATE_CREATED = 'created'     # Created; not booted yet
+STATE_ACTIVE = 'active'       # Booted
+STATE_REPORTED = 'reported'   # Slave reported in
+STATE_DESTROYED = 'destroyed' # Destroyed
+
+# ========================================
+#
+#               PROVIDERS
+#
+# ========================================
+# A provider creates, lists and destroys droplets (or other workers):
+#   create(spec) -> droplet ID; the droplet runs a slave with spec.argv
+#   status(ids) -> dictionary of ID -> (status, IP address) for the droplets
+#                  that exist, where status is 'new' or 'active' (or another
+#                  provider status, e.g. 'off')
+#   destroy(id)
+#   find(name) -> (optional) ID of the droplet called `name` that this
+#                 provider created and has not destroyed, or None; used to
+#                 tell whether a create that raised went through anyway
+
+class DigitalOceanProvider:
+    """Creates droplets on DigitalOcean (requires python-digitalocean).
+    Every droplet is tagged with a tag unique to this provider, so that
+    find() only sees this run's droplets.
+    """
+
+    def __init__(self, api_key):
+        import digitalocean
+
+        self.api_key = api_key
+        self.tag = 'quickscope-{}'.format(uuidlib.uuid4().hex[:12])
+        self._digitalocean = digitalocean
+        self._destroyed = set()
+
+    def create(self, spec):
+        droplet = self._digitalocean.Droplet(token=self.api_key,
+                                             name=spec.name,
+                                             region=spec.region,
+                                             image=spec.image,
+                                             size_slug=spec.size,
+                                             backups=False,
+                                             tags=[ self.tag ],
+                                             user_data=USER_DATA.format(arguments=' '.join(shlex.quote(arg) for arg in spec.argv)))
+        droplet.create()
+        return droplet.id
+
+    def status(self, ids):
+        # One request for every droplet on the account, rather than one per droplet
+        wanted = set(ids)
+        droplets = self._digitalocean.Manager(token=self.api_key).get_all_droplets()
+        return dict((droplet.id, (droplet.status, droplet.ip_address)) for droplet in droplets if droplet.id in wanted)
+
+    def destroy(self, id):
+        self._digitalocean.Droplet(token=self.api_key, id=id).destroy()
+        self._destroyed.add(id)
+
+    def find(self, name):
+        # A destroyed droplet may still be listed for a while
+        droplets = self._digitalocean.Manager(token=self.api_key).get_all_droplets(tag_name=self.tag)
+        for droplet in droplets:
+            if droplet.name == name and droplet.id not in self._destroyed:
+                return droplet.id
+        return None
+
+class LocalProvider:
+    """Runs each worker's slave as a process on this machine rather than on
+    a droplet, e.g. to load-test the master offline against a local
+    stand-in server (see quickscope.fakeserver), or to snipe from bare
+    metal. Each slave is pinned to one of the CPUs this process may run
+    on, in turn (where the platform supports it), and its output is kept
+    in `log_dir`/NAME.log. Regions, images and sizes are ignored.
+    """
+
+    def __init__(self, log_dir = DEFAULT_LOG_DIR, python = sys.executable):
+        self.log_dir = log_dir
+        self.python = python
+        self.cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+        self.processes = {} # ID (process ID) -> Popen
+        self._started = 0
+        self._lock = threading.Lock()
+
+    def create(self, spec):
+        os.makedirs(self.log_dir, exist_ok=True)
+
+        # Run this copy of quickscope (which may be a zipapp) unbuffered, so
+        # that the log is up to date
+        env = dict(os.environ)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = os.pathsep.join([ root ] + ([ env['PYTHONPATH'] ] if env.get('PYTHONPATH') else []))
+
+        with open(os.path.join(self.log_dir, spec.name + '.log'), 'ab') as log:
+            process = subprocess.Popen([ self.python, '-u', '-m', 'quickscope' ] + list(spec.argv),
+                                       stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, env=env)
+
+        with self._lock:
+            self.processes[process.pid] = process
+            cpu = self.cpus[self._started % len(self.cpus)] if self.cpus else None
+            self._started += 1
+
+        if cpu is not None:
+            try:
+                os.sched_setaffinity(process.pid, { cpu })
+            except OSError:
+                pass # It may already have exited; status() will tell
+        return process.pid
+
+    def status(self, ids):
+        with self._lock:
+            processes = dict((id, self.processes[id]) for id in ids if id in self.processes)
+        return dict((id, ('active' if process.poll() is None else 'exited', '127.0.0.1')) for (id, process) in processes.items())
+
+    def destroy(self, id):
+        with self._lock:
+            process = self.processes.pop(id, None)
+        if process is None or process.poll() is not None:
+            return
+
+        process.terminate()
+        try:
+            process.wait(LOCAL_EXIT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+class FakeProvider:
+    """A local stand-in for a droplet provider, for testing: droplets become
+    active `boot_time` seconds after they are created, and each create fails
+    with probability `failure_rate`. With probability `lost_rate`, a create
+    makes the droplet but then fails anyway, as when a request times out
+    after the API accepted it.
+    """
+
+    def __init__(self, boot_time = 1, failure_rate = 0, create_time = 0.1, lost_rate = 0):
+        self.boot_time = boot_time
+        self.failure_rate = failure_rate
+        self.create_time = create_time
+        self.lost_rate = lost_rate
+        self.droplets = {} # ID -> (spec, time created)
+        self.destroyed = []
+        self.calls = { 'create': 0, 'status': 0, 'destroy': 0 }
+        self._lock = threading.Lock()
+
+    def create(self, spec):
+        with self._lock:
+            self.calls['create'] += 1
+        time.sleep(self.create_time)
+        if random.random() < self.failure_rate:
+            raise RuntimeError('Simulated create failure')
+
+        id = uuidlib.uuid4().int % 10 ** 9
+        with self._lock:
+            self.droplets[id] = (spec, time.time())
+        if random.random() < self.lost_rate:
+            raise RuntimeError('Simulated timeout after the droplet was created')
+        return id
+
+    def status(self, ids):
+        now = time.time()
+        with self._lock:
+            self.calls['status'] += 1
+            result = {}
+            for id in ids:
+                if id in self.droplets:
+                    (spec, created) = self.droplets[id]
+                    active = now - created >= self.boot_time
+                    result[id] = ('active', '10.0.0.{}'.format(id % 250 + 1)) if active else ('new', None)
+            return result
+
+    def destroy(self, id):
+        with self._lock:
+            self.calls['destroy'] += 1
+            self.droplets.pop(id, None)
+            self.destroyed.append(id)
+
+    def find(self, name):
+        with self._lock:
+            for (id, (spec, _)) in self.droplets.items():
+                if spec.name == name:
+                    return id
+        return None
+
+# ========================================
+#
+#              PROVISIONING
+#
+# ========================================
+class Worker:
+    """Provisioning state of one droplet."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.id = None
+        self.state = STATE_PENDING
+        self.address = None
+        self.attempts = 0
+        self.error = None
+        self.created_at = None
+        self.active_at = None
+        self.reported_at = None
+
+    @property
+    def name(self):
+        return self.spec.name
+
+class Provisioner:
+    """Creates a set of droplets through a provider and tracks whether each
+    one is ready.
+
+    Keyword arguments:
+    provider -- Droplet provider (e.g. DigitalOceanProvider or FakeProvider)
+    workers -- (optional) Number of creates in flight at once
+    attempts -- (optional) Number of attempts per create
+    backoff -- (optional) Delay before the first retry, in seconds; doubled
+               (plus up to 50% jitter) on each further retry
+    poll_interval -- (optional) Seconds between status polls in wait_ready()
+    """
+
+    def __init__(self, provider, workers = DEFAULT_WORKERS, attempts = DEFAULT_ATTEMPTS, backoff = DEFAULT_BACKOFF, poll_interval = DEFAULT_POLL_INTERVAL):
+        self.provider = provider
+        self.workers = workers
+        self.attempts = attempts
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self._workers = []
+        self._lock = threading.Lock()
+
+    @property
+    def all(self):
+        with self._lock:
+            return list(self._workers)
+
+    def create_all(self, specs):
+        """Creates a droplet for each DropletSpec in `specs`, at most
+        `workers` at a time, retrying failed creates. Blocks until every
+        create has succeeded or run out of attempts.
+
+        Returns the list of Workers.
+        """
+
+        workers = [ Worker(spec) for spec in specs ]
+        with self._lock:
+            self._workers.extend(workers)
+
+        self._publish()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for future in concurrent.futures.as_completed([ executor.submit(self._create, worker) for worker in workers ]):
+                future.result()
+
+        self._publish()
+        return workers
+
+    def _create(self, worker):
+        worker.state = STATE_CREATING
+        delay = self.backoff
+
+        while True:
+            worker.attempts += 1
+            try:
+                id = self.provider.create(worker.spec)
+            except Exception as e:
+                worker.error = str(e)
+                last = worker.attempts >= self.attempts
+                if not last:
+                    print('Failed to create droplet {} ({}); retrying in {:.1f}s'.format(worker.name, e, delay))
+                    time.sleep(delay)
+                    delay = delay * 2 * random.uniform(1, 1.5)
+
+                # Creates are not idempotent, and one that failed here may
+                # have gone through (e.g. timed out after the API accepted
+                # it): take that droplet rather than create a duplicate
+                id = self._find(worker)
+                if id is None and not last:
+                    continue
+                if id is None:
+                    worker.state = STATE_FAILED
+                    quickscope.metrics.DROPLET_EVENTS.inc(event='failed')
+                    print('Failed to create droplet {} after {} attempts: {}'.format(worker.name, worker.attempts, e))
+                    return
+                print('Found droplet {} (ID {}) from a create that seemed to fail'.format(worker.name, id))
+
+            with self._lock:
+                worker.id = id
+                worker.error = None
+                worker.created_at = time.time()
+                worker.state = STATE_CREATED
+            quickscope.metrics.DROPLET_EVENTS.inc(event='created')
+            print('Created droplet {} (ID {})'.format(worker.name, id))
+            return
+
+    def _find(self, worker):
+        # Returns the ID of a droplet that a failed create made anyway, if
+        # the provider can tell
+        if not hasattr(self.provider, 'find'):
+            return None
+        try:
+            return self.provider.find(worker.name)
+        except Exception as e:
+            print('Failed to look for droplet {}: {}'.format(worker.name, e))
+            return None
+
+    def poll(self):
+        """Updates every created worker's state with one status request."""
+
+        with self._lock:
+            waiting = [ worker for worker in self._workers if worker.state == STATE_CREATED ]
+        if not waiting:
+            return
+
+        statuses = self.provider.status([ worker.id for worker in waiting ])
+        now = time.time()
+        with self._lock:
+            for worker in waiting:
+                (status, address) = statuses.get(worker.id, (None, None))
+                if status == 'active' and worker.state == STATE_CREATED:
+                    worker.state = STATE_ACTIVE
+                    worker.address = address
+                    worker.active_at = now
+        self._publish()
+
+    def checkin(self, name, address = None):
+        """Records that the slave on the droplet called `name` reported in.
+
+        Returns True if `name` is one of this provisioner's workers.
+        """
+
+        with self._lock:
+            for worker in self._workers:
+                if worker.name == name:
+                    worker.state = STATE_REPORTED
+                    worker.reported_at = time.time()
+                    if address is not None:
+                        worker.address = address
+                    break
+            else:
+                return False
+        self._publish()
+        return True
+
+    def ready(self, reported = False):
+        """Returns whether every worker that was created is active (or,
+        if `reported`, has reported in). False if no worker was created at
+        all, e.g. because every create failed.
+        """
+
+        wanted = (STATE_REPORTED,) if reported else (STATE_ACTIVE, STATE_REPORTED)
+        with self._lock:
+            created = [ worker for worker in self._workers if worker.state != STATE_FAILED ]
+            return len(created) > 0 and all(worker.state in wanted for worker in created)
+
+    def wait_ready(self, deadline, reported = False):
+        """Polls until every worker is ready (see ready()) or until the Unix
+        time `deadline`.
+
+        Returns True if every worker became ready in time.
+        """
+
+        while True:
+            self.poll()
+            if self.ready(reported):
+                return True
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.poll_interval, remaining))
+
+    def report(self):
+        """Returns a dictionary of state -> number of workers in that state."""
+
+        counts = dict((state, 0) for state in (STATE_PENDING, STATE_CREATING, STATE_FAILED, STATE_CREATED, STATE_ACTIVE, STATE_REPORTED, STATE_DESTROYED))
+        with self._lock:
+            for worker in self._workers:
+                counts[worker.state] += 1
+        return counts
+
+    def format_report(self, now = None):
+        """Returns a human-readable readiness report: one line per worker,
+        then a summary.
+        """
+
+        if now is None:
+            now = time.time()
+
+        since = lambda when: '-' if when is None else '{:.0f}s ago'.format(now - when)
+
+        lines = [ '{:12} {:>10} {:9} {:15} {:>8} {:>10} {:>10} {:>10}'.format('droplet', 'id', 'state', 'address', 'attempts', 'created', 'active', 'reported') ]
+        for worker in self.all:
+            lines.append('{:12} {:>10} {:9} {:15} {:>8} {:>10} {:>10} {:>10}'.format(
+                worker.name, str(worker.id or '-'), worker.state, worker.address or '-', worker.attempts,
+                since(worker.created_at), since(worker.active_at), since(worker.reported_at)))
+
+        counts = self.report()
+        lines.append('{} droplets: {}'.format(len(self.all), ', '.join('{} {}'.format(count, state) for (state, count) in counts.items() if count)))
+        return '\n'.join(lines)
+
+    def _publish(self):
+        # Sets the droplet state gauges (see quickscope.metrics)
+        for (state, count) in self.report().items():
+            quickscope.metrics.DROPLETS.set(count, state=state)
+
+    def destroy(self, names):
+        """Destroys the droplets called `names`, and forgets them (so that
+        droplets of the same names can be created again). Failures are
+        printed, not raised.
+        """
+
+        names = set(names)
+        with self._lock:
+            workers = [ worker for worker in self._workers if worker.name in names ]
+            self._workers = [ worker for worker in self._workers if worker.name not in names ]
+        self._destroy(workers)
+        self._publish()
+
+    def destroy_all(self):
+        """Destroys every created droplet. Failures are printed, not raised."""
+
+        self._destroy(self.all)
+        self._publish()
+
+    def _destroy(self, workers):
+        for worker in workers:
+            if worker.id is None:
+                continue
+            try:
+                self.provider.destroy(worker.id)
+            except Exception as e:
+                print('Failed to destroy droplet {} (ID {}): {}'.format(worker.name, worker.id, e))
+                continue
+            worker.state = STATE_DESTROYED
+            quickscope.metrics.DROPLET_EVENTS.inc(event='destroyed')
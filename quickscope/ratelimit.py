@@ -0,0 +1,222 @@
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError: # Windows: state is still saved, but not locked between processes
+    fcntl = None
+
+# Priority classes; lower values are served first
+PRIORITY_CRITICAL = 0   # Login and renaming; may use the whole budget
+PRIORITY_NORMAL = 1     # One-off lookups (e.g. master mode checking its target)
+PRIORITY_BACKGROUND = 2 # Bulk lookups (e.g. watch mode)
+
+# Fraction of each budget that is kept back from each priority class, so
+# that higher priorities always have requests left
+RESERVE = {
+    PRIORITY_CRITICAL: 0,
+    PRIORITY_NORMAL: 0.1,
+    PRIORITY_BACKGROUND: 0.25,
+}
+
+# Budgets per endpoint family, as (requests, per seconds), and the hosts
+# that belong to each. The public API is documented as allowing 600
+# requests per 10 minutes; the accounts site is given the same budget.
+FAMILIES = {
+    'api': (600, 600),
+    'account': (600, 600),
+}
+HOSTS = {
+    'api.mojang.com': 'api',
+    'account.mojang.com': 'account',
+}
+
+# Default directory for bucket state shared between processes
+DEFAULT_STATE_DIR = os.path.join(os.path.expanduser('~'), '.quickscope', 'ratelimit')
+
+# Longest time a waiting caller sleeps before checking the bucket again
+# (another process may have changed it)
+POLL_INTERVAL = 0.5
+
+class TokenBucket:
+    """A token bucket holding up to `capacity` tokens, refilled at
+    `capacity / period` tokens per second.
+
+    If `path` is given, the bucket's state is kept in that file (locked
+    while it is updated), so every process using the same file shares one
+    budget. Otherwise the state is only shared between threads.
+    """
+
+    def __init__(self, capacity, period, path = None):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.path = path
+        self._tokens = capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+    def take(self, floor = 0, count = 1):
+        """Takes `count` tokens if at least `floor` tokens would be left.
+
+        Returns 0 if the tokens were taken, otherwise the number of seconds
+        until enough tokens should be available.
+        """
+
+        with self._lock:
+            return self._update(lambda tokens: self._take(tokens, floor, count))
+
+    def drain(self):
+        """Empties the bucket, e.g. after the server reported that the rate
+        limit was hit.
+        """
+
+        with self._lock:
+            self._update(lambda tokens: (0, None))
+
+    def available(self):
+        """Returns the number of tokens currently in the bucket."""
+
+        with self._lock:
+            return self._update(lambda tokens: (tokens, tokens))
+
+    def _take(self, tokens, floor, count):
+        if tokens - count >= floor:
+            return (tokens - count, 0)
+        return (tokens, (floor + count - tokens) / self.rate)
+
+    def _update(self, change):
+        # Refills the bucket, applies change(tokens) -> (new tokens, result)
+        # and saves the state. Must be called with self._lock held.
+        if self.path is None:
+            (self._tokens, result) = change(self._refill(self._tokens, self._updated))
+            self._updated = time.time()
+            return result
+
+        with open(self.path, 'a+') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+
+            f.seek(0)
+            try:
+                state = json.loads(f.read())
+                (tokens, updated) = (state['tokens'], state['updated'])
+            except (ValueError, KeyError):
+                (tokens, updated) = (self.capacity, time.time())
+
+            (tokens, result) = change(self._refill(tokens, updated))
+
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps({ 'tokens': tokens, 'updated': time.time() }))
+            f.flush()
+            return result
+
+    def _refill(self, tokens, updated):
+        return min(self.capacity, tokens + max(0, time.time() - updated) * self.rate)
+
+class RateLimiter:
+    """Client-side rate limiting for the Mojang endpoints: one TokenBucket
+    per endpoint family (see FAMILIES), with priority classes.
+
+    A caller is only given a token while no caller of a higher priority in
+    this process is waiting for the same family, and while taking it leaves
+    the RESERVE for its priority in the bucket. Callers that cannot have a
+    token yet sleep until one should be available.
+    """
+
+    def __init__(self, state_dir = None, enabled = True):
+        self.enabled = enabled
+        self._state_dir = state_dir
+        self._buckets = {}
+        self._waiting = {}
+        self._cond = threading.Condition()
+
+    def configure(self, state_dir = None, enabled = None):
+        """Changes where bucket state is shared, and/or enables or disables
+        rate limiting. Existing buckets are replaced.
+        """
+
+        with self._cond:
+            if enabled is not None:
+                self.enabled = enabled
+            self._state_dir = state_dir
+            self._buckets = {}
+
+    def bucket(self, family):
+        """Returns the TokenBucket for an endpoint family."""
+
+        with self._cond:
+            bucket = self._buckets.get(family)
+            if bucket is None:
+                (requests, period) = FAMILIES[family]
+                path = None if self._state_dir is None else os.path.join(self._state_dir, '{}.json'.format(family))
+                bucket = TokenBucket(requests, period, path)
+                self._buckets[family] = bucket
+            return bucket
+
+    def acquire(self, url, priority = PRIORITY_NORMAL):
+        """Blocks until a request to the host of the Url `url` may be sent.
+        Hosts that do not belong to a family (see HOSTS) are not limited.
+        """
+
+        family = HOSTS.get(url.host)
+        if not self.enabled or family is None:
+            return
+
+        bucket = self.bucket(family)
+        floor = bucket.capacity * RESERVE[priority]
+        key = (family, priority)
+
+        with self._cond:
+            self._waiting[key] = self._waiting.get(key, 0) + 1
+
+        try:
+            while True:
+                with self._cond:
+                    blocked = any(self._waiting.get((family, p), 0) > 0 for p in RESERVE if p < priority)
+
+                wait = POLL_INTERVAL if blocked else bucket.take(floor)
+                if wait == 0:
+                    return
+
+                with self._cond:
+                    self._cond.wait(min(wait, POLL_INTERVAL))
+        finally:
+            with self._cond:
+                self._waiting[key] -= 1
+                self._cond.notify_all()
+
+    def try_acquire(self, url, priority = PRIORITY_NORMAL):
+        """Non-blocking version of acquire(), for callers that cannot sleep
+        (e.g. coroutines).
+
+        Returns 0 if the request may be sent, otherwise the number of seconds
+        to wait before trying again.
+        """
+
+        family = HOSTS.get(url.host)
+        if not self.enabled or family is None:
+            return 0
+
+        with self._cond:
+            if any(self._waiting.get((family, p), 0) > 0 for p in RESERVE if p < priority):
+                return POLL_INTERVAL
+
+        bucket = self.bucket(family)
+        return bucket.take(bucket.capacity * RESERVE[priority])
+
+    def limited(self, url):
+        """Records that the server rejected a request to the host of the
+        Url `url` for exceeding its rate limit, by emptying its bucket.
+        """
+
+        family = HOSTS.get(url.host)
+        if self.enabled and family is not None:
+            self.bucket(family).drain()
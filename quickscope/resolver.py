@@ -0,0 +1,195 @@
+import http.client
+import socket
+import threading
+import time
+
+# Default number of seconds between background refreshes
+DEFAULT_REFRESH_INTERVAL = 5 * 60
+
+# Number of TCP connects used to time each address
+PROBE_SAMPLES = 3
+
+# Seconds to wait for each probe connect
+PROBE_TIMEOUT = 2
+
+def resolve(host, port):
+    """Resolves `host` to the addresses it can be reached on over TCP.
+
+    Returns a list of IP address strings, in the order getaddrinfo returned
+    them, without duplicates.
+    """
+
+    addresses = []
+    for (family, type, proto, canonname, sockaddr) in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+        if sockaddr[0] not in addresses:
+            addresses.append(sockaddr[0])
+    return addresses
+
+def probe(address, port, samples = PROBE_SAMPLES, timeout = PROBE_TIMEOUT):
+    """Times TCP connects to `address` on `port`.
+
+    Returns the fastest of `samples` connect times in seconds, or None if
+    every connect failed.
+    """
+
+    best = None
+    for i in range(samples):
+        before = time.perf_counter()
+        try:
+            sock = socket.create_connection((address, port), timeout)
+        except OSError:
+            continue
+        elapsed = time.perf_counter() - before
+        sock.close()
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+class PinnedHTTPConnection(http.client.HTTPConnection):
+    """An http.client.HTTPConnection that connects to the address its
+    `resolver` has pinned for its host, rather than resolving the host name
+    itself. The Host header still uses the host name.
+    """
+
+    # Resolver to look the host's address up in; if None, the host name is
+    # connected to directly
+    resolver = None
+
+    def connect(self):
+        address = self.host if self.resolver is None else self.resolver.address(self.host, self.port)
+        self.sock = socket.create_connection((address, self.port), self.timeout, self.source_address)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self._tunnel_host:
+            self._tunnel()
+
+class PinnedHTTPSConnection(http.client.HTTPSConnection, PinnedHTTPConnection):
+    """HTTPS version of PinnedHTTPConnection. HTTPSConnection.connect()
+    opens the socket with PinnedHTTPConnection.connect(), and then verifies
+    (and sends as the TLS server name) the host name.
+    """
+
+class Resolver:
+    """Caches the addresses of the hosts quickscope connects to, and pins
+    each host to one address, so that connections are never resolved at
+    connect time (e.g. just before a rename is fired) and all go to the same
+    server.
+
+    When a host has several addresses, each one's connect latency is probed
+    and the fastest is pinned. start() re-resolves (and re-probes) every
+    known host in the background every `refresh_interval` seconds.
+
+    While disabled, address() returns host names unchanged.
+    """
+
+    def __init__(self, refresh_interval = DEFAULT_REFRESH_INTERVAL, enabled = True):
+        self.refresh_interval = refresh_interval
+        self.enabled = enabled
+        self._pinned = {} # (host, port) -> address
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def configure(self, refresh_interval = None, enabled = None):
+        """Changes the refresh interval and/or enables or disables pinning."""
+
+        with self._lock:
+            if refresh_interval is not None:
+                self.refresh_interval = refresh_interval
+            if enabled is not None:
+                self.enabled = enabled
+
+    def pin(self, host, port):
+        """Resolves `host` and probes its addresses now, and pins the
+        fastest. Keeps the previous pin if resolution fails.
+
+        Returns the pinned address, or None if `host` could not be resolved.
+        """
+
+        try:
+            addresses = resolve(host, port)
+        except OSError as e:
+            print('Warning: failed to resolve {}: {}'.format(host, e))
+            with self._lock:
+                return self._pinned.get((host, port))
+
+        if len(addresses) == 1:
+            (address, timings) = (addresses[0], None)
+        else:
+            timings = [ (probe(address, port), address) for address in addresses ]
+            reachable = [ (elapsed, address) for (elapsed, address) in timings if elapsed is not None ]
+            address = min(reachable)[1] if reachable else addresses[0]
+
+        with self._lock:
+            previous = self._pinned.get((host, port))
+            self._pinned[(host, port)] = address
+
+        if address != previous:
+            if timings is None:
+                print('Resolved {} to {}'.format(host, address))
+            else:
+                print('Resolved {} to {}; pinned {}'.format(host, ', '.join(
+                    '{} ({})'.format(candidate, 'unreachable' if elapsed is None else '{:.1f}ms'.format(elapsed * 1000))
+                    for (elapsed, candidate) in timings), address))
+        return address
+
+    def prefetch(self, endpoints):
+        """Pins every (host, port) in `endpoints` that is not pinned yet."""
+
+        for (host, port) in endpoints:
+            with self._lock:
+                pinned = (host, port) in self._pinned
+            if not pinned:
+                self.pin(host, port)
+
+    def address(self, host, port):
+        """Returns the address to connect to for `host`, pinning it first if
+        needed. Falls back to `host` itself if pinning is disabled or `host`
+        cannot be resolved.
+        """
+
+        if not self.enabled:
+            return host
+
+        with self._lock:
+            address = self._pinned.get((host, port))
+        if address is None:
+            address = self.pin(host, port)
+        return host if address is None else address
+
+    def connection(self, ssl, host, port):
+        """Creates an HTTP(S)Connection to `host` that connects to the
+        host's pinned address (see PinnedHTTPConnection).
+
+        Keyword arguments:
+        ssl -- Whether to use HTTPS
+        host -- Host name to connect to
+        port -- Port to connect to
+        """
+
+        conn = PinnedHTTPSConnection(host, port) if ssl else PinnedHTTPConnection(host, port)
+        conn.resolver = self
+        return conn
+
+    def start(self):
+        """Starts refreshing every pinned host in the background."""
+
+        if self._thread is not None or not self.enabled or self.refresh_interval <= 0:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='quickscope-resolver')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            with self._lock:
+                endpoints = list(self._pinned)
+            for (host, port) in endpoints:
+                self.pin(host, port)
@@ -0,0 +1,276 @@
+import collections
+import email.utils
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+import quickscope.metrics
+import quickscope.mojang
+
+# Login sessions and rename authenticity tokens. Login cookies are kept on
+# disk per account, so that a restarted slave does not log in again, and are
+# only refreshed (by logging in) once they expire. Rename authenticity tokens
+# are fetched in a batch well before the window and handed out from a pool,
+# rather than each request fetching its own just before firing.
+
+# Default location of the session store
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.quickscope', 'sessions.json')
+
+# Seconds a login is assumed to last if its cookies do not say
+DEFAULT_SESSION_TTL = 6 * 60 * 60
+
+# Sessions expiring within this many seconds are treated as expired
+REFRESH_MARGIN = 5 * 60
+
+# One rename authenticity token. `cookies` (a SimpleCookie) must be sent with
+# it, and it is only valid until its session expires at `expires`.
+RenameToken = namedtuple('RenameToken', ['token', 'cookies', 'fetched', 'expires'])
+
+def cookie_expiry(cookies, now = None, default_ttl = DEFAULT_SESSION_TTL):
+    """Returns when (Unix time) the first of `cookies` (a SimpleCookie)
+    expires, from their Max-Age or Expires attributes; or `default_ttl`
+    seconds from `now` if none has either.
+    """
+
+    if now is None:
+        now = time.time()
+
+    expiries = []
+    for morsel in cookies.values():
+        if morsel['max-age']:
+            try:
+                expiries.append(now + int(morsel['max-age']))
+                continue
+            except ValueError:
+                pass
+        if morsel['expires']:
+            parsed = email.utils.parsedate_tz(morsel['expires'])
+            if parsed is not None:
+                expiries.append(email.utils.mktime_tz(parsed))
+
+    return min(expiries) if expiries else now + default_ttl
+
+class SessionStore:
+    """Login cookies of each account, kept in a JSON file that only the
+    current user can read. The file may be shared between processes: it is
+    re-read on every load and replaced atomically on every save.
+
+    Keyword arguments:
+    path -- Path of the JSON file (created if missing)
+    """
+
+    def __init__(self, path = DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self, username):
+        """Returns the stored (cookies, expiry) of `username`, where cookies
+        is a SimpleCookie, or None if there are none or they have expired.
+        """
+
+        with self._lock:
+            entry = self._read().get(username)
+        if entry is None or entry['expires'] - REFRESH_MARGIN <= time.time():
+            return None
+
+        cookies = quickscope.mojang.get_cookies([ ('Set-Cookie', entry['cookies']) ])
+        return (cookies, entry['expires'])
+
+    def save(self, username, cookies, expires):
+        """Stores the login cookies (a SimpleCookie) of `username`."""
+
+        with self._lock:
+            sessions = self._read()
+            sessions[username] = { 'cookies': cookies.output(attrs=[], header='', sep=';'), 'expires': expires, 'saved': time.time() }
+            self._write(sessions)
+
+    def remove(self, username):
+        """Forgets the login cookies of `username`."""
+
+        with self._lock:
+            sessions = self._read()
+            if sessions.pop(username, None) is not None:
+                self._write(sessions)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, sessions):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        temp = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump(sessions, f)
+        os.replace(temp, self.path)
+
+class Session:
+    """A logged in Mojang account. Logs in lazily: on the first call to
+    cookies(), and again whenever the login has expired or was invalidated.
+
+    Keyword arguments:
+    username -- Mojang username
+    password -- Mojang password
+    store -- (optional) SessionStore to load login cookies from and save
+             them to
+    ttl -- (optional) Seconds a login is assumed to last if its cookies do
+           not say
+    """
+
+    def __init__(self, username, password, store = None, ttl = DEFAULT_SESSION_TTL):
+        self.username = username
+        self.password = password
+        self.store = store
+        self.ttl = ttl
+        self.expires = None
+        self.error = None # Why the last login failed, if it did
+        self._cookies = None
+        self._lock = threading.Lock()
+
+    def cookies(self):
+        """Returns the login cookies (a SimpleCookie), logging in if needed.
+        Returns None if the login failed; see `error`.
+        """
+
+        with self._lock:
+            cookies = self._current()
+            if cookies is not None:
+                return cookies
+            return self._logged_in(quickscope.mojang.login(self.username, self.password))
+
+    def current(self):
+        """Returns the login cookies if there is a login (in memory or
+        stored) that has not expired, without logging in; otherwise None.
+        """
+
+        with self._lock:
+            return self._current()
+
+    def logged_in(self, result):
+        """Records the result of logging in (as returned by mojang#login, or
+        its coroutine version), for callers that log in themselves.
+
+        Returns the login cookies, or None if the login failed; see `error`.
+        """
+
+        with self._lock:
+            return self._logged_in(result)
+
+    def invalidate(self):
+        """Forgets the login, e.g. because the server no longer accepts it;
+        the next call to cookies() logs in again.
+        """
+
+        with self._lock:
+            self._cookies = None
+            self.expires = None
+            if self.store is not None:
+                self.store.remove(self.username)
+
+    def _current(self):
+        if self._cookies is not None and self.expires - REFRESH_MARGIN > time.time():
+            return self._cookies
+
+        stored = self.store.load(self.username) if self.store is not None else None
+        if stored is None:
+            return None
+
+        (self._cookies, self.expires) = stored
+        print('Using stored login for {} (expires in {:.0f}s)'.format(self.username, self.expires - time.time()))
+        return self._cookies
+
+    def _logged_in(self, result):
+        self.error = quickscope.mojang.get_login_error(result)
+        if self.error is not None:
+            quickscope.metrics.LOGINS.inc(result='failed')
+            self._cookies = None
+            return None
+
+        quickscope.metrics.LOGINS.inc(result='ok')
+        self._cookies = quickscope.mojang.get_cookies(result[1])
+        self.expires = cookie_expiry(self._cookies, default_ttl=self.ttl)
+        if self.store is not None:
+            self.store.save(self.username, self._cookies, self.expires)
+        return self._cookies
+
+class TokenPool:
+    """Rename authenticity tokens for one profile, fetched in batches and
+    handed out one per request. Tokens whose session has expired are
+    dropped.
+
+    The pool may be shared between threads.
+
+    Keyword arguments:
+    session -- Session to fetch tokens with
+    uuid -- UUID of the Minecraft account to be renamed
+    """
+
+    def __init__(self, session, uuid):
+        self.session = session
+        self.uuid = uuid
+        self._tokens = collections.deque()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tokens)
+
+    def prefetch(self, count):
+        """Fetches tokens until `count` are pooled. If the server rejects the
+        session, logs in again once.
+
+        Returns the number of tokens pooled.
+        """
+
+        relogged = False
+        while len(self) < count:
+            cookies = self.session.cookies()
+            result = None if cookies is None else quickscope.mojang.get_rename_token(self.uuid, cookies)
+            if result is None:
+                if relogged:
+                    break
+                self.session.invalidate()
+                quickscope.metrics.LOGIN_RETRIES.inc()
+                relogged = True
+                continue
+            self.add(result)
+
+        return len(self)
+
+    def take(self):
+        """Returns a RenameToken from the pool, fetching one if the pool is
+        empty, or None if no token could be fetched.
+        """
+
+        token = self.pop()
+        if token is None and self.prefetch(1) > 0:
+            token = self.pop()
+        return token
+
+    def add(self, result):
+        """Pools a (authenticity token, cookies) tuple, as returned by
+        mojang#get_rename_token, valid until the session expires.
+        """
+
+        (token, token_cookies) = result
+        with self._lock:
+            self._tokens.append(RenameToken(token, token_cookies, time.time(), self.session.expires))
+
+    def pop(self):
+        """Returns the oldest pooled RenameToken that has not expired, or
+        None if there is none; never fetches.
+        """
+
+        now = time.time()
+        with self._lock:
+            while self._tokens:
+                token = self._tokens.popleft()
+                if token.expires > now:
+                    return token
+        return None
@@ -0,0 +1,51 @@
+import asyncio
+import quickscope.accounts
+import quickscope.mojang_async
+import quickscope.session
+
+# Asyncio equivalents of the methods of quickscope.session.Session and
+# TokenPool that send requests, and of quickscope.accounts.login_all. Every function here is a coroutine that
+# works on the same Session and TokenPool objects, so logins and tokens
+# are still stored and pooled by quickscope.session.
+
+async def cookies(session):
+    """Coroutine version of session#Session.cookies."""
+
+    current = session.current()
+    if current is not None:
+        return current
+    return session.logged_in(await quickscope.mojang_async.login(session.username, session.password))
+
+async def prefetch(tokens, count):
+    """Coroutine version of session#TokenPool.prefetch."""
+
+    relogged = False
+    while len(tokens) < count:
+        login_cookies = await cookies(tokens.session)
+        result = None if login_cookies is None else await quickscope.mojang_async.get_rename_token(tokens.uuid, login_cookies)
+        if result is None:
+            if relogged:
+                break
+            tokens.session.invalidate()
+            relogged = True
+            continue
+        tokens.add(result)
+
+    return len(tokens)
+
+async def take(tokens):
+    """Coroutine version of session#TokenPool.take."""
+
+    token = tokens.pop()
+    if token is None and await prefetch(tokens, 1) > 0:
+        token = tokens.pop()
+    return token
+
+async def login_all(accounts, store = None):
+    """Coroutine version of accounts#login_all. Every account logs in at
+    once.
+    """
+
+    sessions = [ quickscope.session.Session(account.username, account.password, store) for account in accounts ]
+    results = await asyncio.gather(*[ cookies(session) for session in sessions ])
+    return quickscope.accounts.logged_in(accounts, sessions, results)
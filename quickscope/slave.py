@@ -1,8 +1,18 @@
-from threading import Thread
+from threading import Event, Lock, Thread, Timer
+import http.client
 import time
+import quickscope.accounts
+import quickscope.clock
+import quickscope.collector
+import quickscope.control
+import quickscope.fireplan
+import quickscope.hotwindow
+import quickscope.metrics
 import quickscope.mojang
+import quickscope.ratelimit
+import quickscope.session
 import quickscope.timing
-import quickscope.app
+import quickscope.trace
 
 # Maximum number of login attempts
 RETRY_LIMIT = 5
@@ -10,86 +20,468 @@ RETRY_LIMIT = 5
 # Latency check accuracy
 LATENCY_CHECK_ACCURACY = 10
 
-debugkek = 0
+# Seconds to wait for outstanding requests once the last one is due
+FINISH_TIMEOUT = 60
 
-def start(args, username, password, retries = 0):
-    global debugkek
-    
-    available = args.expiry + quickscope.app.USERNAME_HOLDING_TIME
+# Seconds before its requests are prepared (see SnipeThread.PREPARE_TIME)
+# that a slave stops waiting for the master's fire plan and plans its own
+OFFSETS_MARGIN = 30
+
+# Arguments that a schedule pushed by the master may override; any other
+# field is ignored
+SCHEDULE_FIELDS = ('target', 'expiry', 'variance', 'interval', 'requests', 'offsets', 'plan_window', 'measure', 'warm')
+
+def start(args, username, password, retries = 0, control = None):
+    if retries == 0 and control is None:
+        control = connect_control(args)
+
+    available = args.expiry + quickscope.mojang.USERNAME_HOLDING_TIME
 #    remaining = available - time.time()
 
-    # Try to login
-    login_result = quickscope.mojang.login(username, password)
-    login_error = quickscope.mojang.get_login_error(login_result)
+    # Try to login every account at once (or reuse stored logins)
+    accounts = load_accounts(args, username, password)
+    sessions = quickscope.accounts.login_all(accounts, session_store(args))
 
-    if login_error is not None:
+    if not sessions:
         if retries < RETRY_LIMIT:
-            return start(args, username, password, retries + 1)
+            quickscope.metrics.LOGIN_RETRIES.inc()
+            return start(args, username, password, retries + 1, control)
         else:
-            print('Error: failed to login after {} attempts. Latest error message: {}'.format(RETRY_LIMIT, login_error))
+            print('Error: failed to login after {} attempts'.format(RETRY_LIMIT))
             return
-
-    # Store login cookies
-    login_cookies = quickscope.mojang.get_cookies(login_result[1])
     
-    # Get the latency to Mojang server
-    latency = quickscope.mojang.time_rename_profile(LATENCY_CHECK_ACCURACY, username, password, args.uuid, login_cookies)
+    # Get the latency to Mojang server, for each account
+    calibrated = []
+    for (account, session) in sessions:
+        if len(sessions) > 1:
+            print('Account {}:'.format(account.username))
+        profile = quickscope.mojang.profile_rename_profile(LATENCY_CHECK_ACCURACY, account.username, account.password, account.uuid, session.cookies())
+        if profile is None:
+            print('Error: failed to measure latency')
+            continue
+
+        latency = profile.estimate(args.latency_estimate)
+        print(profile.format())
+        print('Latency ({}): {}'.format(args.latency_estimate, latency))
+        calibrated.append((account, session, profile, latency))
+
+    if not calibrated:
+        return
+
     variance = args.variance / 1000
     interval = args.interval / 1000
 
-    print('Latency: {}'.format(latency))
-    debugkek = available
+    # Fire by the server's clock rather than ours
+    clock = measure_clock(args.clock_samples)
+    offset = 0 if clock is None else clock.offset
+    report_ready(control)
+
+    # Work out when (relative to availability) to aim each request; the
+    # accounts take turns along this one schedule
+    errors = [ error for (_, _, profile, latency) in calibrated for error in arrival_errors(profile, latency, clock) ]
+    aims = fire_offsets(args, sorted(errors), control)
+    turns = [ calibrated[request % len(calibrated)] for request in range(len(aims)) ]
+
+    # Fetch every request's authenticity token now, rather than each one
+    # just before firing
+    pools = {}
+    for (account, session, _, _) in calibrated:
+        pools[account] = quickscope.session.TokenPool(session, account.uuid)
+        wanted = len([ turn for turn in turns if turn[0] == account ])
+        print('Prefetched {} of {} rename tokens{}'.format(pools[account].prefetch(wanted), wanted, ' for ' + account.username if len(calibrated) > 1 else ''))
+
+    # One dispatcher thread fires every request, and one collector thread
+    # reads every response
+    scheduler = quickscope.timing.Scheduler()
+    scheduler.start()
+    threads = []
+    collector = quickscope.collector.ResponseCollector(on_status=lambda request, status: succeeded(threads, status))
+    collector.start()
 
     # SEND THE BATTLESHIPS TO BATTLE fdsjnkhgnslhdfsk
-    for request in range(args.requests):
-        when = available - latency + variance + interval * request
-        thread = SnipeThread(when, username, password, args.uuid, args.target, login_cookies)
+    for (request, (aim, (account, _, _, latency))) in enumerate(zip(aims, turns)):
+        when = available - offset - latency + aim
+        trace = { 'index': request, 'target': args.target, 'available': available, 'offset': offset, 'aim': aim, 'account': account.username,
+                  'latency': latency, 'latency_estimate': args.latency_estimate, 'variance': variance, 'interval': interval }
+        threads.append(SnipeThread(when, account.username, account.password, account.uuid, args.target, pools[account], scheduler, collector, trace, control))
+
+    # Keep the dispatcher thread undisturbed around the fire times
+    hot = None
+    if args.hot_window and threads:
+        hot = quickscope.hotwindow.HotWindow(scheduler, args.priority, args.cpu)
+        (wall, perf) = (time.time(), time.perf_counter())
+        deadlines = [ perf + thread.when - wall for thread in threads ]
+        hot.arm(min(deadlines), max(deadlines))
+
+    # Stop every request that has not been sent when the master says so
+    if control is not None:
+        control.on_cancel = lambda: [ thread.cancel() for thread in threads ]
+        if control.cancelled.is_set():
+            control.on_cancel()
+
+    for thread in threads:
         thread.start()
 
+    # The dispatcher thread is a daemon, so wait until every request has been
+    # answered (or cancelled), then tell the master (if any)
+    deadline = max([ thread.when for thread in threads ] + [ time.time() ]) + FINISH_TIMEOUT
+    for thread in threads:
+        thread.finished.wait(max(0, deadline - time.time()))
+
+    # Print the hot window's report, and whatever it held back, before
+    # exiting (or moving on to the next target) rather than when the window
+    # was due to close
+    if hot is not None:
+        hot.finish(FINISH_TIMEOUT)
+
+    if len(calibrated) > 1:
+        print(format_accounts([ (thread.username, thread.status, thread.cancelled) for thread in threads ]))
+    collector.stop()
+
+    if next_target(args, control):
+        scheduler.stop()
+        return start(args, username, password, control=control)
+
+def succeeded(threads, status):
+    # Called by the response collector as soon as a status line arrives:
+    # once the name is ours, drop every request that has not been sent
+    if status == quickscope.control.STATUS_SUCCESS:
+        for thread in threads:
+            thread.cancel()
+
+def report_ready(control = None):
+    """Prints (and traces, and tells the master) how long this slave took to
+    be logged in and calibrated: since its process started, and since the
+    system booted.
+    """
+
+    now = time.time()
+    started = now - quickscope.timing.process_started()
+    booted = quickscope.timing.system_booted()
+    since_boot = None if booted is None else now - booted
+
+    print('Ready {:.2f}s after start{}'.format(started, '' if since_boot is None else ' ({:.1f}s after boot)'.format(since_boot)))
+    quickscope.trace.TRACER.emit('ready', process=started, boot=since_boot)
+    if control is not None:
+        control.ready(process=started, boot=since_boot)
+
+def session_store(args):
+    """Returns the quickscope.session.SessionStore in args.sessions, or None."""
+
+    return quickscope.session.SessionStore(args.sessions) if args.sessions else None
+
+def load_accounts(args, username, password):
+    """Returns the accounts to snipe with: the one given by arguments, then
+    those in args.accounts (a file; see quickscope.accounts), if any.
+    """
+
+    primary = [ quickscope.accounts.Account(username, password, args.uuid.replace('-', '')) ]
+    if not args.accounts:
+        return primary
+    return quickscope.accounts.merge(primary, quickscope.accounts.load_accounts(args.accounts))
+
+def format_accounts(results):
+    """Returns a summary of how each account's requests went, given a list
+    of (username, response status or None, whether cancelled) tuples, one
+    per request.
+    """
+
+    accounts = []
+    for (username, _, _) in results:
+        if username not in accounts:
+            accounts.append(username)
+
+    lines = []
+    for username in accounts:
+        mine = [ (status, cancelled) for (name, status, cancelled) in results if name == username ]
+        statuses = [ str(status) for (status, _) in mine if status is not None ]
+        outcome = 'claimed the name' if any(status == quickscope.control.STATUS_SUCCESS for (status, _) in mine) else 'did not claim the name'
+        lines.append('Account {}: {} of {} requests answered ({}), {} cancelled; {}'.format(
+            username, len(statuses), len(mine), ', '.join(statuses) or 'none', len([ 1 for (_, cancelled) in mine if cancelled ]), outcome))
+    return '\n'.join(lines)
+
+def connect_control(args):
+    """Registers with the master if a control channel was given (see
+    quickscope.control), and applies the schedule it pushes to `args`.
+
+    Returns a connected ControlClient, or None.
+    """
+
+    if not args.master:
+        return None
+
+    control = quickscope.control.ControlClient(quickscope.control.parse_address(args.master), args.name, args.token)
+    try:
+        control.connect()
+    except OSError as e:
+        print('Warning: failed to connect to master: {}'.format(e))
+        return None
+
+    schedule = control.wait_schedule()
+    if schedule is None:
+        print('Warning: master did not send a schedule; using arguments')
+    else:
+        apply_schedule(args, schedule)
+
+    return control
+
+def apply_schedule(args, schedule):
+    """Overrides `args` with the fields of a schedule pushed by the master
+    that are in SCHEDULE_FIELDS, ignoring (with a warning) the rest.
+    """
+
+    ignored = sorted(key for key in schedule if key not in SCHEDULE_FIELDS)
+    if ignored:
+        print('Warning: ignoring unknown schedule fields from master: {}'.format(', '.join(ignored)))
+    schedule = dict((key, value) for (key, value) in schedule.items() if key in SCHEDULE_FIELDS)
+    for (key, value) in schedule.items():
+        setattr(args, key, value)
+    print('Schedule from master: {}'.format(schedule))
+
+def next_target(args, control = None):
+    """Called once every request was sent or cancelled: tells the master (if
+    any) that this slave is done. If the master's schedule asked this slave
+    to stay warm, waits for it to hand over another target (see
+    quickscope.warmpool) and applies that schedule to `args`.
+
+    Returns True if there is another target to snipe.
+    """
+
+    if control is None:
+        return False
+
+    if getattr(args, 'warm', False):
+        print('Waiting for the master to hand over another target...')
+        schedule = control.idle()
+        if schedule is not None:
+            apply_schedule(args, schedule)
+            return True
+        print('Released by master' if control.released else 'Warning: lost connection to master')
+    else:
+        control.done()
+
+    control.close()
+    return False
+
+def arrival_errors(profile, latency, clock):
+    """Returns samples of how far (in ms) a request's arrival may be from
+    where it was aimed (see quickscope.fireplan), given the latency profile,
+    the latency estimate subtracted (seconds) and the ClockOffset used (or
+    None).
+    """
+
+    one_way = [ ttfb * 1000 / 2 for ttfb in profile.values('ttfb') ]
+    if clock is None:
+        return quickscope.fireplan.residuals(one_way, latency * 1000)
+    return quickscope.fireplan.residuals(one_way, latency * 1000, (clock.low - clock.offset) * 1000, (clock.high - clock.offset) * 1000)
+
+def fire_offsets(args, errors, control = None):
+    """Returns the offsets (seconds after availability) to aim each request
+    at: the offsets given (by argument or by the master's schedule); or, if a
+    plan window was given, offsets planned from the arrival error samples
+    `errors` (by the master if it asked for them, otherwise locally); or
+    VARIANCE + INTERVAL * i for each request, also if there are no error
+    samples to plan from.
+    """
+
+    if args.offsets is not None:
+        return [ offset / 1000 for offset in args.offsets ]
+
+    static = [ (args.variance + args.interval * i) / 1000 for i in range(args.requests) ]
+    if not args.plan_window:
+        return static
+
+    offsets = None
+    if control is not None and getattr(args, 'measure', False):
+        control.measurements(errors)
+        available = args.expiry + quickscope.mojang.USERNAME_HOLDING_TIME
+        deadline = available - SnipeThread.PREPARE_TIME - OFFSETS_MARGIN
+        offsets = control.wait_offsets(max(min(quickscope.control.OFFSETS_TIMEOUT, deadline - time.time()), 0))
+        if offsets is None:
+            print('Warning: master did not send offsets; planning locally')
+
+    if not errors:
+        # The plan would have no requests at all
+        print('Warning: no arrival error samples to plan from; using VARIANCE and INTERVAL')
+        return static
+
+    if offsets is None:
+        offsets = quickscope.fireplan.worker_offsets(errors, args.requests, args.plan_window)
+
+    print('Fire plan:')
+    print(quickscope.fireplan.format_plan({ 'offsets': offsets }, { 'offsets': errors }, args.plan_window))
+    return [ offset / 1000 for offset in offsets ]
+
+def measure_clock(samples):
+    """Estimates the offset of the Mojang accounts server's clock from ours
+    (see quickscope.clock) using `samples` requests to the login page.
+
+    Returns the ClockOffset, or None if calibration is disabled (samples is
+    0), failed, or is too uncertain to fire by (see
+    quickscope.clock.trusted).
+    """
+
+    if samples <= 0:
+        return None
+
+    url = quickscope.mojang.URL_LOGIN
+
+    # Calibration sends its requests itself, so take its budget up front
+    for i in range(samples + 1):
+        quickscope.mojang.LIMITER.acquire(url, quickscope.ratelimit.PRIORITY_CRITICAL)
+
+    try:
+        offset = quickscope.clock.calibrate(url, samples=samples, headers={ 'User-Agent': quickscope.mojang.USER_AGENT }, pool=quickscope.mojang.POOLS.get(url))
+    except (http.client.HTTPException, OSError) as e:
+        print('Warning: failed to calibrate clock: {}'.format(e))
+        return None
+
+    if offset is None:
+        print('Warning: failed to calibrate clock: no Date headers')
+        return None
+
+    print('Clock: {}'.format(quickscope.clock.format_offset(offset)))
+    if not quickscope.clock.trusted(offset):
+        print('Warning: clock calibration is too uncertain; firing by our own clock')
+        return None
+    return offset
 
 class SnipeThread(Thread):
 
     PREPARE_TIME = 60
 
-    def __init__(self, when, username, password, uuid, new_name, login_cookies):
+    # Seconds before firing to check the prepared connection is still open
+    REFRESH_TIME = 8
+
+    def __init__(self, when, username, password, uuid, new_name, tokens, scheduler, collector, trace = {}, control = None):
         Thread.__init__(self)
         self.when = when
         self.username = username
         self.password = password
         self.uuid = uuid
         self.new_name = new_name
-        self.login_cookies = login_cookies
+        self.tokens = tokens # quickscope.session.TokenPool to take an authenticity token from
+        self.scheduler = scheduler
+        self.collector = collector # quickscope.collector.ResponseCollector to read the response with
+        self.trace = trace # Fields added to this request's trace record
+        self.control = control # ControlClient to report the result to, if any
+        self.finished = Event() # Set once the response was read, or the request was dropped
+        self.status = None # Status of the response, once read
+        self._cancelled = Event()
+        self._event = None
+        self._request = None
+        self._refresh = None # Timer that checks the prepared connection before firing
+        self._deadline = None
+        self._woke = None
+        self._lock = Lock()
 
     def run(self):
         difference = self.when - self.PREPARE_TIME - time.time()
         if difference < 0:
             print('Snipe not run, difference < 0.')
+            self.finished.set()
             return
-        
-        timer = quickscope.timing.PreciseTimer(difference, lambda: self.prepare())
-        timer.start()
+
+        # Preparing does not need to be precise, so just sleep (unless cancelled)
+        if self._cancelled.wait(difference):
+            self.finished.set()
+            return
+        self.prepare()
+
+    @property
+    def cancelled(self):
+        """Whether the request was dropped before it was sent."""
+
+        return self._cancelled.is_set() and self._woke is None
+
+    def cancel(self):
+        """Drops the request if it has not been sent yet."""
+
+        self._cancelled.set()
+        with self._lock:
+            if self._refresh is not None:
+                self._refresh.cancel()
+            if self._event is not None and self.scheduler.cancel(self._event):
+                self._request.close()
+                self.finished.set()
+                print('Request {} cancelled'.format(self.trace.get('index')))
 
     def prepare(self):
         # Prepare the battleships/request!
-        (execute, conn, _) = quickscope.mojang.rename_profile_later(self.username, self.password, self.uuid, self.new_name, self.login_cookies)
+        token = self.tokens.take()
+        if token is None:
+            print('Fuck! Failed to get an authenticity token')
+            self.finished.set()
+            return
+        (request, conn, _) = quickscope.mojang.rename_profile_later(self.username, self.password, self.uuid, self.new_name, token=token)
 
         # Oh shit, something might have went wrong
-        if execute == False:
+        if request == False:
             print('Fuck! {}'.format(conn))
+            self.finished.set()
             return
 
         # Right, we're ready! START THE TIMERRRRRRRRRRR
         difference = self.when - time.time()
-        timer = quickscope.timing.PreciseTimer(difference, lambda: self.attack(execute, conn))
-        timer.start()
+        deadline = time.perf_counter() + difference
+        with self._lock:
+            if self._cancelled.is_set():
+                request.close()
+                self.finished.set()
+                return
+            self._request = request
+            self._deadline = deadline
+            self._event = self.scheduler.schedule_at(deadline, self.attack)
+            if difference > self.REFRESH_TIME:
+                self._refresh = Timer(difference - self.REFRESH_TIME, request.refresh)
+                self._refresh.start()
 
-    def attack(self, execute, conn):
-        before = time.perf_counter()
-        execute(conn)
-        elapsed = time.perf_counter() - before
-        
-        afterdubcek = (time.time() - debugkek) * 1000
-        
-        resp = conn.getresponse()
-        print('Attack succeeded! Status: {}; body: {}. Executed {}ms (vs {}ms); took {}; '.format(resp.status, str(resp.read()), afterdubcek, (self.when - debugkek) * 1000, elapsed * 1000))
+    def attack(self):
+        # Runs on the scheduler's dispatcher thread: only fire here, and
+        # leave the response to the collector. Everything used here was
+        # set up by prepare(), so firing allocates next to nothing.
+        self._woke = time.perf_counter()
+        self._request.fire()
+        self.collector.add(self._request, self.responded)
+
+    def responded(self, request, status, headers, body):
+        self.collect(request, status, body, self._deadline, self._woke)
+
+    def collect(self, request, status, body, deadline, woke):
+        try:
+            self._collect(request, status, body, deadline, woke)
+        finally:
+            self.finished.set()
+
+    def _collect(self, request, status, body, deadline, woke):
+        metrics = quickscope.metrics
+        metrics.WAKE_ERROR.observe(woke - deadline)
+        if request.sent_at is not None:
+            metrics.FIRE_ERROR.observe(quickscope.trace.TRACER.wall(request.sent_at) - self.when)
+        metrics.RESPONSES.inc(status='error' if status is None else status)
+
+        if status is None:
+            print('Failed to read response to request {}: {}'.format(self.trace.get('index'), body))
+            return
+        self.status = status
+
+        tracer = quickscope.trace.TRACER
+        fired = tracer.wall(request.sent_at)
+        tracer.emit('rename',
+                    scheduled=self.when,
+                    deadline=tracer.wall(deadline),
+                    woke=tracer.wall(woke),
+                    send_start=fired,
+                    send_end=tracer.wall(request.sent_at + request.send_duration),
+                    first_byte=tracer.wall(request.first_byte_at),
+                    status=status,
+                    body_size=len(body),
+                    address=request.peer,
+                    **self.trace)
+
+        print('Attack succeeded! Status: {}; body: {}. Fired {:+.3f}ms from schedule; took {}ms; sent to {}'.format(status, str(body), (fired - self.when) * 1000, request.send_duration * 1000, request.peer))
+
+        if self.control is not None:
+            self.control.report(index=self.trace.get('index'), status=status, body=body.decode('utf-8', 'replace'),
+                                fired=fired, error=round((fired - self.when) * 1000, 3), address=request.peer, account=self.username)
         
@@ -0,0 +1,228 @@
+import asyncio
+import time
+import quickscope.control
+import quickscope.metrics
+import quickscope.mojang
+import quickscope.mojang_async
+import quickscope.session
+import quickscope.session_async
+import quickscope.slave
+import quickscope.trace
+from quickscope.slave import RETRY_LIMIT, LATENCY_CHECK_ACCURACY
+
+# Asyncio engine for slave mode: login, per-request preparation, scheduled
+# firing and response collection all run on a single event loop.
+
+# Seconds before firing to prepare a request (see slave.SnipeThread)
+PREPARE_TIME = 60
+
+# Seconds before firing to check the prepared connection is still open
+REFRESH_TIME = 8
+
+# Seconds before firing at which the loop stops sleeping and busy-waits.
+# The loop's own timers are only accurate to around a millisecond.
+SPIN_TIME = 0.002
+
+def start(args, username, password):
+    """Runs slave mode on a new event loop until every request has been
+    fired and answered (and then, if the master keeps this slave warm, for
+    each further target it hands over).
+    """
+
+    control = quickscope.slave.connect_control(args)
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run(args, username, password, control))
+        while quickscope.slave.next_target(args, control):
+            loop.run_until_complete(run(args, username, password, control))
+        loop.run_until_complete(_close())
+    finally:
+        loop.close()
+
+async def _close():
+    quickscope.mojang_async.close_pools()
+
+async def run(args, username, password, control = None):
+    available = args.expiry + quickscope.mojang.USERNAME_HOLDING_TIME
+
+    # Try to login every account at once (or reuse stored logins)
+    loop = asyncio.get_event_loop()
+    accounts = quickscope.slave.load_accounts(args, username, password)
+    store = quickscope.slave.session_store(args)
+    for attempt in range(RETRY_LIMIT + 1):
+        sessions = await quickscope.session_async.login_all(accounts, store)
+        if sessions:
+            break
+        if attempt < RETRY_LIMIT:
+            quickscope.metrics.LOGIN_RETRIES.inc()
+    else:
+        print('Error: failed to login after {} attempts'.format(RETRY_LIMIT))
+        return
+
+    # Get the latency to Mojang server, for each account
+    calibrated = []
+    for (account, session) in sessions:
+        if len(sessions) > 1:
+            print('Account {}:'.format(account.username))
+        profile = await quickscope.mojang_async.profile_rename_profile(LATENCY_CHECK_ACCURACY, account.username, account.password, account.uuid, await quickscope.session_async.cookies(session))
+        if profile is None:
+            print('Error: failed to measure latency')
+            continue
+
+        latency = profile.estimate(args.latency_estimate)
+        print(profile.format())
+        print('Latency ({}): {}'.format(args.latency_estimate, latency))
+        calibrated.append((account, session, profile, latency))
+
+    if not calibrated:
+        return
+
+    variance = args.variance / 1000
+    interval = args.interval / 1000
+
+    # Calibration spends most of its time waiting for second boundaries, so
+    # run it off the loop
+    clock = await loop.run_in_executor(None, quickscope.slave.measure_clock, args.clock_samples)
+    offset = 0 if clock is None else clock.offset
+    quickscope.slave.report_ready(control)
+
+    # Work out when to aim each request (this may wait for the master); the
+    # accounts take turns along this one schedule
+    errors = [ error for (_, _, profile, latency) in calibrated for error in quickscope.slave.arrival_errors(profile, latency, clock) ]
+    aims = await loop.run_in_executor(None, quickscope.slave.fire_offsets, args, sorted(errors), control)
+    turns = [ calibrated[request % len(calibrated)] for request in range(len(aims)) ]
+
+    # Fetch every request's authenticity token now, rather than each one
+    # just before firing
+    pools = {}
+    for (account, session, _, _) in calibrated:
+        pools[account] = quickscope.session.TokenPool(session, account.uuid)
+        wanted = len([ turn for turn in turns if turn[0] == account ])
+        prefetched = await quickscope.session_async.prefetch(pools[account], wanted)
+        print('Prefetched {} of {} rename tokens{}'.format(prefetched, wanted, ' for ' + account.username if len(calibrated) > 1 else ''))
+
+    if args.hot_window:
+        print('Warning: --hot-window is only supported by the threads engine')
+
+    tasks = []
+    unsent = set() # Indices of requests that can still be cancelled
+
+    # Cancel the requests that have not been sent once one succeeds
+    def cancel():
+        for index in list(unsent):
+            tasks[index].cancel()
+            print('Request {} cancelled'.format(index))
+        unsent.clear()
+
+    for (request, (aim, (account, _, _, latency))) in enumerate(zip(aims, turns)):
+        when = available - offset - latency + aim
+        trace = { 'index': request, 'target': args.target, 'available': available, 'offset': offset, 'aim': aim, 'account': account.username,
+                  'latency': latency, 'latency_estimate': args.latency_estimate, 'variance': variance, 'interval': interval }
+        tasks.append(loop.create_task(snipe(when, account.username, account.password, account.uuid, args.target, pools[account], trace, control, unsent.discard, cancel)))
+        unsent.add(request)
+
+    if control is not None:
+        # ... or when the master says so
+        control.on_cancel = lambda: loop.call_soon_threadsafe(cancel)
+        if control.cancelled.is_set():
+            cancel()
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    if len(calibrated) > 1:
+        print(quickscope.slave.format_accounts([ (account.username, result if isinstance(result, int) else None, isinstance(result, asyncio.CancelledError))
+                                                 for ((account, _, _, _), result) in zip(turns, results) ]))
+
+async def sleep_until(when):
+    """Sleeps until the wall-clock time `when` (seconds since the epoch)."""
+
+    remaining = when - time.time()
+    if remaining > 0:
+        await asyncio.sleep(remaining)
+
+async def fire_at(when, request):
+    """Fires `request` at the wall-clock time `when`. The event loop sleeps
+    until SPIN_TIME before the deadline, then busy-waits; other coroutines do
+    not run during the spin.
+
+    Returns a tuple of the perf_counter() deadline, and the perf_counter()
+    time at which the spin ended.
+    """
+
+    deadline = time.perf_counter() + (when - time.time())
+    remaining = deadline - time.perf_counter()
+    if remaining > SPIN_TIME:
+        await asyncio.sleep(remaining - SPIN_TIME)
+
+    while time.perf_counter() < deadline:
+        pass
+
+    woke = time.perf_counter()
+    request.fire()
+    return (deadline, woke)
+
+async def snipe(when, username, password, uuid, new_name, tokens, trace = {}, control = None, on_fired = None, on_success = None):
+    """Prepares and fires one rename request at the wall-clock time `when`.
+
+    Returns the response status, or None if the request was not sent.
+    """
+
+    if when - PREPARE_TIME - time.time() < 0:
+        print('Snipe not run, difference < 0.')
+        return
+
+    await sleep_until(when - PREPARE_TIME)
+
+    # Prepare the request
+    token = await quickscope.session_async.take(tokens)
+    if token is None:
+        print('Failed to prepare request: failed to get an authenticity token')
+        return
+    (request, conn, _) = await quickscope.mojang_async.rename_profile_later(username, password, uuid, new_name, token=token)
+    if request == False:
+        print('Failed to prepare request: {}'.format(conn))
+        return
+
+    await sleep_until(when - REFRESH_TIME)
+    await request.connect()
+
+    try:
+        (deadline, woke) = await fire_at(when, request)
+    except asyncio.CancelledError:
+        request.close()
+        raise
+    if on_fired is not None:
+        on_fired(trace.get('index'))
+
+    (status, _, data) = await request.getresponse()
+    request.close()
+
+    metrics = quickscope.metrics
+    metrics.WAKE_ERROR.observe(woke - deadline)
+    metrics.FIRE_ERROR.observe(quickscope.trace.TRACER.wall(request.sent_at) - when)
+    metrics.RESPONSES.inc(status=status)
+    if status == quickscope.control.STATUS_SUCCESS and on_success is not None:
+        on_success()
+
+    tracer = quickscope.trace.TRACER
+    fired = tracer.wall(request.sent_at)
+    tracer.emit('rename',
+                scheduled=when,
+                deadline=tracer.wall(deadline),
+                woke=tracer.wall(woke),
+                send_start=fired,
+                send_end=tracer.wall(request.sent_at + request.send_duration),
+                first_byte=tracer.wall(request.conn.head_at),
+                status=status,
+                body_size=len(data),
+                address=request.conn.peer,
+                **trace)
+
+    print('Attack succeeded! Status: {}; body: {}. Fired {:+.3f}ms from schedule; took {}ms; sent to {}'.format(status, str(data), (fired - when) * 1000, request.send_duration * 1000, request.conn.peer))
+
+    if control is not None:
+        control.report(index=trace.get('index'), status=status, body=data.decode('utf-8', 'replace'),
+                       fired=fired, error=round((fired - when) * 1000, 3), address=request.conn.peer, account=username)
+
+    return status
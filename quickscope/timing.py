@@ -1,6 +1,41 @@
+import heapq
+import os
+import threading
 import time
+import traceback
 from threading import Timer
 
+# Time this module was imported; stands in for the process' start time where
+# /proc is not available
+IMPORTED_AT = time.time()
+
+def system_booted():
+    """Returns the Unix time at which the system booted, or None if unknown
+    (i.e. not on Linux).
+    """
+
+    try:
+        with open('/proc/uptime') as f:
+            return time.time() - float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+def process_started():
+    """Returns the Unix time at which this process started, including the
+    interpreter's own start-up (to within a clock tick); or, if that is
+    unknown, the time this module was imported.
+    """
+
+    booted = system_booted()
+    try:
+        with open('/proc/self/stat') as f:
+            # The command name may contain spaces, so split after it
+            fields = f.read().rpartition(')')[2].split()
+        ticks = int(fields[19]) # starttime: clock ticks after boot
+        return booted + ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, TypeError):
+        return IMPORTED_AT
+
 class PreciseTimer:
     # TODO doc
 
@@ -40,3 +75,182 @@ class PreciseTimer:
                 break
 
         self.callback()
+
+
+class ScheduledEvent:
+    """An event queued on a Scheduler. Returned by Scheduler.schedule and
+    Scheduler.schedule_at; pass it to Scheduler.cancel or
+    Scheduler.reschedule to change it.
+    """
+
+    __slots__ = ('deadline', 'callback', 'cancelled', 'fired', 'seq')
+
+    def __init__(self, deadline, callback, seq):
+        self.deadline = deadline # perf_counter() time to fire at
+        self.callback = callback
+        self.cancelled = False
+        self.fired = False
+        self.seq = seq
+
+    def __lt__(self, other):
+        return (self.deadline, self.seq) < (other.deadline, other.seq)
+
+class Scheduler:
+    """Fires callbacks at precise times from a single dispatcher thread.
+
+    Pending events are kept in a min-heap ordered by deadline. The dispatcher
+    sleeps on a condition variable until shortly before the earliest deadline
+    (waking early if an earlier event is scheduled), then runs one hybrid
+    phase for that event only: short sleeps of decreasing length, followed by
+    a busy-wait over the last SPIN_TIME seconds. Only one thread ever spins,
+    however many events are scheduled, so events do not disturb each other's
+    timing the way one PreciseTimer per event does.
+
+    Callbacks run on the dispatcher thread and delay every later event while
+    they run, so they should be short (e.g. send an already prepared request)
+    and hand any blocking work off to another thread.
+    """
+
+    # Seconds before a deadline at which the dispatcher stops waiting on the
+    # condition variable and starts the hybrid sleep/spin phase
+    COARSE_MARGIN = 0.02
+
+    # Seconds before a deadline at which the dispatcher busy-waits
+    SPIN_TIME = 0.002
+
+    def __init__(self, coarse_margin = COARSE_MARGIN, spin_time = SPIN_TIME):
+        self.coarse_margin = coarse_margin
+        self.spin_time = spin_time
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        """Starts the dispatcher thread."""
+
+        if self._thread is not None:
+            raise RuntimeError("Scheduler already started.")
+
+        self._thread = threading.Thread(target=self._run, name='quickscope-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, wait = True):
+        """Stops the dispatcher thread. Events that have not fired yet are
+        dropped.
+        """
+
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+        if wait and self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def schedule_at(self, deadline, callback):
+        """Schedules `callback` to be called (with no arguments) at the
+        time.perf_counter() value `deadline`.
+
+        Returns a ScheduledEvent.
+        """
+
+        with self._cond:
+            self._seq += 1
+            event = ScheduledEvent(deadline, callback, self._seq)
+            heapq.heappush(self._heap, event)
+
+            # Wake the dispatcher if this is now the earliest event
+            if self._heap[0] is event:
+                self._cond.notify()
+
+        return event
+
+    def schedule(self, delay, callback):
+        """Schedules `callback` to be called `delay` seconds from now.
+
+        Returns a ScheduledEvent.
+        """
+
+        return self.schedule_at(time.perf_counter() + delay, callback)
+
+    def cancel(self, event):
+        """Cancels a scheduled event. Returns False if the event has already
+        fired (or was already cancelled), True otherwise.
+        """
+
+        with self._cond:
+            if event.fired or event.cancelled:
+                return False
+            event.cancelled = True
+            self._cond.notify()
+            return True
+
+    def reschedule(self, event, delay):
+        """Moves an event so that it fires `delay` seconds from now. The old
+        event is cancelled and a new ScheduledEvent with the same callback is
+        returned, or None if the old event had already fired.
+        """
+
+        if not self.cancel(event):
+            return None
+        return self.schedule(delay, event.callback)
+
+    def pending(self):
+        """Returns the number of events that are waiting to fire."""
+
+        with self._cond:
+            return len([ event for event in self._heap if not event.cancelled ])
+
+    def _next_event(self):
+        # Blocks until the earliest event is due within the coarse margin, and
+        # pops it. Returns None if the scheduler was stopped.
+        with self._cond:
+            while True:
+                if self._stopped:
+                    return None
+
+                while self._heap and self._heap[0].cancelled:
+                    heapq.heappop(self._heap)
+
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+
+                remaining = self._heap[0].deadline - time.perf_counter()
+                if remaining > self.coarse_margin:
+                    self._cond.wait(remaining - self.coarse_margin)
+                    continue
+
+                return heapq.heappop(self._heap)
+
+    def _run(self):
+        while True:
+            event = self._next_event()
+            if event is None:
+                return
+
+            # Hybrid phase: sleep for half of the remaining time until within
+            # SPIN_TIME of the deadline, then spin
+            deadline = event.deadline
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= self.spin_time:
+                    break
+                time.sleep((remaining - self.spin_time) / 2)
+
+            while time.perf_counter() < deadline:
+                pass
+
+            # No lock here: taking it costs tens of microseconds right at
+            # the deadline. A cancel() racing with this check may report
+            # success for an event that fires anyway.
+            if event.cancelled:
+                continue
+            event.fired = True
+
+            try:
+                event.callback()
+            except Exception:
+                traceback.print_exc()
@@ -0,0 +1,319 @@
+import ctypes
+import ctypes.util
+import json
+import multiprocessing
+import platform
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+import quickscope.latency
+import quickscope.timing
+
+# Benchmarks how accurately callbacks fire with quickscope.timing and a few
+# alternative strategies: many callbacks are scheduled at varied delays,
+# optionally under background load, and each one's error (actual - intended
+# fire time) is recorded.
+
+# Default number of callbacks per strategy
+DEFAULT_COUNT = 1000
+
+# Default number of callbacks pending at once
+DEFAULT_CONCURRENCY = 20
+
+# Default range of delays, in seconds
+DEFAULT_MIN_DELAY = 0.05
+DEFAULT_MAX_DELAY = 0.5
+
+# Seconds before a deadline at which the hybrid strategy starts spinning
+SPIN_TIME = 0.002
+
+# Upper bounds (microseconds) of the histogram buckets; errors beyond the
+# last bound go in a final overflow bucket, and negative errors (early
+# fires) in their own bucket
+BUCKETS = [ 10, 50, 100, 500, 1000, 5000, 10000 ]
+
+# ========================================
+#
+#               STRATEGIES
+#
+# ========================================
+# Each strategy takes a list of perf_counter() deadlines and a callback
+# fire(i), and arranges for fire(i) to be called at deadlines[i].
+
+def run_precise_timer(deadlines, fire):
+    # One PreciseTimer per callback, each started on its own thread (as the
+    # slave used to)
+    for (i, deadline) in enumerate(deadlines):
+        timer = quickscope.timing.PreciseTimer(deadline - time.perf_counter(), lambda i=i: fire(i))
+        thread = threading.Thread(target=timer.start)
+        thread.daemon = True
+        thread.start()
+
+def run_scheduler(deadlines, fire):
+    scheduler = quickscope.timing.Scheduler()
+    scheduler.start()
+    for (i, deadline) in enumerate(deadlines):
+        scheduler.schedule_at(deadline, lambda i=i: fire(i))
+    return scheduler.stop
+
+def run_sleep(deadlines, fire):
+    # Plain sleeping, one threading.Timer per callback
+    for (i, deadline) in enumerate(deadlines):
+        timer = threading.Timer(deadline - time.perf_counter(), fire, (i,))
+        timer.daemon = True
+        timer.start()
+
+def _hybrid(deadline, i, fire):
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= SPIN_TIME:
+            break
+        time.sleep((remaining - SPIN_TIME) / 2)
+    while time.perf_counter() < deadline:
+        pass
+    fire(i)
+
+def run_hybrid(deadlines, fire):
+    # Sleep/spin on one thread per callback
+    for (i, deadline) in enumerate(deadlines):
+        thread = threading.Thread(target=_hybrid, args=(deadline, i, fire))
+        thread.daemon = True
+        thread.start()
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [ ('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long) ]
+
+def _load_clock_nanosleep():
+    if not sys.platform.startswith('linux') or not hasattr(time, 'CLOCK_MONOTONIC'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        function = libc.clock_nanosleep
+    except (OSError, AttributeError):
+        return None
+    function.argtypes = [ ctypes.c_int, ctypes.c_int, ctypes.POINTER(_Timespec), ctypes.POINTER(_Timespec) ]
+    return function
+
+_clock_nanosleep = _load_clock_nanosleep()
+
+# Flag for clock_nanosleep: the deadline is absolute
+TIMER_ABSTIME = 1
+
+def _nanosleep(monotonic_deadline, i, fire):
+    spec = _Timespec(int(monotonic_deadline), int((monotonic_deadline % 1) * 1e9))
+    # Returns EINTR if interrupted by a signal; sleep again until the deadline
+    while _clock_nanosleep(time.CLOCK_MONOTONIC, TIMER_ABSTIME, ctypes.byref(spec), None) != 0:
+        pass
+    fire(i)
+
+def run_clock_nanosleep(deadlines, fire):
+    # clock_nanosleep() with absolute CLOCK_MONOTONIC deadlines, one thread
+    # per callback (Linux only)
+    shift = time.clock_gettime(time.CLOCK_MONOTONIC) - time.perf_counter()
+    for (i, deadline) in enumerate(deadlines):
+        thread = threading.Thread(target=_nanosleep, args=(deadline + shift, i, fire))
+        thread.daemon = True
+        thread.start()
+
+STRATEGIES = OrderedDict([
+    ('precise-timer', run_precise_timer),
+    ('scheduler', run_scheduler),
+    ('sleep', run_sleep),
+    ('hybrid', run_hybrid),
+])
+if _clock_nanosleep is not None:
+    STRATEGIES['clock-nanosleep'] = run_clock_nanosleep
+
+# ========================================
+#
+#                 LOAD
+#
+# ========================================
+def _burn(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+class Load:
+    """Background CPU load: `threads` busy Python threads in this process
+    (which compete for the GIL) and `processes` busy processes (which
+    compete for CPUs).
+    """
+
+    def __init__(self, threads = 0, processes = 0):
+        self.threads = threads
+        self.processes = processes
+        self._thread_stop = threading.Event()
+        self._process_stop = multiprocessing.Event()
+        self._workers = []
+
+    def __enter__(self):
+        for i in range(self.threads):
+            thread = threading.Thread(target=_burn, args=(self._thread_stop,))
+            thread.daemon = True
+            thread.start()
+            self._workers.append(thread)
+        for i in range(self.processes):
+            process = multiprocessing.Process(target=_burn, args=(self._process_stop,))
+            process.daemon = True
+            process.start()
+            self._workers.append(process)
+        return self
+
+    def __exit__(self, *exc):
+        self._thread_stop.set()
+        self._process_stop.set()
+        for worker in self._workers:
+            worker.join()
+
+# ========================================
+#
+#               MEASUREMENT
+#
+# ========================================
+def measure(strategy, count = DEFAULT_COUNT, concurrency = DEFAULT_CONCURRENCY, min_delay = DEFAULT_MIN_DELAY, max_delay = DEFAULT_MAX_DELAY, seed = None):
+    """Fires `count` callbacks with `strategy` (a function from STRATEGIES),
+    in rounds of `concurrency` callbacks pending at once, each at a random
+    delay between `min_delay` and `max_delay` seconds.
+
+    Returns a tuple of (errors in seconds, number of callbacks that never fired).
+    """
+
+    rng = random.Random(seed)
+    errors = []
+    lost = 0
+
+    while count > 0:
+        size = min(count, concurrency)
+        count -= size
+
+        now = time.perf_counter()
+        deadlines = [ now + rng.uniform(min_delay, max_delay) for i in range(size) ]
+        fired = [ None ] * size
+        done = threading.Semaphore(0)
+
+        def fire(i):
+            fired[i] = time.perf_counter()
+            done.release()
+
+        cleanup = strategy(deadlines, fire)
+        timeout = time.perf_counter() + max_delay + 5
+        for i in range(size):
+            if not done.acquire(timeout=max(0, timeout - time.perf_counter())):
+                break
+        if cleanup is not None:
+            cleanup()
+
+        for (deadline, actual) in zip(deadlines, fired):
+            if actual is None:
+                lost += 1
+            else:
+                errors.append(actual - deadline)
+
+    return (errors, lost)
+
+def histogram(errors):
+    """Counts errors (in seconds) into BUCKETS. Returns an OrderedDict of
+    bucket label -> count.
+    """
+
+    labels = [ '<0' ] + [ '<{}us'.format(bound) for bound in BUCKETS ] + [ '>={}us'.format(BUCKETS[-1]) ]
+    counts = OrderedDict((label, 0) for label in labels)
+    for error in errors:
+        micros = error * 1e6
+        if micros < 0:
+            counts['<0'] += 1
+            continue
+        for bound in BUCKETS:
+            if micros < bound:
+                counts['<{}us'.format(bound)] += 1
+                break
+        else:
+            counts['>={}us'.format(BUCKETS[-1])] += 1
+    return counts
+
+def summarize(errors, lost):
+    """Summarizes errors as a dictionary of statistics in microseconds."""
+
+    values = sorted(errors)
+    micros = lambda value: None if value is None else round(value * 1e6, 1)
+    return OrderedDict([
+        ('count', len(values)),
+        ('lost', lost),
+        ('min', micros(values[0] if values else None)),
+        ('p50', micros(quickscope.latency.percentile(values, 50))),
+        ('p90', micros(quickscope.latency.percentile(values, 90))),
+        ('p99', micros(quickscope.latency.percentile(values, 99))),
+        ('max', micros(values[-1] if values else None)),
+        ('mean', micros(sum(values) / len(values) if values else None)),
+        ('histogram', histogram(values)),
+    ])
+
+def format_results(results):
+    """Returns a human-readable table (and histograms) of the results
+    returned by run().
+    """
+
+    lines = [ '{:16} {:>6} {:>5} {:>9} {:>9} {:>9} {:>9}'.format('strategy', 'n', 'lost', 'p50 (us)', 'p90 (us)', 'p99 (us)', 'max (us)') ]
+    for (name, summary) in results.items():
+        lines.append('{:16} {:>6} {:>5} {:>9} {:>9} {:>9} {:>9}'.format(name, summary['count'], summary['lost'], summary['p50'], summary['p90'], summary['p99'], summary['max']))
+
+    for (name, summary) in results.items():
+        lines.append('')
+        lines.append(name)
+        total = max(1, summary['count'])
+        for (label, count) in summary['histogram'].items():
+            lines.append('  {:>9} {:>6} {}'.format(label, count, '#' * int(round(40 * count / total))))
+    return '\n'.join(lines)
+
+def run(strategies, count = DEFAULT_COUNT, concurrency = DEFAULT_CONCURRENCY, min_delay = DEFAULT_MIN_DELAY, max_delay = DEFAULT_MAX_DELAY, load_threads = 0, load_processes = 0, seed = None):
+    """Measures each named strategy in turn under the same load and delays.
+
+    Returns an OrderedDict of strategy name -> summary (see summarize).
+    """
+
+    results = OrderedDict()
+    with Load(load_threads, load_processes):
+        for name in strategies:
+            (errors, lost) = measure(STRATEGIES[name], count, concurrency, min_delay, max_delay, seed)
+            results[name] = summarize(errors, lost)
+    return results
+
+def start(args):
+    # Options left unset take the defaults here, so that building the
+    # command line does not import this module
+    strategies = args.strategies or list(STRATEGIES)
+    unknown = [ name for name in strategies if name not in STRATEGIES ]
+    if unknown:
+        print('error: unknown strategy \'{}\' (choose from {})'.format(unknown[0], ', '.join(STRATEGIES)))
+        return
+    count = DEFAULT_COUNT if args.count is None else args.count
+    concurrency = DEFAULT_CONCURRENCY if args.concurrency is None else args.concurrency
+    min_delay = int(DEFAULT_MIN_DELAY * 1000) if args.min_delay is None else args.min_delay
+    max_delay = int(DEFAULT_MAX_DELAY * 1000) if args.max_delay is None else args.max_delay
+
+    results = run(strategies, count, concurrency, min_delay / 1000, max_delay / 1000, args.load_threads, args.load_processes, args.seed)
+    print(format_results(results))
+
+    if args.json:
+        document = OrderedDict([
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('cpus', multiprocessing.cpu_count()),
+            ('config', OrderedDict([
+                ('count', count),
+                ('concurrency', concurrency),
+                ('min_delay_ms', min_delay),
+                ('max_delay_ms', max_delay),
+                ('load_threads', args.load_threads),
+                ('load_processes', args.load_processes),
+                ('seed', args.seed),
+            ])),
+            ('results', results),
+        ])
+        if args.json == '-':
+            print(json.dumps(document, indent=2))
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(document, f, indent=2)
@@ -0,0 +1,131 @@
+import atexit
+import collections
+import json
+import os
+import socket
+import threading
+import time
+
+# Structured tracing: records (dictionaries) are written as JSON lines to a
+# file, so that fire accuracy can be analysed across every droplet after a
+# run.
+
+# Seconds between writes of buffered records
+FLUSH_INTERVAL = 0.5
+
+# Name of this machine, included in every record so traces from several
+# droplets can be merged
+HOSTNAME = socket.gethostname()
+
+class TraceWriter:
+    """A buffered, non-blocking JSONL writer.
+
+    emit() only appends the record to an in-memory queue, so it is safe to
+    call on the fire path; a background thread serializes and writes queued
+    records every FLUSH_INTERVAL seconds, and once more at exit. Tracing is
+    disabled (emit() does nothing) until configure() is given a path.
+
+    Times on the fire path are taken with time.perf_counter(); wall() turns
+    them into Unix timestamps.
+    """
+
+    def __init__(self, path = None, flush_interval = FLUSH_INTERVAL):
+        self.path = None
+        self.flush_interval = flush_interval
+        self._queue = collections.deque()
+        self._file = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._paused = False
+        self._lock = threading.Lock()
+        self._anchor = (time.time(), time.perf_counter())
+        atexit.register(self.close)
+        if path is not None:
+            self.configure(path)
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def configure(self, path):
+        """Starts writing records to `path` (appending), or stops tracing if
+        `path` is None.
+        """
+
+        self.close()
+        if path is None:
+            return
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self._file = open(path, 'a')
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='quickscope-trace')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def wall(self, perf):
+        """Converts a time.perf_counter() value to a Unix timestamp."""
+
+        if perf is None:
+            return None
+        return self._anchor[0] + (perf - self._anchor[1])
+
+    def emit(self, event, **fields):
+        """Queues a record of type `event` with the given fields. Does no I/O."""
+
+        if self.path is None:
+            return
+        fields['event'] = event
+        fields['host'] = HOSTNAME
+        fields['pid'] = os.getpid()
+        self._queue.append(fields)
+
+    def flush(self):
+        """Writes every queued record now."""
+
+        with self._lock:
+            if self._file is None:
+                return
+            lines = []
+            while self._queue:
+                lines.append(json.dumps(self._queue.popleft(), sort_keys=True))
+            if lines:
+                self._file.write('\n'.join(lines) + '\n')
+                self._file.flush()
+
+    def pause(self):
+        """Stops writing queued records (e.g. during the fire window) until
+        resume() is called. Records are still queued.
+        """
+
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+
+    def close(self):
+        """Writes any queued records and stops tracing."""
+
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+        self.flush()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.path = None
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            if not self._paused:
+                self.flush()
+
+# Records emitted by quickscope.slave and quickscope.mojang go here
+TRACER = TraceWriter()
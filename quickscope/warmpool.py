@@ -0,0 +1,135 @@
+import time
+
+# Warm pool of workers kept between consecutive snipes. Rather than
+# destroying every droplet once a target is done and creating a fresh fleet
+# from the snapshot for the next one, the master keeps the droplets whose
+# slaves finished (and are still connected) idle, and hands them the next
+# target over the control channel (see quickscope.control). Droplets missing
+# from the pool are created as usual; idle droplets are only destroyed once
+# they have been idle for longer than the idle TTL, or when the queue of
+# targets runs out.
+
+# Default seconds a droplet may stay idle before it is destroyed
+DEFAULT_IDLE_TTL = 45 * 60 # 45 mins
+
+# How long before the username becomes available to hand warm droplets
+# their target; they only need to log in and calibrate again
+ASSIGN_TIME = 10 * 60 # 10 mins
+
+# Seconds between checks for droplets that have been idle too long
+REAP_INTERVAL = 30
+
+class WarmPool:
+    """Tracks which droplets are idle between snipes, and hands them new
+    targets.
+
+    Keyword arguments:
+    provisioner -- quickscope.provision.Provisioner that created the droplets
+    control -- quickscope.control.ControlServer their slaves are connected to
+    idle_ttl -- (optional) Seconds a droplet may stay idle before it is
+                destroyed
+    """
+
+    def __init__(self, provisioner, control, idle_ttl = DEFAULT_IDLE_TTL):
+        self.provisioner = provisioner
+        self.control = control
+        self.idle_ttl = idle_ttl
+        self.idle = {} # Droplet name -> time it became idle
+        self.assigned = {} # Droplet name -> time it was handed its current target
+
+    def connected(self, name):
+        slave = self.control.slaves.get(name)
+        return slave is not None and slave.connected
+
+    def warm(self):
+        """Returns the set of names of idle droplets whose slave is still
+        connected, i.e. that can be handed another target.
+        """
+
+        return set(name for name in self.idle if self.connected(name))
+
+    def assign(self, schedules):
+        """Hands each idle droplet named in `schedules` (a dictionary of
+        droplet name -> schedule) its new schedule.
+
+        Returns the list of names handed one.
+        """
+
+        now = time.time()
+        assigned = []
+        for name in sorted(self.warm() & set(schedules)):
+            self.control.push_schedule(name, schedules[name])
+            del self.idle[name]
+            self.assigned[name] = now
+            assigned.append(name)
+        return assigned
+
+    def settle(self, names):
+        """Called once the droplets called `names` are done with a target:
+        those whose slave finished and is still connected become idle, and
+        the rest are destroyed.
+        """
+
+        now = time.time()
+        broken = []
+        for name in names:
+            slave = self.control.slaves.get(name)
+            if slave is not None and slave.connected and slave.done:
+                self.idle[name] = now
+            else:
+                broken.append(name)
+            self.assigned.pop(name, None)
+
+        if broken:
+            print('Destroying {} droplets that did not finish: {}'.format(len(broken), ', '.join(broken)))
+            self.retire(broken)
+
+    def reap(self, now = None):
+        """Destroys the idle droplets that have been idle for longer than the
+        idle TTL, or whose slave disconnected.
+        """
+
+        if now is None:
+            now = time.time()
+
+        expired = [ name for (name, since) in self.idle.items() if now - since >= self.idle_ttl or not self.connected(name) ]
+        if expired:
+            print('Destroying {} idle droplets: {}'.format(len(expired), ', '.join(sorted(expired))))
+            self.retire(expired)
+
+    def retire(self, names):
+        """Releases the slaves of, and destroys, the droplets called `names`."""
+
+        for name in names:
+            self.control.release(name)
+            self.idle.pop(name, None)
+            self.assigned.pop(name, None)
+        self.provisioner.destroy(names)
+
+    def wait(self, names, available, prep_time):
+        """Sleeps until the droplets called `names` must be got ready for a
+        target that becomes available at the Unix time `available`: ASSIGN_TIME
+        before it if every one of them is warm, or `prep_time` seconds before
+        it if some must be created. Idle droplets are reaped meanwhile, which
+        may bring the wake-up time forward.
+        """
+
+        while True:
+            self.reap()
+            lead = ASSIGN_TIME if set(names) <= self.warm() else prep_time
+            remaining = available - lead - time.time()
+            if remaining <= 0:
+                return
+            time.sleep(min(REAP_INTERVAL, remaining))
+
+    def close(self):
+        """Releases and destroys every idle droplet."""
+
+        if self.idle:
+            self.retire(list(self.idle))
+
+    def format_status(self):
+        """Returns a one-line summary of the pool."""
+
+        warm = self.warm()
+        return 'Warm pool: {} idle ({} connected), {} busy'.format(len(self.idle), len(warm), len(self.assigned))
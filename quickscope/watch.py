@@ -0,0 +1,208 @@
+import concurrent.futures
+import datetime
+import os
+import sqlite3
+import threading
+import time
+import quickscope.cache
+import quickscope.mojang
+import quickscope.ratelimit
+
+# Default location of the watchlist calendar
+DEFAULT_CALENDAR_PATH = os.path.join(os.path.expanduser('~'), '.quickscope', 'calendar.sqlite')
+
+# Default number of names resolved at once
+DEFAULT_WORKERS = 8
+
+# Default number of seconds after which a calendar entry is stale
+DEFAULT_REFRESH = 6 * 60 * 60
+
+# Number of resolved names between calendar commits
+COMMIT_INTERVAL = 100
+
+# Entry states
+STATE_FREE = 'free'     # Name was freed; `available` is when it can be claimed
+STATE_TAKEN = 'taken'   # Name is owned, or its free time cannot be worked out
+STATE_ERROR = 'error'   # Lookup failed (e.g. network error); always refreshed
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calendar (
+    name      TEXT PRIMARY KEY,
+    state     TEXT NOT NULL,
+    expiry    INTEGER,
+    available INTEGER,
+    checked   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS calendar_available ON calendar (available);
+"""
+
+def read_names(path):
+    """Reads a watchlist file: one name per line; blank lines and lines
+    starting with '#' are ignored. Duplicates (case-insensitively) are
+    dropped.
+
+    Returns a list of names.
+    """
+
+    names = []
+    seen = set()
+    with open(path) as f:
+        for line in f:
+            name = line.strip()
+            if not name or name.startswith('#') or name.lower() in seen:
+                continue
+            seen.add(name.lower())
+            names.append(name)
+    return names
+
+class Calendar:
+    """A persistent calendar of when watched names become available,
+    stored in sqlite.
+
+    Keyword arguments:
+    path -- Path of the sqlite database (created if missing), or ':memory:'
+    """
+
+    def __init__(self, path = DEFAULT_CALENDAR_PATH):
+        if path != ':memory:':
+            directory = os.path.dirname(path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+
+    def stale(self, names, refresh, now = None):
+        """Returns the names in `names` that need resolving: names that are
+        not in the calendar, entries older than `refresh` seconds, failed
+        lookups, and free names whose availability has already passed (they
+        may have been claimed since).
+        """
+
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            rows = dict((name, (state, available, checked)) for (name, state, available, checked) in self._db.execute('SELECT name, state, available, checked FROM calendar'))
+
+        stale = []
+        for name in names:
+            row = rows.get(name.lower())
+            if row is None:
+                stale.append(name)
+                continue
+
+            (state, available, checked) = row
+            if state == STATE_ERROR \
+            or now - checked > refresh \
+            or (state == STATE_FREE and available < now):
+                stale.append(name)
+
+        return stale
+
+    def update(self, name, state, expiry = None, available = None, commit = True):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO calendar VALUES (?, ?, ?, ?, ?)', (name.lower(), state, expiry, available, time.time()))
+            if commit:
+                self._db.commit()
+
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+
+    def upcoming(self, names = None, since = None):
+        """Returns (name, expiry, available) tuples for free names, sorted by
+        availability, that become available after `since` (default: now).
+        If `names` is given, only those names are included.
+        """
+
+        if since is None:
+            since = time.time()
+
+        with self._lock:
+            rows = self._db.execute('SELECT name, expiry, available FROM calendar WHERE state = ? AND available >= ? ORDER BY available', (STATE_FREE, since)).fetchall()
+
+        if names is not None:
+            wanted = set(name.lower() for name in names)
+            rows = [ row for row in rows if row[0] in wanted ]
+
+        return rows
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def resolve(name, cache):
+    """Works out when `name` becomes available.
+
+    Returns a tuple of (state, expiry, available); see the STATE_ constants.
+    """
+
+    try:
+        expiry = quickscope.mojang.get_free_time(name, cache=cache, priority=quickscope.ratelimit.PRIORITY_BACKGROUND)
+    except Exception as e:
+        print('Failed to resolve \'{}\': {}'.format(name, e))
+        return (STATE_ERROR, None, None)
+
+    if expiry is None:
+        return (STATE_TAKEN, None, None)
+
+    return (STATE_FREE, expiry, expiry + quickscope.mojang.USERNAME_HOLDING_TIME)
+
+def refresh(calendar, names, cache, workers = DEFAULT_WORKERS, max_age = DEFAULT_REFRESH):
+    """Resolves every stale name in `names` (see Calendar#stale) using at
+    most `workers` concurrent lookups, and stores the results in the
+    calendar.
+
+    Returns the number of names resolved.
+    """
+
+    stale = calendar.stale(names, max_age)
+    if not stale:
+        return 0
+
+    print('Resolving {} of {} names...'.format(len(stale), len(names)))
+
+    done = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = dict((executor.submit(resolve, name, cache), name) for name in stale)
+        for future in concurrent.futures.as_completed(futures):
+            (state, expiry, available) = future.result()
+            done += 1
+            calendar.update(futures[future], state, expiry, available, commit=done % COMMIT_INTERVAL == 0)
+
+    calendar.commit()
+    return done
+
+def format_upcoming(rows, now = None):
+    """Returns a human-readable table of (name, expiry, available) rows."""
+
+    if now is None:
+        now = time.time()
+
+    lines = []
+    for (name, expiry, available) in rows:
+        remaining = datetime.timedelta(seconds=int(available - now))
+        lines.append('{}  {:16}  expiry {}  in {}'.format(
+            time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime(available)), name, expiry, remaining))
+    return '\n'.join(lines)
+
+def start(args):
+    names = read_names(args.names)
+    cache = None if args.no_cache else quickscope.cache.NameCache(args.cache or quickscope.cache.DEFAULT_PATH)
+    calendar = Calendar(args.calendar or DEFAULT_CALENDAR_PATH)
+
+    refresh(calendar, names, cache, args.workers or DEFAULT_WORKERS, DEFAULT_REFRESH if args.refresh is None else args.refresh)
+
+    rows = calendar.upcoming(names)
+    if args.limit:
+        rows = rows[:args.limit]
+
+    if not rows:
+        print('No watched names are becoming available.')
+    else:
+        print(format_upcoming(rows))
+
+    calendar.close()
@@ -8,5 +8,6 @@ setup(name='Quickscope',
       packages=['quickscope'],
       scripts=['bin/quickscope'],
       include_package_data=True,
+      python_requires='>=3.6',
       install_requires=['python-digitalocean']
 )
@@ -0,0 +1,54 @@
+import sys
+
+import quickscope.app as app
+import quickscope.slave as slave
+
+def run(monkeypatch, *argv):
+    calls = []
+    monkeypatch.setattr(sys, 'argv', [ 'quickscope' ] + list(argv))
+    monkeypatch.setattr(app, 'start_watch', lambda args: calls.append(('watch', args)))
+    monkeypatch.setattr(app, 'start_bench', lambda args: calls.append(('bench', args)))
+    monkeypatch.setattr(app, 'start_timing_bench', lambda args: calls.append(('timing-bench', args)))
+    monkeypatch.setattr(app, 'start_zipapp', lambda args: calls.append(('zipapp', args)))
+    monkeypatch.setattr(app, 'start_fake_server', lambda args: calls.append(('fake-server', args)))
+    monkeypatch.setattr(slave, 'start', lambda args, username, password: calls.append(('slave', args)))
+    app.start()
+    return calls
+
+def test_watch_mode(monkeypatch):
+    [ (mode, args) ] = run(monkeypatch, '--pool-size', '3', 'watch', 'names.txt', '-n', '5')
+    assert mode == 'watch'
+    assert args.names == 'names.txt'
+    assert args.limit == 5
+    assert args.pool_size == 3
+
+def test_bench_mode(monkeypatch):
+    [ (mode, args) ] = run(monkeypatch, 'bench', '-s', '-30', '--engine', 'asyncio')
+    assert mode == 'bench'
+    assert args.skew == -30
+    assert args.engine == 'asyncio'
+
+def test_timing_bench_mode(monkeypatch):
+    [ (mode, args) ] = run(monkeypatch, 'timing-bench', '-s', 'sleep', '-s', 'hybrid')
+    assert mode == 'timing-bench'
+    assert args.strategies == [ 'sleep', 'hybrid' ]
+
+def test_zipapp_mode(monkeypatch):
+    [ (mode, args) ] = run(monkeypatch, 'zipapp', '--compile')
+    assert mode == 'zipapp'
+    assert args.target is None
+    assert args.compile
+
+def test_fake_server_mode(monkeypatch):
+    [ (mode, args) ] = run(monkeypatch, 'fake-server', '--port', '8080', '--lead', '60')
+    assert mode == 'fake-server'
+    assert args.port == 8080
+    assert args.lead == 60
+    assert args.target is None
+
+def test_target_named_like_a_mode(monkeypatch):
+    [ (mode, args) ] = run(monkeypatch, '-u', 'user', '-p', 'pass', 'slave', 'watch', 'abc', '100')
+    assert mode == 'slave'
+    assert args.target == 'watch'
+    assert args.uuid == 'abc'
+    assert args.expiry == 100
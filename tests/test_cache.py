@@ -0,0 +1,74 @@
+import quickscope.cache as cache
+
+class Clock:
+    def __init__(self, now = 1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def test_names_round_trip():
+    names = cache.NameCache(':memory:')
+    assert names.get_names('abc') is None
+
+    names.put_names('abc', [ { 'name': 'old' } ])
+    assert names.get_names('abc') == [ { 'name': 'old' } ]
+
+def test_uuid_at_ignores_case():
+    names = cache.NameCache(':memory:')
+    names.put_uuid_at('Notch', 100, 200, 'abc')
+    names.put_uuid_at('free', 100, 204, None)
+
+    assert names.get_uuid_at('notch', 100) == (200, 'abc')
+    assert names.get_uuid_at('FREE', 100) == (204, None)
+    assert names.get_uuid_at('notch', 101) is None
+
+def test_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'time', clock)
+    names = cache.NameCache(':memory:', history_ttl=60, uuid_at_ttl=10)
+    names.put_names('abc', [])
+    names.put_uuid_at('name', 0, 204, None)
+
+    clock.now += 30
+    assert names.get_names('abc') == []
+    assert names.get_uuid_at('name', 0) is None
+
+    clock.now += 31
+    assert names.get_names('abc') is None
+
+def test_purge(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'time', clock)
+    names = cache.NameCache(':memory:', history_ttl=60)
+    names.put_names('old', [])
+    clock.now += 50
+    names.put_names('new', [])
+    clock.now += 20
+    names.purge()
+
+    (count,) = names._db.execute('SELECT COUNT(*) FROM names').fetchone()
+    assert count == 1
+
+def test_lru_eviction(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'time', clock)
+    names = cache.NameCache(':memory:', max_entries=10)
+
+    for i in range(cache.EVICT_INTERVAL - 1):
+        clock.now += 1
+        names.put_names(str(i), [])
+
+    # Reading an entry makes it recently used
+    clock.now += 1
+    assert names.get_names('0') == []
+
+    # The next write checks the table size and evicts down to max_entries
+    clock.now += 1
+    names.put_names('last', [])
+
+    (count,) = names._db.execute('SELECT COUNT(*) FROM names').fetchone()
+    assert count == 10
+    assert names.get_names('0') == []
+    assert names.get_names('last') == []
+    assert names.get_names('1') is None
@@ -0,0 +1,23 @@
+import quickscope.clock as clock
+
+def test_estimate_intersects_bounds():
+    observations = [ clock.Observation(100.9, 101.0, 101), clock.Observation(101.9, 102.0, 101) ]
+    offset = clock.estimate(observations)
+
+    # First: [0, 1.1]; second: [-1, 0.1]
+    assert offset.consistent
+    assert abs(offset.low - 0) < 1e-9
+    assert abs(offset.high - 0.1) < 1e-9
+    assert abs(offset.offset - 0.05) < 1e-9
+    assert clock.estimate([]) is None
+
+def test_estimate_inconsistent():
+    observations = [ clock.Observation(100.0, 100.1, 105), clock.Observation(100.0, 100.1, 90) ]
+    assert not clock.estimate(observations).consistent
+
+def test_trusted():
+    assert clock.trusted(clock.ClockOffset(0.01, 0, 0.02, 12, True))
+    assert not clock.trusted(clock.ClockOffset(0.01, 0, 0.02, 12, False))
+    assert not clock.trusted(clock.ClockOffset(0.01, 0, 0.02, clock.MIN_SAMPLES - 1, True))
+    assert not clock.trusted(clock.ClockOffset(0.0519, -0.0829, 0.1866, 3, True))
+    assert not clock.trusted(clock.ClockOffset(0.1, 0, 0.2, 12, True))
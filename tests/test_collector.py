@@ -0,0 +1,70 @@
+import pytest
+
+import quickscope.collector as collector
+
+def feed_all(parser, *parts):
+    done = False
+    for part in parts:
+        done = parser.feed(part)
+    return done
+
+def test_status_line_split_across_reads():
+    parser = collector.ResponseParser()
+    assert not parser.feed(b'HT')
+    assert parser.status is None
+
+    assert not parser.feed(b'TP/1.1 2')
+    assert parser.status is None
+
+    assert not parser.feed(b'04 No Content\r')
+    assert parser.status is None
+
+    assert parser.feed(b'\nServer: test\r\n\r\n')
+    assert parser.status == 204
+    assert parser.reason == 'No Content'
+    assert parser.headers == [ ('Server', 'test') ]
+    assert parser.body == b''
+
+def test_content_length_body():
+    parser = collector.ResponseParser()
+    assert not feed_all(parser, b'HTTP/1.1 400 Bad Request\r\nContent-Length: 11\r\n', b'Content-Type: text/plain\r\n\r\nhello')
+    assert parser.headers == [ ('Content-Length', '11'), ('Content-Type', 'text/plain') ]
+
+    assert parser.feed(b' world')
+    assert parser.body == b'hello world'
+
+def test_chunked_body():
+    parser = collector.ResponseParser()
+    assert not feed_all(parser, b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n', b'5\r\nhel', b'lo\r\n6;ext=1\r\n world\r\n')
+    assert parser.feed(b'0\r\n\r\n')
+    assert parser.body == b'hello world'
+
+def test_interim_response_is_skipped():
+    parser = collector.ResponseParser()
+    assert parser.feed(b'HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 204 No Content\r\n\r\n')
+    assert parser.status == 204
+
+def test_head_response_has_no_body():
+    parser = collector.ResponseParser('HEAD')
+    assert parser.feed(b'HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\n')
+    assert parser.body == b''
+
+def test_finish_completes_close_delimited_body():
+    parser = collector.ResponseParser()
+    assert not feed_all(parser, b'HTTP/1.0 200 OK\r\n\r\n', b'until ', b'closed')
+    assert parser.finish()
+    assert parser.body == b'until closed'
+
+def test_finish_before_body_is_incomplete():
+    parser = collector.ResponseParser()
+    assert not parser.feed(b'HTTP/1.1 200 OK\r\nContent-Len')
+    assert not parser.finish()
+
+    parser = collector.ResponseParser()
+    assert not parser.feed(b'HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nshort')
+    assert not parser.finish()
+
+def test_malformed_status_line():
+    parser = collector.ResponseParser()
+    with pytest.raises(ValueError):
+        parser.feed(b'SSH-2.0-OpenSSH\r\n')
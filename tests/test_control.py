@@ -0,0 +1,168 @@
+import argparse
+import socket
+import threading
+import time
+import quickscope.control as control
+import quickscope.slave as slave
+
+TOKEN = 'secret'
+
+def server(schedules = None):
+    master = control.ControlServer(TOKEN, host='127.0.0.1', port=0, schedules=schedules)
+    master.start()
+    return master
+
+def client(master, name = 'qs-sl-0', on_cancel = None):
+    c = control.ControlClient(master.address, name, TOKEN, on_cancel=on_cancel)
+    c.connect()
+    return c
+
+def wait_for(condition, timeout = 5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+def test_schedule_arrives():
+    master = server({ 'qs-sl-0': { 'expiry': 1234, 'variance': -5 } })
+    try:
+        c = client(master)
+        assert c.wait_schedule(5) == { 'expiry': 1234, 'variance': -5 }
+        c.close()
+    finally:
+        master.stop()
+
+def test_schedule_pushed_after_register():
+    master = server()
+    try:
+        c = client(master)
+        wait_for(lambda: 'qs-sl-0' in master.slaves)
+        master.push_schedule('qs-sl-0', { 'target': 'name' })
+        assert c.wait_schedule(5) == { 'target': 'name' }
+        c.close()
+    finally:
+        master.stop()
+
+def test_wrong_token_is_ignored():
+    master = server({ 'qs-sl-0': { 'expiry': 1 } })
+    try:
+        c = control.ControlClient(master.address, 'qs-sl-0', 'wrong')
+        c.connect()
+        assert c.wait_schedule(0.5) is None
+        assert master.slaves == {}
+        c.close()
+    finally:
+        master.stop()
+
+def test_authenticate():
+    master = control.ControlServer(TOKEN, port=0)
+    master.start()
+    try:
+        assert master.address[0] == '127.0.0.1'
+        assert master.authenticate(TOKEN)
+        assert not master.authenticate('secreT')
+        assert not master.authenticate(None)
+        assert not master.authenticate([ TOKEN ])
+    finally:
+        master.stop()
+
+def test_duplicate_name_is_rejected():
+    master = server({ 'qs-sl-0': { 'expiry': 1 } })
+    try:
+        first = client(master)
+        assert first.wait_schedule(5) == { 'expiry': 1 }
+        registered = master.slaves['qs-sl-0']
+
+        second = client(master)
+        assert second.wait_schedule(0.5) is None
+        assert master.slaves['qs-sl-0'] is registered
+        second.close()
+
+        # Once the first has gone, the name can be registered again
+        first.close()
+        wait_for(lambda: not registered.connected)
+        third = client(master)
+        assert third.wait_schedule(5) == { 'expiry': 1 }
+        assert master.slaves['qs-sl-0'] is not registered
+        third.close()
+    finally:
+        master.stop()
+
+def test_cancel_on_success():
+    master = server({ 'qs-sl-0': {}, 'qs-sl-1': {} })
+    try:
+        cancelled = threading.Event()
+        first = client(master, 'qs-sl-0')
+        second = client(master, 'qs-sl-1', on_cancel=cancelled.set)
+        first.wait_schedule(5)
+        second.wait_schedule(5)
+
+        first.report(index=0, status=control.STATUS_SUCCESS)
+        assert cancelled.wait(5)
+        assert second.cancelled.is_set()
+        assert master.wait_finished([ 'qs-sl-0', 'qs-sl-1' ], 5)
+        first.close()
+        second.close()
+    finally:
+        master.stop()
+
+def test_cancel_before_register():
+    master = server()
+    try:
+        master.cancel()
+        c = client(master)
+        assert c.cancelled.wait(5)
+        c.close()
+    finally:
+        master.stop()
+
+def test_done():
+    master = server({ 'qs-sl-0': {} })
+    try:
+        c = client(master)
+        c.wait_schedule(5)
+        assert not master.finished([ 'qs-sl-0' ])
+        c.done()
+        assert master.wait_finished([ 'qs-sl-0' ], 5)
+        c.close()
+    finally:
+        master.stop()
+
+def test_master_disconnect():
+    # A master that accepts the registration and then goes away
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    c = control.ControlClient(listener.getsockname(), 'qs-sl-0', TOKEN)
+    c.connect()
+    (conn, _) = listener.accept()
+    assert control.read_message(conn.makefile('rb'))['type'] == 'register'
+    conn.close()
+    listener.close()
+
+    started = time.time()
+    assert c.wait_schedule(5) is None
+    assert c.idle() is None
+    assert time.time() - started < 5
+    c.report(index=0, status=None) # Must not raise
+    c.close()
+
+def test_slave_disconnect():
+    master = server({ 'qs-sl-0': {} })
+    try:
+        c = client(master)
+        c.wait_schedule(5)
+        c.close()
+        wait_for(lambda: not master.slaves['qs-sl-0'].connected)
+    finally:
+        master.stop()
+
+def test_apply_schedule_ignores_unknown_fields():
+    args = argparse.Namespace(target='old', expiry=0, token='secret', master='host:1')
+    slave.apply_schedule(args, { 'target': 'new', 'expiry': 1234, 'warm': True, 'token': 'other', 'master': 'evil:1' })
+
+    assert args.target == 'new'
+    assert args.warm
+    assert args.expiry == 1234
+    assert args.token == 'secret'
+    assert args.master == 'host:1'
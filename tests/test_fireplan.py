@@ -0,0 +1,88 @@
+import argparse
+import random
+import quickscope.bench as bench
+import quickscope.fakeserver as fakeserver
+import quickscope.fireplan as fireplan
+import quickscope.slave as slave
+
+def test_residuals():
+    assert fireplan.residuals([ 10, 12 ], 11) == [ -1, 1 ]
+    assert fireplan.residuals([ 10 ], 10, -2, 2, 3) == [ -2, 0, 2 ]
+
+def test_coverage():
+    errors = [ -3, 0, 2, 8 ]
+    assert fireplan.coverage(errors, [ 0 ], 5) == 0.5
+    assert fireplan.coverage(errors, [ 3, -8 ], 5) == 1
+    assert fireplan.coverage([], [ 0 ], 5) == 0
+
+def test_worker_offsets_cover_distribution():
+    errors = [ -20, -19, -18, 0, 1, 30 ]
+    offsets = fireplan.worker_offsets(errors, 3, 5)
+
+    assert len(offsets) == 3
+    assert offsets == sorted(offsets)
+    assert fireplan.coverage(errors, offsets, 5) == 1
+
+def test_worker_offsets_greedy_order():
+    # With one request, aim at the densest part of the distribution
+    assert fireplan.worker_offsets([ -20, -19, -18, 0, 30 ], 1, 5) == [ 20 ]
+
+def test_worker_offsets_stops_when_covered():
+    assert fireplan.worker_offsets([ 1, 2, 3 ], 5, 5) == [ -1 ]
+
+def test_worker_offsets_empty_samples():
+    assert fireplan.worker_offsets([], 5) == []
+
+def test_plan_uses_budget():
+    rng = random.Random(1)
+    workers = dict(('w{}'.format(i), [ rng.gauss(0, 20) for _ in range(200) ]) for i in range(3))
+    schedule = fireplan.plan(workers, 9, 5)
+
+    assert set(schedule) == set(workers)
+    assert sum(len(offsets) for offsets in schedule.values()) == 9
+
+def test_plan_beats_static_plan():
+    rng = random.Random(2)
+    workers = dict(('w{}'.format(i), [ rng.gauss(10 * i, 15) for _ in range(200) ]) for i in range(3))
+    schedule = fireplan.plan(workers, 9, 5)
+    static = fireplan.static_plan(sorted(workers), [ 0 ], 20, 3)
+
+    assert fireplan.hit_probability(schedule, workers, 5) >= fireplan.hit_probability(static, workers, 5)
+
+def test_plan_prefers_tighter_worker():
+    workers = { 'tight': [ 0, 1, 2 ], 'loose': [ -100, 0, 100 ] }
+    schedule = fireplan.plan(workers, 1, 5)
+
+    assert len(schedule['tight']) == 1
+    assert schedule['loose'] == []
+    assert fireplan.hit_probability(schedule, workers, 5) == 1
+
+def test_plan_max_per_worker():
+    workers = { 'a': [ i * 10 for i in range(10) ], 'b': [ i * 10 for i in range(10) ] }
+    schedule = fireplan.plan(workers, 10, 5, max_per_worker=2)
+
+    assert len(schedule['a']) == 2
+    assert len(schedule['b']) == 2
+
+def test_plan_empty_samples():
+    schedule = fireplan.plan({ 'a': [], 'b': [ 0, 1 ] }, 4, 5)
+
+    assert schedule['a'] == []
+    assert len(schedule['b']) == 1
+    assert fireplan.plan({}, 4) == {}
+
+def test_fire_offsets_without_samples():
+    args = argparse.Namespace(offsets=None, plan_window=5, variance=-10, interval=20, requests=3)
+    assert slave.fire_offsets(args, []) == [ -0.01, 0.01, 0.03 ]
+
+def test_bench_report():
+    arrival = fakeserver.Arrival(0, 0, 'uuid', 'name', 200)
+    rows = [ (0, 100, arrival, 0.003), (1, 100.02, arrival, -0.001) ]
+    report = bench.format_report(rows, 5)
+
+    assert 'worst |error| 3.00ms' in report
+    assert report.endswith('1 of 2 landed within 5ms')
+
+def test_bench_report_without_arrivals():
+    assert bench.format_report([], 5).endswith('0 of 0 landed within 5ms')
+    assert 'mean' not in bench.format_report([])
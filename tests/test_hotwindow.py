@@ -0,0 +1,58 @@
+import sys
+import time
+
+import quickscope.hotwindow as hotwindow
+import quickscope.timing as timing
+
+def armed(first, last):
+    scheduler = timing.Scheduler()
+    scheduler.start()
+    hot = hotwindow.HotWindow(scheduler, lead=0.05, tail=0.05)
+    now = time.perf_counter()
+    hot.arm(now + first, now + last)
+    return (scheduler, hot)
+
+def test_report_printed_when_window_closes(capsys):
+    (scheduler, hot) = armed(0.5, 1)
+    try:
+        # Output inside the window is held back until it closes
+        time.sleep(0.4)
+        assert isinstance(sys.stdout, hotwindow.DeferredOutput)
+        print('fired')
+        assert hot.closed.wait(5)
+    finally:
+        scheduler.stop()
+
+    out = capsys.readouterr().out
+    assert 'fired' in out
+    assert 'Dispatch lateness before hot window: p50' in out
+    assert 'Dispatch lateness in hot window:     p50' in out
+    assert not isinstance(sys.stdout, hotwindow.DeferredOutput)
+
+def test_finish_before_window_opens(capsys):
+    (scheduler, hot) = armed(60, 61)
+    try:
+        assert hot.finish(5)
+        time.sleep(0.1)
+    finally:
+        scheduler.stop()
+
+    out = capsys.readouterr().out
+    assert 'Dispatch lateness before hot window: p50' in out
+    assert 'Dispatch lateness in hot window:     no samples' in out
+    assert scheduler.pending() == 0
+
+def test_finish_inside_window(capsys):
+    (scheduler, hot) = armed(0.5, 60)
+    try:
+        time.sleep(0.4)
+        assert isinstance(sys.stdout, hotwindow.DeferredOutput)
+        print('fired')
+        assert hot.finish(5)
+    finally:
+        scheduler.stop()
+
+    out = capsys.readouterr().out
+    assert 'fired' in out
+    assert 'Dispatch lateness in hot window:' in out
+    assert not isinstance(sys.stdout, hotwindow.DeferredOutput)
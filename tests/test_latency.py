@@ -0,0 +1,49 @@
+import quickscope.latency as latency
+
+def test_percentile():
+    assert latency.percentile([], 50) is None
+    assert latency.percentile([ 5 ], 90) == 5
+    assert latency.percentile([ 1, 2, 3, 4 ], 50) == 2.5
+    assert latency.percentile([ 0, 10 ], 90) == 9
+
+def test_reject_outliers_too_few_samples():
+    assert latency.reject_outliers([ 100, 1 ]) == ([ 1, 100 ], 0)
+    assert latency.reject_outliers([]) == ([], 0)
+
+def test_reject_outliers_small_counts():
+    assert latency.reject_outliers([ 12, 10, 100, 11 ]) == ([ 10, 11, 12 ], 1)
+    assert latency.reject_outliers([ 10, 11, 12, 100, 200 ]) == ([ 10, 11, 12 ], 2)
+
+def test_reject_outliers_keeps_spread_samples():
+    values = [ 10, 12, 14, 16, 18 ]
+    assert latency.reject_outliers(values) == (values, 0)
+
+def test_reject_outliers_zero_deviation():
+    # More than half the samples are equal, so the MAD is 0 and nothing
+    # can be measured against it
+    assert latency.reject_outliers([ 1, 1, 100 ]) == ([ 1, 1, 100 ], 0)
+
+def test_summarize():
+    summary = latency.summarize([ 0.010, 0.011, 0.012, 0.100 ])
+
+    assert summary.count == 3
+    assert summary.rejected == 1
+    assert summary.min == 0.010
+    assert summary.max == 0.012
+    assert abs(summary.mean - 0.011) < 1e-9
+    assert latency.summarize([]) is None
+
+def test_profile_estimates():
+    profile = latency.Profile()
+    assert profile.estimate('one-way-p50') == 0
+
+    profile.add_connect(0.005, 0.010)
+    for ttfb in (0.020, 0.022, 0.024):
+        profile.add(latency.Sample(None, None, 0.001, ttfb, ttfb + 0.001))
+
+    assert profile.summary('connect').count == 1
+    assert profile.summary('send').count == 3
+    assert abs(profile.estimate('send-mean') - 0.001) < 1e-9
+    assert abs(profile.estimate('one-way-p50') - 0.011) < 1e-9
+    assert abs(profile.estimate('rtt-p50') - 0.022) < 1e-9
+    assert 'ttfb' in profile.format()
@@ -0,0 +1,92 @@
+import urllib.request
+
+import quickscope.metrics as metrics
+
+def test_format_value():
+    assert metrics.format_value(float('inf')) == '+Inf'
+    assert metrics.format_value(-float('inf')) == '-Inf'
+    assert metrics.format_value(3.0) == '3'
+    assert metrics.format_value(0.25) == '0.25'
+
+def test_updates_ignored_until_enabled():
+    registry = metrics.Registry()
+    counter = registry.counter('test_total', 'Test counter')
+    counter.inc()
+
+    registry.enabled = True
+    counter.inc(2)
+    registry.collect()
+    assert counter.values == { (): 2 }
+
+def test_histogram_buckets():
+    registry = metrics.Registry()
+    registry.enabled = True
+    histogram = registry.histogram('test_seconds', 'Test histogram', [ 'endpoint' ], buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value, endpoint='/a')
+    registry.collect()
+
+    # Bucket counts are cumulative, and a value on a bound counts in that bucket
+    samples = histogram.samples()
+    assert samples[:3] == [
+        ('_bucket', ('/a',), (('le', '0.1'),), 2),
+        ('_bucket', ('/a',), (('le', '1'),), 3),
+        ('_bucket', ('/a',), (('le', '+Inf'),), 4),
+    ]
+    assert abs(samples[3][3] - 5.65) < 1e-9
+    assert samples[4] == ('_count', ('/a',), (), 4)
+
+def test_pause_holds_updates_back():
+    registry = metrics.Registry()
+    registry.enabled = True
+    gauge = registry.gauge('test', 'Test gauge')
+    gauge.set(5)
+    registry.pause()
+    gauge.dec()
+    registry.collect()
+    assert gauge.values == {}
+
+    registry.resume()
+    registry.collect()
+    assert gauge.values == { (): 4 }
+
+def test_prometheus_text_format():
+    registry = metrics.Registry()
+    registry.enabled = True
+    counter = registry.counter('test_total', 'Requests, by "status"\nand more', [ 'status' ])
+    histogram = registry.histogram('test_seconds', 'Durations', buckets=(1,))
+    counter.inc(status='204')
+    counter.inc(status='a"b\\c')
+    histogram.observe(0.5)
+
+    assert registry.format() == '\n'.join([
+        '# HELP test_total Requests, by "status"\\nand more',
+        '# TYPE test_total counter',
+        'test_total{status="204"} 1',
+        'test_total{status="a\\"b\\\\c"} 1',
+        '# HELP test_seconds Durations',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{le="1"} 1',
+        'test_seconds_bucket{le="+Inf"} 1',
+        'test_seconds_sum 0.5',
+        'test_seconds_count 1',
+    ]) + '\n'
+
+def test_serve():
+    registry = metrics.Registry()
+    counter = registry.counter('test_total', 'Test counter')
+    counter.inc()
+    server = metrics.serve(('127.0.0.1', 0), registry)
+    counter.inc(2)
+    try:
+        (host, port) = server.server_address[:2]
+        with urllib.request.urlopen('http://{}:{}/metrics'.format(host, port), timeout=5) as response:
+            assert response.headers['Content-Type'] == metrics.CONTENT_TYPE
+            body = response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # Only the update made once serving enabled the registry counts
+    assert '# TYPE test_total counter' in body
+    assert 'test_total 2\n' in body
@@ -0,0 +1,66 @@
+import json
+
+import quickscope.placement as placement
+
+LATENCIES = [
+    placement.RegionLatency('ams2', 10, 1),
+    placement.RegionLatency('nyc1', 80, 4),
+    placement.RegionLatency('sfo1', 150, 2),
+]
+
+def test_expected_error_ranks_by_jitter():
+    errors = sorted(LATENCIES, key=placement.expected_error)
+    assert [ latency.region for latency in errors ] == [ 'ams2', 'sfo1', 'nyc1' ]
+    assert placement.expected_error(placement.RegionLatency('x', 0, 0)) == 0
+
+def test_allocate_prefers_low_jitter():
+    assert placement.allocate(LATENCIES, 1) == { 'ams2': 1 }
+
+def test_allocate_spreads():
+    # Each droplet in ams2 makes it 25% worse; sfo1 is twice as bad to
+    # begin with, so only takes a droplet once ams2 has five
+    assert placement.allocate(LATENCIES, 5) == { 'ams2': 5 }
+    assert placement.allocate(LATENCIES, 6) == { 'ams2': 5, 'sfo1': 1 }
+
+def test_allocate_max_per_region():
+    assert placement.allocate(LATENCIES, 4, max_per_region=2) == { 'ams2': 2, 'sfo1': 2 }
+    try:
+        placement.allocate(LATENCIES, 7, max_per_region=2)
+    except ValueError:
+        pass
+    else:
+        assert False, 'expected ValueError'
+
+def test_allocate_ties_broken_by_mean():
+    latencies = [ placement.RegionLatency('far', 100, 1), placement.RegionLatency('near', 20, 1) ]
+    assert placement.allocate(latencies, 1) == { 'near': 1 }
+
+def test_window_targets():
+    assert placement.window_targets(1, -10, 10) == [ 0 ]
+    assert placement.window_targets(3, 0, 0) == [ 0, 0, 0 ]
+    assert placement.window_targets(5, -20, 20) == [ 0, -10, 10, -20, 20 ]
+
+def test_plan_gives_best_regions_the_middle():
+    plan = placement.plan(LATENCIES, 6, window=(-50, 50), max_per_region=3)
+
+    assert [ p.name for p in plan ] == [ 'qs-sl-{}'.format(i) for i in range(6) ]
+    assert [ p.region for p in plan ] == [ 'ams2' ] * 3 + [ 'sfo1' ] * 3
+    assert [ p.variance for p in plan ] == [ -10, 10, -30, 30, -50, 50 ]
+
+def test_plan_without_latencies():
+    plan = placement.plan([], 3, variances=[ 5, -5 ])
+    assert [ (p.region, p.variance) for p in plan ] == [ (placement.DEFAULT_REGION, 5), (placement.DEFAULT_REGION, -5), (placement.DEFAULT_REGION, 5) ]
+
+def test_load_and_save(tmp_path):
+    path = str(tmp_path / 'latency.json')
+    with open(path, 'w') as f:
+        json.dump({ 'nyc1': { 'mean': 80, 'stddev': 4 }, 'ams2': { 'mean': 10, 'stddev': 1 } }, f)
+    latencies = placement.load_latency_table(path)
+    assert latencies == [ placement.RegionLatency('ams2', 10.0, 1.0), placement.RegionLatency('nyc1', 80.0, 4.0) ]
+
+    plan_path = str(tmp_path / 'plans' / 'plan.json')
+    placement.save_plan(plan_path, placement.plan(latencies, 2), 'target', latencies)
+    with open(plan_path) as f:
+        saved = json.load(f)
+    assert saved['target'] == 'target'
+    assert [ p['region'] for p in saved['placements'] ] == [ 'ams2', 'ams2' ]
@@ -0,0 +1,77 @@
+import time
+import quickscope.provision as provision
+
+def specs(count):
+    return [ provision.DropletSpec('qs-sl-{}'.format(i), 'ams2', 'image', '512mb', []) for i in range(count) ]
+
+def provisioner(provider, attempts = 3):
+    return provision.Provisioner(provider, attempts=attempts, backoff=0.01, poll_interval=0.01)
+
+def test_create_all():
+    provider = provision.FakeProvider(boot_time=0, create_time=0)
+    p = provisioner(provider)
+    workers = p.create_all(specs(4))
+
+    assert all(worker.state == provision.STATE_CREATED for worker in workers)
+    assert len(provider.droplets) == 4
+    assert p.wait_ready(time.time() + 5)
+    assert p.report()[provision.STATE_ACTIVE] == 4
+
+def test_failed_creates():
+    provider = provision.FakeProvider(boot_time=0, create_time=0, failure_rate=1)
+    p = provisioner(provider, attempts=3)
+    workers = p.create_all(specs(2))
+
+    assert all(worker.state == provision.STATE_FAILED for worker in workers)
+    assert all(worker.attempts == 3 for worker in workers)
+    assert provider.droplets == {}
+    assert p.report()[provision.STATE_FAILED] == 2
+
+def test_not_ready_when_every_create_failed():
+    p = provisioner(provision.FakeProvider(boot_time=0, create_time=0, failure_rate=1), attempts=1)
+    p.create_all(specs(2))
+
+    assert not p.ready()
+    assert not p.wait_ready(time.time() + 0.05)
+
+def test_not_ready_without_workers():
+    p = provisioner(provision.FakeProvider())
+    assert not p.ready()
+
+def test_ready_ignores_failed_workers():
+    p = provisioner(provision.FakeProvider(boot_time=0, create_time=0))
+    workers = p.create_all(specs(2))
+    workers[1].state = provision.STATE_FAILED
+
+    assert p.wait_ready(time.time() + 5)
+
+def test_ready_reported():
+    p = provisioner(provision.FakeProvider(boot_time=0, create_time=0))
+    p.create_all(specs(2))
+    p.wait_ready(time.time() + 5)
+    assert not p.ready(reported=True)
+
+    p.checkin('qs-sl-0')
+    assert not p.ready(reported=True)
+    p.checkin('qs-sl-1')
+    assert p.ready(reported=True)
+
+def test_lost_create_is_not_duplicated():
+    # Every create makes its droplet and then fails, as on a timeout
+    provider = provision.FakeProvider(boot_time=0, create_time=0, lost_rate=1)
+    p = provisioner(provider, attempts=3)
+    workers = p.create_all(specs(3))
+
+    assert all(worker.state == provision.STATE_CREATED for worker in workers)
+    assert all(worker.attempts == 1 for worker in workers)
+    assert len(provider.droplets) == 3
+    assert sorted(worker.id for worker in workers) == sorted(provider.droplets)
+
+def test_destroy_all():
+    provider = provision.FakeProvider(boot_time=0, create_time=0)
+    p = provisioner(provider)
+    p.create_all(specs(3))
+    p.destroy_all()
+
+    assert provider.droplets == {}
+    assert len(provider.destroyed) == 3
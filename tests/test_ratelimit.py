@@ -0,0 +1,86 @@
+import quickscope.ratelimit as ratelimit
+from quickscope.mojang import Url
+
+API = Url(True, 'api.mojang.com', 443, '/')
+OTHER = Url(False, 'localhost', 8080, '/')
+
+class Clock:
+    def __init__(self, now = 1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def test_bucket_refill(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, 'time', clock)
+    bucket = ratelimit.TokenBucket(10, 10)
+
+    for i in range(10):
+        assert bucket.take() == 0
+    assert bucket.take() == 1
+
+    clock.now += 2.5
+    assert abs(bucket.available() - 2.5) < 1e-9
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert abs(bucket.take() - 0.5) < 1e-9
+
+    # Never refills above capacity
+    clock.now += 100
+    assert bucket.available() == 10
+
+def test_bucket_shared_through_file(monkeypatch, tmp_path):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, 'time', clock)
+    path = str(tmp_path / 'state' / 'api.json')
+    first = ratelimit.TokenBucket(10, 10, path)
+    second = ratelimit.TokenBucket(10, 10, path)
+
+    for i in range(6):
+        assert first.take() == 0
+    assert second.available() == 4
+
+    second.drain()
+    assert first.take() == 1
+
+def test_priority_reserve(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, 'time', clock)
+    monkeypatch.setitem(ratelimit.FAMILIES, 'api', (20, 20))
+    limiter = ratelimit.RateLimiter()
+
+    # Background callers leave a quarter of the budget
+    taken = 0
+    while limiter.try_acquire(API, ratelimit.PRIORITY_BACKGROUND) == 0:
+        taken += 1
+    assert taken == 15
+
+    # Normal callers leave a tenth
+    taken = 0
+    while limiter.try_acquire(API, ratelimit.PRIORITY_NORMAL) == 0:
+        taken += 1
+    assert taken == 3
+
+    # Critical callers may use the rest
+    taken = 0
+    while limiter.try_acquire(API, ratelimit.PRIORITY_CRITICAL) == 0:
+        taken += 1
+    assert taken == 2
+
+def test_waiting_priority_blocks_lower(monkeypatch):
+    limiter = ratelimit.RateLimiter()
+    limiter._waiting[('api', ratelimit.PRIORITY_CRITICAL)] = 1
+
+    assert limiter.try_acquire(API, ratelimit.PRIORITY_NORMAL) == ratelimit.POLL_INTERVAL
+    assert limiter.try_acquire(API, ratelimit.PRIORITY_CRITICAL) == 0
+
+def test_unlimited():
+    limiter = ratelimit.RateLimiter()
+    limiter.limited(API)
+    assert limiter.try_acquire(OTHER) == 0
+    assert limiter.try_acquire(API) > 0
+
+    limiter.configure(enabled=False)
+    assert limiter.try_acquire(API) == 0
+    limiter.acquire(API)
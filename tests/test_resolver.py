@@ -0,0 +1,38 @@
+import socket
+
+import quickscope.resolver as resolver
+
+def listen():
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    return server
+
+def test_resolve():
+    assert resolver.resolve('127.0.0.1', 80) == [ '127.0.0.1' ]
+
+def test_address_disabled():
+    pins = resolver.Resolver(enabled=False)
+    pins._pinned[('example.invalid', 80)] = '127.0.0.1'
+    assert pins.address('example.invalid', 80) == 'example.invalid'
+
+def test_connection_uses_pinned_address():
+    server = listen()
+    port = server.getsockname()[1]
+    pins = resolver.Resolver()
+    pins._pinned[('example.invalid', port)] = '127.0.0.1'
+
+    conn = pins.connection(False, 'example.invalid', port)
+    try:
+        conn.connect()
+        assert conn.sock.getpeername() == ('127.0.0.1', port)
+        assert conn.host == 'example.invalid'
+    finally:
+        conn.close()
+        server.close()
+
+def test_https_connection():
+    pins = resolver.Resolver()
+    conn = pins.connection(True, 'example.invalid', 443)
+    assert isinstance(conn, resolver.PinnedHTTPSConnection)
+    assert conn.resolver is pins
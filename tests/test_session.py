@@ -0,0 +1,93 @@
+import asyncio
+
+import quickscope.accounts as accounts
+import quickscope.mojang_async as mojang_async
+import quickscope.session as session
+import quickscope.session_async as session_async
+
+LOGIN = (302, [ ('Location', '/me'), ('Set-Cookie', 'PLAY_SESSION=abc; Max-Age=3600') ], b'')
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+def test_logged_in():
+    s = session.Session('user', 'pass')
+    assert s.current() is None
+
+    assert s.logged_in(False) is None
+    assert s.error == 'Failed to get authenticity token'
+
+    cookies = s.logged_in(LOGIN)
+    assert cookies['PLAY_SESSION'].value == 'abc'
+    assert s.current() is cookies
+
+def test_store_round_trip(tmp_path):
+    store = session.SessionStore(str(tmp_path / 'sessions.json'))
+    session.Session('user', 'pass', store).logged_in(LOGIN)
+
+    restored = session.Session('user', 'pass', store)
+    assert restored.current()['PLAY_SESSION'].value == 'abc'
+
+    restored.invalidate()
+    assert session.Session('user', 'pass', store).current() is None
+
+def test_async_login_and_tokens(monkeypatch):
+    calls = []
+
+    async def login(username, password):
+        calls.append('login')
+        return LOGIN
+
+    async def get_rename_token(uuid, login_cookies):
+        calls.append('token')
+        return ('at-{}'.format(len(calls)), login_cookies)
+
+    monkeypatch.setattr(mojang_async, 'login', login)
+    monkeypatch.setattr(mojang_async, 'get_rename_token', get_rename_token)
+
+    tokens = session.TokenPool(session.Session('user', 'pass'), 'uuid')
+    assert run(session_async.prefetch(tokens, 2)) == 2
+    assert calls == [ 'login', 'token', 'token' ]
+
+    assert run(session_async.take(tokens)).token == 'at-2'
+    assert run(session_async.take(tokens)).token == 'at-3'
+
+    # An empty pool fetches another token, reusing the login
+    assert run(session_async.take(tokens)).token == 'at-4'
+    assert calls.count('login') == 1
+
+def test_async_prefetch_logs_in_again_once(monkeypatch):
+    calls = []
+
+    async def login(username, password):
+        calls.append('login')
+        return LOGIN
+
+    async def get_rename_token(uuid, login_cookies):
+        calls.append('token')
+        return None
+
+    monkeypatch.setattr(mojang_async, 'login', login)
+    monkeypatch.setattr(mojang_async, 'get_rename_token', get_rename_token)
+
+    tokens = session.TokenPool(session.Session('user', 'pass'), 'uuid')
+    assert run(session_async.prefetch(tokens, 2)) == 0
+    assert calls == [ 'login', 'token', 'login', 'token' ]
+    assert run(session_async.take(tokens)) is None
+
+def test_async_login_all(monkeypatch, capsys):
+    async def login(username, password):
+        return LOGIN if password == 'right' else False
+
+    monkeypatch.setattr(mojang_async, 'login', login)
+
+    users = [ accounts.Account('a@example.com', 'right', 'uuid-a'), accounts.Account('b@example.com', 'wrong', 'uuid-b'),
+              accounts.Account('c@example.com', 'right', 'uuid-c') ]
+    logged_in = run(session_async.login_all(users))
+    assert [ account.username for (account, _) in logged_in ] == [ 'a@example.com', 'c@example.com' ]
+    assert logged_in[0][1].current()['PLAY_SESSION'].value == 'abc'
+    assert 'Failed to login as b@example.com' in capsys.readouterr().out
@@ -0,0 +1,45 @@
+import json
+
+import quickscope.trace as trace
+
+def read(path):
+    with open(path) as f:
+        return [ json.loads(line) for line in f ]
+
+def test_disabled_until_configured():
+    tracer = trace.TraceWriter()
+    assert not tracer.enabled
+    tracer.emit('request', status=200)
+    assert len(tracer._queue) == 0
+
+def test_emit_and_close(tmp_path):
+    path = str(tmp_path / 'traces' / 'run.jsonl')
+    tracer = trace.TraceWriter(path, flush_interval=60)
+    assert tracer.enabled
+
+    tracer.emit('request', status=200)
+    tracer.emit('rename', attempt=1)
+    tracer.close()
+    assert not tracer.enabled
+
+    records = read(path)
+    assert [ record['event'] for record in records ] == [ 'request', 'rename' ]
+    assert records[0]['status'] == 200
+    assert records[1]['host'] == trace.HOSTNAME
+
+def test_configure_appends(tmp_path):
+    path = str(tmp_path / 'run.jsonl')
+    tracer = trace.TraceWriter(path)
+    tracer.emit('first')
+    tracer.configure(path)
+    tracer.emit('second')
+    tracer.flush()
+
+    assert [ record['event'] for record in read(path) ] == [ 'first', 'second' ]
+    tracer.close()
+
+def test_wall():
+    tracer = trace.TraceWriter()
+    (wall, perf) = tracer._anchor
+    assert tracer.wall(None) is None
+    assert abs(tracer.wall(perf + 1.5) - (wall + 1.5)) < 1e-9